@@ -1,6 +1,7 @@
 const Users = require("../models/users");
 const otpService = require("../services/otpService");
 const authService = require("../services/authService");
+const aiService = require("../services/aiService");
 const bcrypt = require("bcrypt");
 const { checkRateLimit } = require("../utils/rateLimit");
 
@@ -32,7 +33,7 @@ module.exports = {
 
       const hashedPassword = await bcrypt.hash(payload.password, 10);
 
-      await Users.create({
+      const user = await Users.create({
         fullName: payload.fullName,
         email,
         password: hashedPassword,
@@ -40,6 +41,7 @@ module.exports = {
         authProvider: "local",
         accountStatus: "active",
       });
+      aiService.notifyUserChanged(user._id).catch(() => {});
 
       res.json({ message: "Register success. Redirect to login" });
     } catch (err) {
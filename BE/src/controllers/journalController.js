@@ -17,7 +17,7 @@ module.exports = {
 
       if (data?._id && data.text) {
         aiService
-          .syncEntry(data._id, req.user.id, data.text, "add")
+          .syncEntry(data._id, req.user.id, data.text, "add", data.created_at)
           .catch(console.error);
       }
 
@@ -87,7 +87,7 @@ module.exports = {
 
       if (data?._id && data.text) {
         aiService
-          .syncEntry(data._id, req.user.id, data.text, "update")
+          .syncEntry(data._id, req.user.id, data.text, "update", data.created_at)
           .catch(console.error);
       }
 
@@ -99,12 +99,12 @@ module.exports = {
 
   delete: async (req, res) => {
     try {
-      await journalService.softDelete({
+      const journal = await journalService.softDelete({
         id: req.params.id,
         userId: req.user.id,
       });
 
-      aiService.deleteEntry(req.params.id, req.user.id).catch((err) => {
+      aiService.deleteEntry(req.params.id, req.user.id, journal.created_at).catch((err) => {
         console.error("Delete from vector store failed:", err);
       });
 
@@ -123,7 +123,7 @@ module.exports = {
 
       if (data && data._id && data.text) {
         aiService
-          .syncEntry(data._id, req.user.id, data.text, "add")
+          .syncEntry(data._id, req.user.id, data.text, "add", data.created_at)
           .catch((err) => {
             console.error("Sync to vector store failed for restore:", err);
           });
@@ -137,12 +137,12 @@ module.exports = {
 
   permanentDelete: async (req, res) => {
     try {
-      await journalService.permanentDelete({
+      const journal = await journalService.permanentDelete({
         id: req.params.id,
         userId: req.user.id,
       });
 
-      aiService.deleteEntry(req.params.id, req.user.id).catch((err) => {
+      aiService.deleteEntry(req.params.id, req.user.id, journal.created_at).catch((err) => {
         console.error(
           "Delete from vector store failed for permanent delete:",
           err
@@ -184,6 +184,11 @@ module.exports = {
         { new: true, upsert: true, runValidators: true }
       );
 
+      // Invalidate cached AI trend analysis + update risk detector - non-blocking
+      aiService
+        .notifyDataChanged(userId, "checkin", { date: today, mood: Number(mood) })
+        .catch(() => {});
+
       // Trigger instant AI insight/tip - non-blocking
       (async () => {
         try {
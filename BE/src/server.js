@@ -3,8 +3,11 @@ const { server } = require("./app");
 const connectDB = require("./config/db");
 const { initSchedulers } = require("./utils/scheduler");
 
+const aiChatChannel = require("./services/aiChatChannel");
+
 connectDB();
 initSchedulers();
+aiChatChannel.connect();
 
 require('./services/scheduler');
 
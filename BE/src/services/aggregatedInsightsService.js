@@ -31,6 +31,54 @@ class AggregatedInsightsService {
     }
   }
 
+  /**
+   * Cập nhật daily cube bên Python service
+   * mode = 'dirty' (incremental) | 'nightly'
+   */
+  async refreshCube(mode = 'dirty', days = null) {
+    const response = await axios.post(
+      `${AI_SERVICE_URL}/api/v1/admin/analytics/aggregated/cube/refresh`,
+      null,
+      {
+        params: days ? { mode, days } : { mode },
+        headers: { 'X-API-Key': AI_SERVICE_API_KEY },
+        timeout: 120000
+      }
+    );
+    return response.data;
+  }
+
+  /**
+   * Job hằng ngày cho bảng chiều user -> nhóm tuổi
+   */
+  async refreshUserDimensions(full = false) {
+    const response = await axios.post(
+      `${AI_SERVICE_URL}/api/v1/admin/analytics/aggregated/dimensions/refresh`,
+      null,
+      {
+        params: { full },
+        headers: { 'X-API-Key': AI_SERVICE_API_KEY },
+        timeout: 120000
+      }
+    );
+    return response.data;
+  }
+
+  /**
+   * Làm nóng cache các preset dashboard (last_7/30/90_days x nhóm tuổi)
+   */
+  async warmCache() {
+    const response = await axios.post(
+      `${AI_SERVICE_URL}/api/v1/admin/analytics/aggregated/cache/warm`,
+      null,
+      {
+        headers: { 'X-API-Key': AI_SERVICE_API_KEY },
+        timeout: 300000
+      }
+    );
+    return response.data;
+  }
+
   /**
    * Tạo basic stats khi Python service không khả dụng (fallback)
    */
@@ -0,0 +1,156 @@
+const WebSocket = require('ws');
+
+/**
+ * Kết nối WebSocket lâu dài tới AI service (/api/v1/chat/ws), một kết nối cho mỗi BE worker.
+ * Nhiều phiên chat được multiplex trên cùng kết nối, mỗi request có id riêng;
+ * session_state / user_context chỉ gửi lần đầu mỗi phiên (AI service nhớ theo kết nối).
+ */
+class AIChatChannel {
+    constructor(config = {}) {
+        const baseURL = config.baseURL || process.env.AI_SERVICE_URL || 'http://localhost:8000';
+        this.url = baseURL.replace(/^http/, 'ws') + '/api/v1/chat/ws';
+        this.apiKey = config.apiKey || process.env.AI_SERVICE_API_KEY;
+        this.requestTimeout = config.requestTimeout || 60000;
+        this.chatDeadlineMs = config.chatDeadlineMs || Number(process.env.AI_CHAT_DEADLINE_MS) || 10000;
+
+        this.ws = null;
+        this.pending = new Map();      // id -> { resolve, reject, onFrame, timer, sessionId }
+        this.primed = new Set();       // sessionId đã gửi context trên kết nối hiện tại
+        this.nextId = 1;
+        this.reconnectDelay = 1000;
+        this.closed = false;
+    }
+
+    connect() {
+        if (this.ws || this.closed) return;
+
+        const ws = new WebSocket(this.url, { headers: { 'X-API-Key': this.apiKey } });
+        this.ws = ws;
+
+        ws.on('open', () => {
+            console.log('AI chat channel connected');
+            this.reconnectDelay = 1000;
+        });
+        ws.on('message', (data) => this._onMessage(data));
+        ws.on('close', () => this._onClose());
+        ws.on('error', (error) => {
+            console.error('AI chat channel error:', error.message);
+        });
+    }
+
+    isOpen() {
+        return Boolean(this.ws && this.ws.readyState === WebSocket.OPEN);
+    }
+
+    isPrimed(sessionId) {
+        return this.isOpen() && this.primed.has(String(sessionId));
+    }
+
+    /**
+     * Gửi một message chat; onFrame nhận frame meta/token, Promise resolve với frame final
+     * (cùng shape với processChatMessage). sessionState / userContext có thể null nếu phiên đã primed;
+     * recentMessages chỉ dùng khi AI service không có bộ nhớ phiên.
+     */
+    sendMessage(sessionId, text, sessionState = null, userContext = null, recentMessages = null, onFrame = () => {}) {
+        if (!this.isOpen()) {
+            return Promise.reject(new Error('AI chat channel not connected'));
+        }
+
+        return new Promise((resolve, reject) => {
+            const id = String(this.nextId++);
+            const timer = setTimeout(() => {
+                this.pending.delete(id);
+                this._send({ type: 'cancel', id });
+                reject(new Error('AI chat channel request timed out'));
+            }, this.requestTimeout);
+
+            this.pending.set(id, {
+                resolve,
+                reject,
+                onFrame,
+                timer,
+                sessionId: String(sessionId)
+            });
+            this._sendChat(id, sessionId, text, sessionState, userContext, recentMessages);
+        });
+    }
+
+    forget(sessionId) {
+        this.primed.delete(String(sessionId));
+        if (this.isOpen()) this._send({ type: 'forget', session_id: String(sessionId) });
+    }
+
+    close() {
+        this.closed = true;
+        if (this.ws) this.ws.close();
+    }
+
+    _sendChat(id, sessionId, text, sessionState, userContext, recentMessages) {
+        const frame = { type: 'chat', id, session_id: String(sessionId), text, deadline_ms: this.chatDeadlineMs };
+        if (sessionState || userContext) {
+            frame.session_state = sessionState || {};
+            frame.user_context = userContext || {};
+            this.primed.add(String(sessionId));
+        }
+        if (recentMessages) frame.recent_messages = recentMessages;
+        this._send(frame);
+    }
+
+    _send(frame) {
+        try {
+            this.ws.send(JSON.stringify(frame));
+        } catch (error) {
+            console.error('AI chat channel send failed:', error.message);
+        }
+    }
+
+    _onMessage(data) {
+        let frame;
+        try {
+            frame = JSON.parse(data.toString());
+        } catch (e) {
+            return;
+        }
+
+        const request = this.pending.get(frame.id);
+        if (!request) return;
+
+        if (frame.type === 'token' || frame.type === 'meta') {
+            request.onFrame(frame);
+            return;
+        }
+
+        this.pending.delete(frame.id);
+        clearTimeout(request.timer);
+
+        if (frame.type === 'final') {
+            const { type, id, ...data } = frame;
+            request.resolve({ success: true, data });
+        } else if (frame.code === 'session_required') {
+            // AI service không còn nhớ phiên -> caller gửi lại kèm session_state / user_context
+            this.primed.delete(request.sessionId);
+            request.reject(Object.assign(new Error('session context required'), { code: 'session_required' }));
+        } else {
+            request.reject(new Error(frame.detail || 'AI chat channel error'));
+        }
+    }
+
+    _onClose() {
+        this.ws = null;
+        this.primed.clear();
+        for (const [id, request] of this.pending) {
+            clearTimeout(request.timer);
+            request.reject(new Error('AI chat channel closed'));
+            this.pending.delete(id);
+        }
+        if (this.closed) return;
+
+        console.warn(`AI chat channel closed, reconnecting in ${this.reconnectDelay}ms`);
+        setTimeout(() => this.connect(), this.reconnectDelay);
+        this.reconnectDelay = Math.min(this.reconnectDelay * 2, 30000);
+    }
+}
+
+const aiChatChannel = new AIChatChannel();
+
+module.exports = aiChatChannel;
@@ -25,6 +25,8 @@ class AIServiceClient {
         }
 
         this.timeout = config.timeout || 60000;
+        // SLA một lượt chat: AI service trả lời (LLM hoặc rule-based) trong ngân sách này
+        this.chatDeadlineMs = config.chatDeadlineMs || Number(process.env.AI_CHAT_DEADLINE_MS) || 10000;
 
         this.client = axios.create({
             baseURL: this.baseURL,
@@ -34,6 +36,10 @@ class AIServiceClient {
                 'X-API-Key': this.apiKey
             }
         });
+
+        // Kết quả trend gần nhất theo (user, days) + ETag: AI service trả 304 khi dữ liệu chưa đổi
+        this.trendCache = new Map();
+        this.trendCacheMax = Number(process.env.AI_TREND_CACHE_MAX) || 1000;
     }
 
     /**
@@ -118,6 +124,18 @@ class AIServiceClient {
         }
     }
 
+    /**
+     * Nightly batch: AI service tính sẵn daily summary cho các user có hoạt động trong ngày
+     * (mặc định là hôm qua), /summary/daily sau đó chỉ còn đọc cache.
+     */
+    async precomputeDailySummaries(date = null) {
+        const response = await this.client.post('/api/v1/summary/daily/batch', null, {
+            params: date ? { date } : {},
+            timeout: 1800000
+        });
+        return response.data;
+    }
+
     async saveDailySummary(userId, data) {
         const db = await getMongoDB();
         const collection = db.collection('daily_summaries');
@@ -150,15 +168,16 @@ class AIServiceClient {
     /**
      * UC-20: Process chat message through CBT agent
      */
-    async processChatMessage(sessionId, text, sessionState, userContext, recentMessages = []) {
+    async processChatMessage(sessionId, text, sessionState, userContext, recentMessages = null) {
         try {
             const response = await this.client.post('/api/v1/chat/process_message', {
                 text: text,
                 session_id: sessionId,
                 session_state: sessionState,
                 user_context: userContext,
-                recent_messages: recentMessages
-            });
+                recent_messages: recentMessages,
+                deadline_ms: this.chatDeadlineMs
+            }, { timeout: this.chatDeadlineMs + 2000 });
 
             return {
                 success: true,
@@ -187,6 +206,66 @@ class AIServiceClient {
         }
     }
 
+    /**
+     * UC-20 (streaming): Process chat message, relaying NDJSON frames as they arrive.
+     * onFrame nhận các frame meta/token; Promise resolve với frame final (cùng shape processChatMessage).
+     */
+    async streamChatMessage(sessionId, text, sessionState, userContext, recentMessages = null, onFrame = () => {}) {
+        const response = await this.client.post('/api/v1/chat/process_message/stream', {
+            text: text,
+            session_id: sessionId,
+            session_state: sessionState,
+            user_context: userContext,
+            recent_messages: recentMessages,
+            deadline_ms: this.chatDeadlineMs
+        }, { responseType: 'stream' });
+
+        const stream = response.data;
+        stream.setEncoding('utf8');
+
+        return new Promise((resolve, reject) => {
+            let buffer = '';
+            let final = null;
+
+            stream.on('data', (chunk) => {
+                buffer += chunk;
+                let newline;
+                while ((newline = buffer.indexOf('\n')) >= 0) {
+                    const line = buffer.slice(0, newline).trim();
+                    buffer = buffer.slice(newline + 1);
+                    if (!line) continue;
+
+                    let frame;
+                    try {
+                        frame = JSON.parse(line);
+                    } catch (e) {
+                        console.warn('Invalid chat stream frame:', line.slice(0, 100));
+                        continue;
+                    }
+
+                    if (frame.type === 'final') {
+                        const { type, ...data } = frame;
+                        final = data;
+                    } else if (frame.type === 'error') {
+                        stream.destroy();
+                        reject(new Error(frame.detail || 'AI stream error'));
+                        return;
+                    } else {
+                        onFrame(frame);
+                    }
+                }
+            });
+            stream.on('end', () => {
+                if (final) {
+                    resolve({ success: true, data: final });
+                } else {
+                    reject(new Error('Chat stream ended without final frame'));
+                }
+            });
+            stream.on('error', reject);
+        });
+    }
+
     /**
      * UC-21: Semantic search
      */
@@ -222,20 +301,38 @@ class AIServiceClient {
      */
     async analyzeEmotionalTrends(userId, days = 30) {
         try {
+            const cacheKey = `${userId}:${days}`;
+            const cached = this.trendCache.get(cacheKey);
             const response = await this.client.post('/api/v1/trends/analyze', {
                 user_id: userId,
                 days: days
-            }, { timeout: 15000 });
+            }, {
+                timeout: 15000,
+                headers: cached ? { 'If-None-Match': cached.etag } : {},
+                validateStatus: (status) => (status >= 200 && status < 300) || status === 304
+            });
+
+            let data = response.data;
+            if (response.status === 304 && cached) {
+                data = cached.data;
+            }
+            this.trendCache.delete(cacheKey);
+            if (response.headers.etag) {
+                this.trendCache.set(cacheKey, { etag: response.headers.etag, data });
+                if (this.trendCache.size > this.trendCacheMax) {
+                    this.trendCache.delete(this.trendCache.keys().next().value);
+                }
+            }
 
             return {
                 success: true,
-                moodPoints: response.data.mood_points,
-                overallTrend: response.data.overall_trend,
-                trendScore: response.data.trend_score,
-                volatility: response.data.volatility,
-                insights: response.data.insights,
-                riskFlags: response.data.risk_flags,
-                stats: response.data.stats
+                moodPoints: data.mood_points,
+                overallTrend: data.overall_trend,
+                trendScore: data.trend_score,
+                volatility: data.volatility,
+                insights: data.insights,
+                riskFlags: data.risk_flags,
+                stats: data.stats
             };
 
         } catch (error) {
@@ -395,9 +492,10 @@ class AIServiceClient {
     }
 
     /**
-     * Sync a journal entry to vector store (add/update/delete)
+     * Sync a journal entry to vector store (add/update/delete).
+     * createdAt: created_at of the entry, so the AI service re-aggregates the right day
      */
-    async syncEntry(entryId, userId, text, operation = 'add') {
+    async syncEntry(entryId, userId, text, operation = 'add', createdAt = null) {
         try {
             if (!entryId) {
                 throw new Error('entryId is required');
@@ -417,6 +515,9 @@ class AIServiceClient {
             } else {
                 params.text = String(text || '');
             }
+            if (createdAt) {
+                params.day = new Date(createdAt).toISOString().slice(0, 10);
+            }
 
             const response = await this.client.post('/api/v1/search/sync/entry', null, { params });
             return response.data;
@@ -429,8 +530,45 @@ class AIServiceClient {
     /**
      * Delete journal entry from vector store
      */
-    async deleteEntry(entryId, userId) {
-        return this.syncEntry(entryId, userId, '', 'delete');
+    async deleteEntry(entryId, userId, createdAt = null) {
+        return this.syncEntry(entryId, userId, '', 'delete', createdAt);
+    }
+
+    /**
+     * Notify AI service that user data changed (check-in / journal)
+     * so cached trend results are recomputed. When a mood or sentiment score
+     * is passed, the response carries up-to-date risk_flags (mood dip / decline streak)
+     */
+    async notifyDataChanged(userId, source = 'checkin', { date = null, mood = null, sentimentScore = null } = {}) {
+        try {
+            const response = await this.client.post('/api/v1/events/data-changed', {
+                user_id: String(userId),
+                source: source,
+                date: date,
+                mood: mood,
+                sentiment_score: sentimentScore
+            }, { timeout: 5000 });
+            return response.data;
+        } catch (error) {
+            console.error('Failed to notify data change:', error.message);
+            throw error;
+        }
+    }
+
+    /**
+     * Notify AI service that a user was created / changed (age bucket for analytics)
+     */
+    async notifyUserChanged(userId, operation = 'upsert') {
+        try {
+            const response = await this.client.post('/api/v1/events/user-changed', {
+                user_id: String(userId),
+                operation: operation
+            }, { timeout: 5000 });
+            return response.data;
+        } catch (error) {
+            console.error('Failed to notify user change:', error.message);
+            throw error;
+        }
     }
 
     /**
@@ -3,6 +3,7 @@ const bcrypt = require("bcrypt");
 const jwt = require("jsonwebtoken");
 const googleAuthService = require("./googleAuthService");
 const { applyDefaultAvatar } = require("./userService");
+const aiService = require("./aiService");
 
 const issueJwt = (user) => {
   const finalUser = applyDefaultAvatar(user);
@@ -105,6 +106,7 @@ module.exports = {
         accountStatus: "active",
         password: null,
       });
+      aiService.notifyUserChanged(user._id).catch(() => {});
 
       return issueJwt(user);
     }
@@ -1,6 +1,7 @@
 const ChatSession = require('../models/chatSession');
 const Message = require('../models/Message');
 const aiService = require('./aiService');
+const aiChatChannel = require('./aiChatChannel');
 
 class ChatService {
   async createSession(userId, moodContext = null) {
@@ -14,6 +15,7 @@ class ChatService {
   }
 
   async endSession(sessionId, summary = '') {
+    aiChatChannel.forget(sessionId);
     const session = await ChatSession.findByIdAndUpdate(
       sessionId,
       { status: 'ended', endTime: new Date(), sessionSummary: summary },
@@ -79,6 +81,21 @@ class ChatService {
     return messages;
   }
 
+  // N message cuối (trước message user vừa lưu) cho AI service khi nó không có bộ nhớ phiên (Redis)
+  async getHistoryForAI(sessionId, userText, limit = 5) {
+    const mongoose = require('mongoose');
+    const query = mongoose.Types.ObjectId.isValid(sessionId)
+      ? { sessionId: new mongoose.Types.ObjectId(sessionId) }
+      : { sessionId };
+    const messages = (await Message.find(query)
+      .sort({ timestamp: -1 })
+      .limit(limit + 1)
+      .lean()).reverse();
+    const last = messages[messages.length - 1];
+    if (last && last.sender === 'user' && last.text === String(userText || '').trim()) messages.pop();
+    return messages.slice(-limit).map(m => ({ sender: m.sender, text: m.text }));
+  }
+
   async getUserContext(userId) {
     try {
       const DailyCheckin = require('../models/dailyCheckIn');
@@ -101,24 +118,75 @@ class ChatService {
     }
   }
 
-  async processAndRespond(sessionId, userId, userText) {
+  async sendOverChannel(sessionId, userId, userText, onFrame) {
+    // Phiên đã gửi context trên kết nối hiện tại -> không cần đọc lại state/context từ Mongo
+    if (aiChatChannel.isPrimed(sessionId)) {
+      try {
+        return await aiChatChannel.sendMessage(sessionId, userText, null, null, null, onFrame);
+      } catch (error) {
+        if (error.code !== 'session_required') throw error;
+      }
+    }
+    // Gửi lại đủ context; kèm lịch sử Mongo phòng khi AI service không có bộ nhớ phiên (Redis down)
     const sessionState = await this.getSessionState(sessionId);
-    
     const userContext = await this.getUserContext(userId);
-    
-    const recentMessages = await this.getRecentMessages(sessionId, 5);
-    const formattedRecent = recentMessages.map(m => ({
-      sender: m.sender,
-      text: m.text
-    }));
+    const recentMessages = await this.getHistoryForAI(sessionId, userText);
+    return aiChatChannel.sendMessage(sessionId, userText, sessionState, userContext, recentMessages, onFrame);
+  }
 
-    const aiResult = await aiService.processChatMessage(
-      sessionId,
-      userText,
-      sessionState,
-      userContext,
-      formattedRecent
-    );
+  async processAndRespond(sessionId, userId, userText, onFrame = null) {
+    let aiResult;
+    let relayedTokens = false;
+    const relay = (frame) => {
+      if (frame.type === 'token') relayedTokens = true;
+      if (onFrame) onFrame(frame);
+    };
+
+    // 1. Kênh WebSocket lâu dài tới AI service (nếu đang kết nối)
+    if (aiChatChannel.isOpen()) {
+      try {
+        aiResult = await this.sendOverChannel(sessionId, userId, userText, relay);
+      } catch (error) {
+        console.error('AI chat channel failed:', error.message);
+        if (relayedTokens) throw error;
+      }
+    }
+
+    // 2. HTTP: streaming nếu caller relay token, ngược lại request thường
+    if (!aiResult) {
+      const sessionState = await this.getSessionState(sessionId);
+      const userContext = await this.getUserContext(userId);
+      // Lịch sử Mongo làm dự phòng: AI service ưu tiên bộ nhớ phiên trên Redis nếu còn,
+      // chỉ dùng danh sách này khi Redis không có (down / key đã hết hạn)
+      const recentMessages = await this.getHistoryForAI(sessionId, userText);
+
+      if (onFrame) {
+        // Lỗi trước token đầu tiên -> gọi bản thường
+        try {
+          aiResult = await aiService.streamChatMessage(
+            sessionId,
+            userText,
+            sessionState,
+            userContext,
+            recentMessages,
+            relay
+          );
+        } catch (error) {
+          console.error('Chat stream failed:', error.message);
+          if (relayedTokens) throw error;
+        }
+      }
+
+      if (!aiResult) {
+        aiResult = await aiService.processChatMessage(
+          sessionId,
+          userText,
+          sessionState,
+          userContext,
+          recentMessages
+        );
+      }
+    }
 
     if (!aiResult.success) {
       throw new Error(aiResult.error);
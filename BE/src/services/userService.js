@@ -72,6 +72,10 @@ module.exports = {
       "-resetPasswordToken -resetPasswordExpires -adminRecoveryCodes"
     );
     if (!user) throw new Error("User not found");
+    if (age !== undefined) {
+      // Cập nhật nhóm tuổi cho admin analytics - non-blocking
+      require("./aiService").notifyUserChanged(userId).catch(() => {});
+    }
     const userObj = applyDefaultAvatar(user);
     userObj.hasPassword = !!userObj.password;
     userObj.hasAppLockPin = !!userObj.appLockPinHash;
@@ -57,10 +57,23 @@ module.exports = (io, socket) => {
     try {
       await chatService.saveMessage(currentSessionId, 'user', text);
 
+      // Relay token ngay khi AI service stream về; 'message' cuối cùng vẫn mang bản đầy đủ
       const aiResponse = await chatService.processAndRespond(
         currentSessionId,
         currentUserId,
-        text
+        text,
+        (frame) => {
+          if (frame.type === 'meta') {
+            socket.emit('message-meta', {
+              isCrisis: frame.is_crisis,
+              riskLevel: frame.risk_level,
+              sentiment: frame.sentiment,
+              technique: frame.technique
+            });
+          } else if (frame.type === 'token') {
+            socket.emit('message-token', { text: frame.text });
+          }
+        }
       );
 
       socket.emit('message', {
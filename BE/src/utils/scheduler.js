@@ -1,5 +1,7 @@
 const cron = require("node-cron");
 const journalService = require("../services/journalService");
+const aggregatedInsightsService = require("../services/aggregatedInsightsService");
+const aiService = require("../services/aiService");
 
 /**
  * Initializes all scheduled tasks for the system.
@@ -17,6 +19,55 @@ const initSchedulers = () => {
         }
     });
 
+    // Admin analytics cube: incremental mỗi 10 phút, tính lại 3 ngày gần nhất lúc 02:00
+    cron.schedule("*/10 * * * *", async () => {
+        try {
+            await aggregatedInsightsService.refreshCube('dirty');
+        } catch (error) {
+            console.error("Scheduled task failed: Insights cube refresh", error.message);
+        }
+    });
+
+    cron.schedule("0 2 * * *", async () => {
+        try {
+            const summary = await aggregatedInsightsService.refreshCube('nightly', 3);
+            console.log(`Insights cube nightly rebuild completed: ${summary.partials} partials.`);
+        } catch (error) {
+            console.error("Scheduled task failed: Insights cube nightly rebuild", error.message);
+        }
+    });
+
+    // Làm nóng cache aggregated insights trước khi hết hạn (khớp insights_warm_interval = 15 phút)
+    cron.schedule("*/15 * * * *", async () => {
+        try {
+            const summary = await aggregatedInsightsService.warmCache();
+            if (summary.refreshed > 0) {
+                console.log(`Aggregated insights cache warmed: ${summary.refreshed} presets refreshed.`);
+            }
+        } catch (error) {
+            console.error("Scheduled task failed: Aggregated insights cache warm-up", error.message);
+        }
+    });
+
+    // Bảng chiều nhóm tuổi: re-bucket user có sinh nhật hôm nay
+    cron.schedule("5 0 * * *", async () => {
+        try {
+            await aggregatedInsightsService.refreshUserDimensions();
+        } catch (error) {
+            console.error("Scheduled task failed: User dimension refresh", error.message);
+        }
+    });
+
+    // Daily summary: tính sẵn cho ngày vừa kết thúc, lần mở đầu tiên không phải chờ LLM
+    cron.schedule("30 0 * * *", async () => {
+        try {
+            const summary = await aiService.precomputeDailySummaries();
+            console.log(`Daily summary batch completed: ${summary.generated} generated, ${summary.failed} failed.`);
+        } catch (error) {
+            console.error("Scheduled task failed: Daily summary batch", error.message);
+        }
+    });
+
     console.log("Schedulers initialized: daily at 00:00");
 };
 
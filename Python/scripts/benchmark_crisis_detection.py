@@ -0,0 +1,74 @@
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+# Add src to path
+sys.path.append(os.getcwd())
+
+from src.core.crisis_detection import ENGLISH_PATTERNS, VIETNAMESE_PATTERNS, detect_crisis
+
+def legacy_detect_crisis(text: str):
+    """Bản cũ: lowercase rồi re.search lần lượt từng pattern, hai lượt quét"""
+    text_lower = text.lower()
+    for pattern in VIETNAMESE_PATTERNS:
+        if re.search(pattern, text_lower):
+            return True, 9, "vi"
+    for pattern in ENGLISH_PATTERNS:
+        if re.search(pattern, text_lower):
+            return True, 9, "en"
+    return False, 0, ""
+
+BENIGN = [
+    "Hôm nay mình đi làm về khá mệt nhưng vẫn ổn, tối nay sẽ nghỉ ngơi sớm.",
+    "I had a long day at work and I feel a bit tired, but dinner with friends helped.",
+    "Mình cảm thấy áp lực với kỳ thi sắp tới, không biết có làm tốt không.",
+    "Today I went for a walk in the park and noticed the trees changing color.",
+    "Đôi khi mình thấy cô đơn, nhưng nói chuyện với mẹ giúp mình thấy khá hơn.",
+]
+
+CRISIS = [
+    "I want to die, there is no reason to live anymore.",
+    "Tôi muốn chết, mọi thứ thật vô nghĩa.",
+]
+
+def bench(func, texts, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            func(text)
+    return (time.perf_counter() - started) / (repeat * len(texts)) * 1e6
+
+def main(count: int, repeat: int, crisis_rate: float):
+    random.seed(0)
+    texts = []
+    for _ in range(count):
+        parts = random.choices(BENIGN, k=random.randint(1, 6))
+        if random.random() < crisis_rate:
+            parts.insert(random.randrange(len(parts) + 1), random.choice(CRISIS))
+        texts.append(" ".join(parts))
+
+    # Hai bản phải cho cùng kết luận crisis / ngôn ngữ
+    mismatches = sum(
+        1 for t in texts
+        if legacy_detect_crisis(t)[0] != detect_crisis(t)[0] or legacy_detect_crisis(t)[2] != detect_crisis(t)[2]
+    )
+
+    import logging
+    logging.disable(logging.WARNING)  # bỏ log "Crisis detected" khi đo
+    legacy = bench(legacy_detect_crisis, texts, repeat)
+    compiled = bench(detect_crisis, texts, repeat)
+    print(f"texts={count} repeat={repeat} crisis_rate={crisis_rate} mismatches={mismatches}")
+    print(f"legacy:   {legacy:8.2f} us/text")
+    print(f"compiled: {compiled:8.2f} us/text  ({legacy / compiled:.1f}x)")
+
+if __name__ == "__main__":
+    # python scripts/benchmark_crisis_detection.py --count 2000 --repeat 5
+    parser = argparse.ArgumentParser(description="Benchmark the compiled crisis detector against the legacy loop")
+    parser.add_argument("--count", type=int, default=2000, help="Number of synthetic texts")
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the corpus")
+    parser.add_argument("--crisis-rate", type=float, default=0.05, help="Share of texts containing a crisis phrase")
+    args = parser.parse_args()
+    main(args.count, args.repeat, args.crisis_rate)
@@ -0,0 +1,27 @@
+import argparse
+import asyncio
+import os
+import sys
+
+# Add src to path
+sys.path.append(os.getcwd())
+
+from src.database.mongodb import MongoDB
+from src.core.daily_summary_batch import daily_summary_batch
+
+async def main(date: str, force: bool):
+    instance = MongoDB()
+    await instance.connect()
+    try:
+        summary = await daily_summary_batch.run(date=date, force=force)
+        print(f"DAILY SUMMARY BATCH: {summary}")
+    finally:
+        await instance.disconnect()
+
+if __name__ == "__main__":
+    # Chạy hằng đêm sau 00:00 cho ngày vừa kết thúc, ví dụ: python scripts/run_daily_summary_batch.py
+    parser = argparse.ArgumentParser(description="Precompute daily summaries for users active on a given day")
+    parser.add_argument("--date", type=str, default=None, help="Day to summarize (YYYY-MM-DD), defaults to yesterday")
+    parser.add_argument("--force", action="store_true", help="Regenerate summaries that already exist")
+    args = parser.parse_args()
+    asyncio.run(main(args.date, args.force))
@@ -0,0 +1,27 @@
+import argparse
+import asyncio
+import os
+import sys
+
+# Add src to path
+sys.path.append(os.getcwd())
+
+from src.database.mongodb import MongoDB
+from src.core.mood_forecast import mood_forecast_service
+
+async def main(days: int, horizon: int):
+    instance = MongoDB()
+    await instance.connect()
+    try:
+        summary = await mood_forecast_service.run_batch(days=days, horizon=horizon)
+        print(f"FORECAST BATCH: {summary}")
+    finally:
+        await instance.disconnect()
+
+if __name__ == "__main__":
+    # Chạy hằng đêm (cron / BE scheduler), ví dụ: python scripts/run_forecast_batch.py --days 180
+    parser = argparse.ArgumentParser(description="Fit mood forecasts for all active users")
+    parser.add_argument("--days", type=int, default=None, help="History window in days")
+    parser.add_argument("--horizon", type=int, default=None, help="Forecast horizon in days")
+    args = parser.parse_args()
+    asyncio.run(main(args.days, args.horizon))
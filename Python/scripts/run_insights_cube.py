@@ -0,0 +1,37 @@
+import argparse
+import asyncio
+import os
+import sys
+
+# Add src to path
+sys.path.append(os.getcwd())
+
+from src.database.mongodb import MongoDB
+from src.database.redis_client import redis_client
+from src.core.insights_cube import insights_cube
+
+async def main(days: int, dirty: bool):
+    instance = MongoDB()
+    await instance.connect()
+    try:
+        await redis_client.connect()
+    except Exception:
+        pass  # Không có Redis vẫn chạy được chế độ nightly
+    try:
+        if dirty:
+            summary = await insights_cube.refresh_dirty()
+        else:
+            summary = await insights_cube.run_nightly(days)
+        print(f"INSIGHTS CUBE: {summary}")
+    finally:
+        await redis_client.disconnect()
+        await instance.disconnect()
+
+if __name__ == "__main__":
+    # Nightly: python scripts/run_insights_cube.py --days 3
+    # Backfill: python scripts/run_insights_cube.py --days 90
+    parser = argparse.ArgumentParser(description="Rebuild the daily cohort cube for admin analytics")
+    parser.add_argument("--days", type=int, default=None, help="Number of recent days to rebuild")
+    parser.add_argument("--dirty", action="store_true", help="Only rebuild days marked dirty by writes")
+    args = parser.parse_args()
+    asyncio.run(main(args.days, args.dirty))
@@ -0,0 +1,29 @@
+import argparse
+import asyncio
+import os
+import sys
+
+# Add src to path
+sys.path.append(os.getcwd())
+
+from src.database.mongodb import MongoDB
+from src.core.user_dimension import user_dimension
+
+async def main(full: bool):
+    instance = MongoDB()
+    await instance.connect()
+    try:
+        if full:
+            summary = {"mode": "rebuild", "users": await user_dimension.rebuild_all()}
+        else:
+            summary = await user_dimension.run_daily()
+        print(f"USER DIMENSION: {summary}")
+    finally:
+        await instance.disconnect()
+
+if __name__ == "__main__":
+    # Hằng ngày: python scripts/run_user_dimension.py ; backfill: --full
+    parser = argparse.ArgumentParser(description="Maintain the user -> age bucket dimension for analytics")
+    parser.add_argument("--full", action="store_true", help="Rebuild the whole dimension from users")
+    args = parser.parse_args()
+    asyncio.run(main(args.full))
@@ -0,0 +1,73 @@
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Add src to path
+sys.path.append(os.getcwd())
+
+from pymongo import UpdateOne
+
+from src.config import settings
+from src.database.mongodb import MongoDB
+from src.core.crisis_detection import scan_batch
+
+async def main(days: int, dry_run: bool):
+    instance = MongoDB()
+    await instance.connect()
+    try:
+        db = instance.get_db()
+        query = {"deleted_at": None}
+        if days:
+            query["created_at"] = {"$gte": datetime.utcnow() - timedelta(days=days)}
+
+        scanned, flagged, by_rule = 0, 0, {}
+        batch = []
+
+        async def flush():
+            nonlocal flagged
+            results = scan_batch(f"{e.get('title') or ''}\n{e.get('text') or ''}" for e in batch)
+            ops = []
+            for entry, result in zip(batch, results):
+                if not result:
+                    continue
+                flagged += 1
+                by_rule[result["rule"]] = by_rule.get(result["rule"], 0) + 1
+                ops.append(UpdateOne(
+                    {"_id": entry["_id"]},
+                    {"$set": {
+                        "user_id": entry.get("user_id"),
+                        "created_at": entry.get("created_at"),
+                        "rule": result["rule"],
+                        "severity": result["severity"],
+                        "language": result["language"],
+                        "scanned_at": datetime.utcnow(),
+                    }},
+                    upsert=True,
+                ))
+            if ops and not dry_run:
+                await db.journal_crisis_flags.bulk_write(ops, ordered=False)
+            batch.clear()
+
+        cursor = db.journal_entries.find(
+            query, {"user_id": 1, "title": 1, "text": 1, "created_at": 1}, batch_size=settings.insights_batch_size
+        )
+        async for entry in cursor:
+            batch.append(entry)
+            scanned += 1
+            if len(batch) >= settings.insights_batch_size:
+                await flush()
+        await flush()
+
+        print(f"CRISIS SCAN: {{'scanned': {scanned}, 'flagged': {flagged}, 'by_rule': {by_rule}, 'dry_run': {dry_run}}}")
+    finally:
+        await instance.disconnect()
+
+if __name__ == "__main__":
+    # Quét offline journal đã lưu, ví dụ: python scripts/scan_journal_crisis.py --days 30
+    parser = argparse.ArgumentParser(description="Scan stored journal entries with the crisis detector")
+    parser.add_argument("--days", type=int, default=None, help="Only entries from the last N days")
+    parser.add_argument("--dry-run", action="store_true", help="Report only, do not write journal_crisis_flags")
+    args = parser.parse_args()
+    asyncio.run(main(args.days, args.dry_run))
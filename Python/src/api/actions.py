@@ -5,6 +5,7 @@ from pydantic import BaseModel, Field
 from datetime import datetime, timedelta
 import random
 from src.database import mongodb, redis_client
+from src.core.single_flight import single_flight
 from bson import ObjectId
 import json
 
@@ -230,6 +231,11 @@ async def fetch_actions_from_new_tables(
 # -------------------- Endpoints --------------------
 @router.post("/suggest")
 async def suggest_actions(request: ActionRequest):
+    # Các request trùng (double-tap, BE retry) dùng chung một kết quả gợi ý
+    key = single_flight.make_key("actions_suggest", request.dict())
+    return await single_flight.do(key, lambda: _suggest_actions(request))
+
+async def _suggest_actions(request: ActionRequest) -> Dict[str, Any]:
     logger.info(f"Enhanced suggestion request for {request.user_id}, mood={request.current_mood}")
     try:
         db = mongodb.get_db()
@@ -1,12 +1,14 @@
+import asyncio
 import hashlib
 import json
 import logging
+from collections import Counter
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 
-import pandas as pd
 import numpy as np
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import APIKeyHeader
 from pydantic import BaseModel, Field
 from scipy import stats
@@ -14,6 +16,14 @@ from scipy import stats
 from src.database import mongodb
 from src.database.redis_client import redis_client
 from src.config import settings
+from src.core.insights_cube import (
+    insights_cube, SOURCE_COLLECTIONS, source_stages, activity_union_stages,
+    per_user_group_stages, age_group_stages, safe_avg
+)
+from src.core.single_flight import single_flight
+from src.core.user_dimension import user_dimension
+from src.core.active_users import active_user_counter
+from src.utils.helpers import pearson_from_moments, gather_with_deadline
 
 router = APIRouter(tags=["Aggregated Insights"])
 logger = logging.getLogger(__name__)
@@ -34,6 +44,7 @@ class InsightRequest(BaseModel):
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
     segments: SegmentFilter = Field(default_factory=SegmentFilter)
+    exact_active_users: bool = False  # đếm chính xác thay vì HyperLogLog (audit)
 
 class ExecutiveSummary(BaseModel):
     total_active_users: int
@@ -62,18 +73,23 @@ class InsightResponse(BaseModel):
     usage_patterns: UsagePatterns
     demographic_trends: DemographicTrends
     generated_at: datetime
+    metadata: Optional[Dict[str, Any]] = None  # nguồn dữ liệu, thời gian từng pipeline (cho ops)
 
 # ---- Helper functions ----
 def generate_cache_key(request: InsightRequest) -> str:
     """Tạo cache key duy nhất dựa trên request."""
     unique_str = (
         f"{request.date_range}:{request.start_date}:{request.end_date}:"
-        f"{json.dumps(request.segments.dict(), sort_keys=True)}"
+        f"{json.dumps(request.segments.dict(), sort_keys=True)}:{request.exact_active_users}"
     )
     return f"insights:{hashlib.md5(unique_str.encode()).hexdigest()}"
 
-async def get_cached_result(key: str) -> Optional[InsightResponse]:
-    if not redis_client:
+async def get_cached_result(key: str) -> Optional[tuple]:
+    """
+    Đọc cache stale-while-revalidate.
+    Trả về (response, is_stale) hoặc None nếu chưa có.
+    """
+    if not redis_client.client:
         return None
 
     try:
@@ -81,269 +97,290 @@ async def get_cached_result(key: str) -> Optional[InsightResponse]:
         if not cached:
             return None
 
-        if isinstance(cached, (dict, list)):
-            return InsightResponse.parse_obj(cached)
+        if isinstance(cached, dict) and "response" in cached:
+            age = datetime.utcnow().timestamp() - cached.get("cached_at", 0)
+            return InsightResponse.parse_obj(cached["response"]), age > settings.insights_cache_fresh_ttl
 
+        # Định dạng cũ (chỉ có response) -> coi như stale để được làm mới
+        if isinstance(cached, dict):
+            return InsightResponse.parse_obj(cached), True
         if isinstance(cached, str):
-            return InsightResponse.parse_raw(cached)
+            return InsightResponse.parse_raw(cached), True
 
         return None
     except Exception as e:
         logger.error(f"Cache read failed: {e}")
         return None
 
-async def set_cached_result(key: str, result: InsightResponse, ttl: int = 3600):
-    if not redis_client:
+async def set_cached_result(key: str, result: InsightResponse):
+    """Lưu kèm thời điểm tính; giữ lâu hơn TTL fresh để còn phục vụ bản stale"""
+    if not redis_client.client:
         return
 
     try:
-        await redis_client.set(key, result.json(), expire=ttl)
+        await redis_client.set(key, {
+            "cached_at": datetime.utcnow().timestamp(),
+            "response": jsonable_encoder(result),
+        }, expire=settings.insights_cache_stale_ttl)
     except Exception as e:
         logger.error(f"Cache write failed: {e}")
 
+# Giữ reference tới các task làm mới nền để không bị GC giữa chừng
+_refresh_tasks: set = set()
+
+async def refresh_cached_result(request: InsightRequest, key: str) -> bool:
+    """Tính lại và ghi cache dưới Redis lock - chỉ một worker làm mới mỗi key"""
+    token = await redis_client.acquire_lock(f"{key}:refresh", settings.insights_refresh_lock_ttl)
+    if not token:
+        return False
+    try:
+        response = await compute_insights(request)
+        await set_cached_result(key, response)
+        return True
+    except Exception as e:
+        logger.error(f"Background refresh failed for {key}: {e}", exc_info=True)
+        return False
+    finally:
+        await redis_client.release_lock(f"{key}:refresh", token)
+
+def schedule_refresh(request: InsightRequest, key: str):
+    task = asyncio.create_task(refresh_cached_result(request, key))
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
 # ---- Data Fetching (MongoDB) ----
-async def fetch_aggregated_data(start: datetime, end: datetime, segments: SegmentFilter) -> dict:
+def _segment_stages(segments: SegmentFilter, with_age: bool = False) -> List[dict]:
+    """Join nhóm tuổi (user_dimensions) + lọc segment trên server (bỏ qua join nếu không cần)"""
+    filtered = bool(segments.age_group and segments.age_group != "all")
+    stages = age_group_stages() if (filtered or with_age) else []
+    if filtered:
+        stages.append({"$match": {"age_group": segments.age_group}})
+    return stages
+
+def build_journal_pipeline(start: datetime, end: datetime, segments: SegmentFilter) -> List[dict]:
     """
-    Lấy dữ liệu tổng hợp, ẩn danh từ các collection.
-    Trả về dict chứa total_users, users_data (list of dict), start, end, segments.
+    Journal theo user: số journal, sentiment trung bình, nhóm tuổi, đếm nhãn sentiment.
+    Mỗi dòng kết quả là một user ẩn danh (không trả uid về Python).
     """
+    return (
+        source_stages("journal", start, end)
+        + per_user_group_stages()
+        + _segment_stages(segments, with_age=True)
+        + [{"$project": {
+            "_id": 0,
+            "journal_count": 1,
+            "avg_mood_score": safe_avg("$score_sum", "$score_n"),
+            "age_group": 1,
+            "labels": 1,
+        }}]
+    )
+
+def build_source_totals_pipeline(kind: str, start: datetime, end: datetime, segments: SegmentFilter) -> List[dict]:
+    """Check-in / chat: chỉ cần tổng (số user, số bản ghi, đếm nhãn) - tính hết trên server"""
+    return (
+        source_stages(kind, start, end)
+        + per_user_group_stages()
+        + _segment_stages(segments)
+        + [{"$facet": {
+            "totals": [{"$group": {
+                "_id": None,
+                "users": {"$sum": 1},
+                "count": {"$sum": f"${kind}_count"},
+            }}],
+            "labels": [
+                {"$unwind": "$labels"},
+                {"$match": {"labels.label": {"$ne": None}}},
+                {"$group": {"_id": "$labels.label", "n": {"$sum": "$labels.n"}}},
+            ],
+        }}]
+    )
+
+def _aggregate(collection: str, pipeline: List[dict], **kwargs):
+    """aggregate với giới hạn thời gian phía server khớp deadline của request"""
     db = mongodb.get_db()
+    return db[collection].aggregate(
+        pipeline,
+        allowDiskUse=True,
+        maxTimeMS=int(settings.insights_query_timeout * 1000),
+        **kwargs
+    )
 
-    # 1. Lấy thông tin user: map user_id -> age_group
-    pipeline_users = [
-        {
-            "$match": {
-                "$or": [
-                    {"createdAt": {"$lte": end}},
-                    {"created_at": {"$lte": end}},
-                    {"createdAt": {"$exists": False}, "created_at": {"$exists": False}},
-                ]
-            }
-        },
-        {
-            "$project": {
-                "_id": 1,
-                "computed_age": {
-                    "$let": {
-                        "vars": {
-                            "dob": {"$ifNull": ["$dateOfBirth", "$date_of_birth"]}
-                        },
-                        "in": {
-                            "$cond": {
-                                "if": {"$ifNull": ["$$dob", False]},
-                                "then": {
-                                    "$floor": {
-                                        "$divide": [
-                                            {"$subtract": [end, "$$dob"]},
-                                            365 * 24 * 60 * 60 * 1000,
-                                        ]
-                                    }
-                                },
-                                "else": None,
-                            }
-                        },
-                    }
-                },
-                "age": {"$ifNull": ["$age", "$computed_age"]},
-            }
+async def fetch_journal_columns(start: datetime, end: datetime, segments: SegmentFilter) -> dict:
+    """Stream kết quả theo batch, gom thẳng thành các cột numpy (không tạo DataFrame/list of dict)"""
+    journal_counts: List[float] = []
+    moods: List[float] = []
+    age_groups: List[str] = []
+    labels = Counter()
+
+    cursor = _aggregate(
+        SOURCE_COLLECTIONS["journal"], build_journal_pipeline(start, end, segments),
+        batchSize=settings.insights_batch_size
+    )
+    async for row in cursor:
+        journal_counts.append(float(row.get("journal_count", 0)))
+        mood = row.get("avg_mood_score")
+        moods.append(np.nan if mood is None else float(mood))
+        age_groups.append(row.get("age_group", "unknown"))
+        for item in row.get("labels", []):
+            if item.get("label") is not None:
+                labels[str(item["label"])] += item["n"]
+
+    return {
+        "users": len(age_groups),
+        "count": int(sum(journal_counts)),
+        "columns": {
+            "journal_count": np.asarray(journal_counts, dtype=float),
+            "avg_mood_score": np.asarray(moods, dtype=float),
         },
-    ]
-
-    users_list = await db.users.aggregate(pipeline_users).to_list(length=None)
-    user_age_map = {}
-    for u in users_list:
-        uid = str(u["_id"])
-        age = u.get("age")
-        if age is not None:
-            if age < 18:
-                age_group = "0-17"
-            elif age < 25:
-                age_group = "18-24"
-            elif age < 35:
-                age_group = "25-34"
-            elif age < 50:
-                age_group = "35-49"
-            else:
-                age_group = "50+"
-        else:
-            age_group = "unknown"
-        user_age_map[uid] = age_group
-
-    # 2. Journal entries: tổng hợp theo user
-    pipeline_journal = [
-        {"$match": {
-            "created_at": {"$gte": start, "$lte": end},
-            "deleted_at": None
-        }},
-        {"$group": {
-            "_id": "$user_id",
-            "journal_count": {"$sum": 1},
-            "avg_mood_score": {"$avg": "$sentiment.score"},  
-            "sentiments": {"$push": "$sentiment.sentiment"}
-        }},
-        {"$project": {
-            "user_id": "$_id",
-            "journal_count": 1,
-            "avg_mood_score": 1,
-            "sentiments": 1,
-            "_id": 0
-        }}
-    ]
-    journal_stats = await db.journal_entries.aggregate(pipeline_journal).to_list(length=None)
-
-    # 3. Daily checkins
-    pipeline_checkin = [
-        {"$match": {"date": {"$gte": start, "$lte": end}}},
-        {"$group": {
-            "_id": "$user_id",
-            "checkin_count": {"$sum": 1},
-            "avg_energy": {"$avg": "$energy"},
-            "moods": {"$push": "$mood"}
-        }},
-        {"$project": {
-            "user_id": "$_id",
-            "checkin_count": 1,
-            "avg_energy": 1,
-            "moods": 1,
-            "_id": 0
-        }}
-    ]
-    checkin_stats = await db.dailycheckins.aggregate(pipeline_checkin).to_list(length=None)
-
-    # 4. Chat sessions
-    pipeline_chat = [
-        {"$match": {"start_time": {"$gte": start, "$lte": end}}},
-        {"$group": {
-            "_id": "$user_id",
-            "chat_count": {"$sum": 1},
-            "avg_risk": {"$avg": "$risk_level"}
-        }},
-        {"$project": {
-            "user_id": "$_id",
-            "chat_count": 1,
-            "avg_risk": 1,
-            "_id": 0
-        }}
-    ]
-    chat_stats = await db.chat_sessions.aggregate(pipeline_chat).to_list(length=None)
-
-    # 5. Chuyển thành DataFrame
-    df_journal = pd.DataFrame(journal_stats)
-    df_checkin = pd.DataFrame(checkin_stats)
-    df_chat = pd.DataFrame(chat_stats)
-
-    # Đặt tên cột chung là 'uid' để merge
-    for df in (df_journal, df_checkin, df_chat):
-        if not df.empty:
-            df.rename(columns={"user_id": "uid"}, inplace=True)
-
-    # Merge dần các DataFrame
-    df = pd.DataFrame()
-    if not df_journal.empty:
-        df = df_journal
-    if not df_checkin.empty:
-        if df.empty:
-            df = df_checkin
-        else:
-            df = df.merge(df_checkin, on="uid", how="outer")
-    if not df_chat.empty:
-        if df.empty:
-            df = df_chat
-        else:
-            df = df.merge(df_chat, on="uid", how="outer")
-
-    if df.empty:
-        return {"total_users": 0, "users_data": []}
-
-    df.fillna(0, inplace=True)
-
-    # Thêm nhóm tuổi
-    df["age_group"] = df["uid"].apply(lambda uid: user_age_map.get(str(uid), "unknown"))
-
-    # Áp dụng bộ lọc segment
-    if segments.age_group and segments.age_group != "all":
-        df = df[df["age_group"] == segments.age_group]
-
-    # Loại bỏ uid để ẩn danh
-    users_data = df.drop(columns=["uid"]).to_dict(orient="records")
+        "age_groups": np.asarray(age_groups, dtype=object),
+        "labels": dict(labels),
+    }
+
+async def fetch_source_totals(kind: str, start: datetime, end: datetime, segments: SegmentFilter) -> dict:
+    cursor = _aggregate(SOURCE_COLLECTIONS[kind], build_source_totals_pipeline(kind, start, end, segments))
+    facet = (await cursor.to_list(length=1) or [{"totals": [], "labels": []}])[0]
+    totals = facet["totals"][0] if facet["totals"] else {}
+    return {
+        "users": totals.get("users", 0),
+        "count": totals.get("count", 0),
+        "labels": {str(row["_id"]): row["n"] for row in facet["labels"]},
+    }
+
+async def count_active_users(start: datetime, end: datetime, segments: SegmentFilter) -> int:
+    """Số user active (distinct) trong khoảng - chỉ trả về một con số, không trả từng dòng user"""
+    pipeline = (
+        activity_union_stages(start, end)
+        + [{"$group": {"_id": "$uid"}}]
+        + _segment_stages(segments)
+        + [{"$count": "n"}]
+    )
+    result = await _aggregate(SOURCE_COLLECTIONS["journal"], pipeline).to_list(length=1)
+    return result[0]["n"] if result else 0
+
+async def resolve_active_users(
+    start: datetime,
+    end: datetime,
+    segments: SegmentFilter,
+    exact: bool = False
+) -> Dict[str, Any]:
+    """
+    Số user active: ước lượng HyperLogLog O(số ngày) nếu sketch phủ khoảng ngày,
+    ngược lại (hoặc khi exact=True để audit) đếm chính xác bằng pipeline.
+    """
+    if not exact and settings.active_users_mode == "hll":
+        sketch = await active_user_counter.count(start, end, segments.age_group)
+        if sketch is not None:
+            return {"count": sketch["estimate"], "method": "hll", "standard_error": sketch["standard_error"]}
+    return {"count": await count_active_users(start, end, segments), "method": "exact", "standard_error": 0.0}
+
+async def fetch_aggregated_data(
+    start: datetime,
+    end: datetime,
+    segments: SegmentFilter,
+    active_users: Optional[Dict[str, Any]] = None,
+    exact_active_users: bool = False
+) -> dict:
+    """
+    Chạy song song các pipeline độc lập (journal, check-in, chat, distinct users) với
+    giới hạn song song và deadline chung. Nguồn nào chậm/lỗi thì bị bỏ qua và được
+    ghi vào metadata (kết quả partial).
+    Trả về dict chứa total_users, columns, age_groups, label_counts, total_interactions, metadata.
+    """
+    factories = {
+        "journal": lambda: fetch_journal_columns(start, end, segments),
+        "checkin": lambda: fetch_source_totals("checkin", start, end, segments),
+        "chat": lambda: fetch_source_totals("chat", start, end, segments),
+    }
+    if active_users is None:
+        factories["active_users"] = lambda: resolve_active_users(start, end, segments, exact_active_users)
+
+    results, timings, errors = await gather_with_deadline(
+        factories,
+        timeout=settings.insights_query_timeout,
+        limit=settings.insights_max_concurrency
+    )
+    for name, error in errors.items():
+        logger.warning(f"Aggregated insights sub-query '{name}' failed: {error}")
+
+    journal = results.get("journal") or {
+        "users": 0, "count": 0, "labels": {},
+        "columns": {"journal_count": np.array([]), "avg_mood_score": np.array([])},
+        "age_groups": np.array([], dtype=object),
+    }
+    sources = [results[k] for k in ("journal", "checkin", "chat") if k in results]
+
+    if active_users is None:
+        active_users = results.get("active_users")
+    if active_users is None:
+        # Không có distinct count -> cận dưới từ nguồn lớn nhất
+        active_users = {
+            "count": max((s["users"] for s in sources), default=0),
+            "method": "lower_bound",
+            "standard_error": None,
+        }
 
     return {
-        "total_users": len(df),
-        "users_data": users_data,
+        "total_users": active_users["count"],
+        "columns": journal["columns"],
+        "age_groups": journal["age_groups"],
+        "label_counts": {
+            "journal": journal["labels"],
+            "checkin": results.get("checkin", {}).get("labels", {}),
+        },
+        "total_interactions": int(sum(s["count"] for s in sources)),
         "start": start,
         "end": end,
-        "segments": segments.dict()
+        "segments": segments.dict(),
+        "metadata": {
+            "source": "live",
+            "partial": bool(errors),
+            "failed": errors,
+            "timings_ms": timings,
+            "active_users_method": active_users["method"],
+            "active_users_standard_error": active_users["standard_error"],
+        },
     }
 
 # ---- Analysis Functions ----
 async def perform_analysis(data: dict) -> InsightResponse:
-    """Thực hiện phân tích dữ liệu đã được tổng hợp."""
-    df = pd.DataFrame(data["users_data"])
+    """Thực hiện phân tích trên các cột numpy đã được tổng hợp."""
+    cols = data["columns"]
     total_users = data["total_users"]
-
-    def safe_sum(column: str) -> int:
-        if column not in df.columns:
-            return 0
-        try:
-            return int(pd.to_numeric(df[column], errors="coerce").fillna(0).sum())
-        except Exception:
-            return int(df[column].fillna(0).sum())
+    mood = cols["avg_mood_score"]
+    has_mood = ~np.isnan(mood)
 
     # 1. Executive Summary
-    avg_mood = None
-    if "avg_mood_score" in df.columns and not df["avg_mood_score"].isna().all():
-        avg_mood = df["avg_mood_score"].mean()
-
-    total_interactions = int(
-        safe_sum("journal_count") +
-        safe_sum("checkin_count") +
-        safe_sum("chat_count")
-    )
+    avg_mood = float(mood[has_mood].mean()) if has_mood.any() else None
 
     exec_summary = ExecutiveSummary(
         total_active_users=total_users,
-        average_mood=round(avg_mood, 3) if avg_mood else None,
-        total_interactions=total_interactions,
+        average_mood=round(avg_mood, 3) if avg_mood is not None else None,
+        total_interactions=data["total_interactions"],
         date_range={
             "start": data["start"].isoformat(),
             "end": data["end"].isoformat()
         }
     )
 
-    # 2. Correlation Insights
+    # 2. Correlation Insights (chỉ trên user có sentiment journal)
     correlation_insights = []
-    if "journal_count" in df.columns and "avg_mood_score" in df.columns:
-        sub = df[["journal_count", "avg_mood_score"]].dropna()
-        if len(sub) >= 10:  # BR-41-04
-            corr, p_value = stats.pearsonr(sub["journal_count"], sub["avg_mood_score"])
-            if p_value < 0.05 and abs(corr) > 0.2:  # Ngưỡng thống kê
-                direction = "tích cực" if corr > 0 else "tiêu cực"
-                correlation_insights.append(CorrelationInsight(
-                    title="Tương quan giữa số lần journal và mood",
-                    description=(
-                        f"Người dùng journal nhiều có xu hướng mood {direction} hơn. "
-                        f"(r={corr:.2f}, p={p_value:.3f})"
-                    ),
-                    correlation_coefficient=round(corr, 3),
-                    p_value=round(p_value, 4)
-                ))
-
-    # 3. Usage Patterns
-    mood_dist = {}
-    # Từ sentiments trong journal
-    if "sentiments" in df.columns:
-        all_sentiments = []
-        for s_list in df["sentiments"].dropna():
-            all_sentiments.extend(s_list)
-        if all_sentiments:
-            mood_dist = pd.Series(all_sentiments).value_counts().to_dict()
-    # Fallback: từ moods trong checkin
-    if not mood_dist and "moods" in df.columns:
-        all_moods = []
-        for m_list in df["moods"].dropna():
-            all_moods.extend(m_list)
-        if all_moods:
-            mood_dist = pd.Series(all_moods).value_counts().to_dict()
+    if has_mood.sum() >= 10:  # BR-41-04
+        corr, p_value = stats.pearsonr(cols["journal_count"][has_mood], mood[has_mood])
+        if p_value < 0.05 and abs(corr) > 0.2:  # Ngưỡng thống kê
+            direction = "tích cực" if corr > 0 else "tiêu cực"
+            correlation_insights.append(CorrelationInsight(
+                title="Tương quan giữa số lần journal và mood",
+                description=(
+                    f"Người dùng journal nhiều có xu hướng mood {direction} hơn. "
+                    f"(r={corr:.2f}, p={p_value:.3f})"
+                ),
+                correlation_coefficient=round(float(corr), 3),
+                p_value=round(float(p_value), 4)
+            ))
+
+    # 3. Usage Patterns: từ sentiments trong journal, fallback moods trong checkin
+    mood_dist = data["label_counts"].get("journal") or data["label_counts"].get("checkin") or {}
+    mood_dist = dict(sorted(mood_dist.items(), key=lambda kv: kv[1], reverse=True))
 
     # Tính peak_usage_hours và most_used_features có thể bổ sung sau nếu có log chi tiết
     usage_patterns = UsagePatterns(
@@ -354,9 +391,71 @@ async def perform_analysis(data: dict) -> InsightResponse:
 
     # 4. Demographic Trends
     demo_trends = DemographicTrends()
-    if "age_group" in df.columns and "avg_mood_score" in df.columns:
-        grouped = df.groupby("age_group")["avg_mood_score"].mean().dropna()
-        demo_trends.avg_mood_by_age = grouped.round(3).to_dict()
+    ages = data["age_groups"]
+    if has_mood.any():
+        avg_by_age = {}
+        for group in np.unique(ages[has_mood]):
+            avg_by_age[str(group)] = round(float(mood[has_mood & (ages == group)].mean()), 3)
+        demo_trends.avg_mood_by_age = avg_by_age
+
+    return InsightResponse(
+        executive_summary=exec_summary,
+        correlation_insights=correlation_insights,
+        usage_patterns=usage_patterns,
+        demographic_trends=demo_trends,
+        generated_at=datetime.utcnow()
+    )
+
+def analysis_from_cube(cube: dict, total_users: int, start: datetime, end: datetime) -> InsightResponse:
+    """
+    Phân tích từ các partial của daily cube (đã cộng dồn).
+    Mood trung bình và tương quan tính trên đơn vị user-ngày.
+    """
+    totals = cube["totals"]
+
+    avg_mood = totals["mood_sum"] / totals["mood_n"] if totals["mood_n"] else None
+    exec_summary = ExecutiveSummary(
+        total_active_users=total_users,
+        average_mood=round(avg_mood, 3) if avg_mood is not None else None,
+        total_interactions=int(totals["journal_count"] + totals["checkin_count"] + totals["chat_count"]),
+        date_range={"start": start.isoformat(), "end": end.isoformat()}
+    )
+
+    correlation_insights = []
+    pearson = None
+    if totals["mood_n"] >= 10:  # BR-41-04
+        pearson = pearson_from_moments(
+            totals["mood_n"], totals["x_sum"], totals["mood_sum"],
+            totals["x_sumsq"], totals["mood_sumsq"], totals["xy_sum"]
+        )
+    if pearson:
+        corr, p_value = pearson
+        if p_value < 0.05 and abs(corr) > 0.2:  # Ngưỡng thống kê
+            direction = "tích cực" if corr > 0 else "tiêu cực"
+            correlation_insights.append(CorrelationInsight(
+                title="Tương quan giữa số lần journal và mood",
+                description=(
+                    f"Người dùng journal nhiều có xu hướng mood {direction} hơn. "
+                    f"(r={corr:.2f}, p={p_value:.3f})"
+                ),
+                correlation_coefficient=round(corr, 3),
+                p_value=round(p_value, 4)
+            ))
+
+    mood_dist = cube["sentiment_hist"] or cube["mood_hist"]
+    usage_patterns = UsagePatterns(
+        mood_distribution=dict(sorted(mood_dist.items(), key=lambda kv: kv[1], reverse=True)),
+        peak_usage_hours=None,
+        most_used_features=[]
+    )
+
+    demo_trends = DemographicTrends()
+    avg_by_age = {
+        group: round(m["mood_sum"] / m["mood_n"], 3)
+        for group, m in cube["by_age"].items() if m["mood_n"]
+    }
+    if avg_by_age:
+        demo_trends.avg_mood_by_age = avg_by_age
 
     return InsightResponse(
         executive_summary=exec_summary,
@@ -385,6 +484,103 @@ def generate_insufficient_data_response(user_count: int, start: datetime, end: d
         generated_at=datetime.utcnow()
     )
 
+def resolve_date_range(request: InsightRequest) -> tuple:
+    end = request.end_date or datetime.utcnow()
+    if request.date_range == "last_7_days":
+        start = end - timedelta(days=7)
+    elif request.date_range == "last_30_days":
+        start = end - timedelta(days=30)
+    elif request.date_range == "last_90_days":
+        start = end - timedelta(days=90)
+    elif request.date_range == "custom" and request.start_date:
+        start = request.start_date
+    else:
+        start = end - timedelta(days=30)  # mặc định
+    return start, end
+
+async def compute_insights(request: InsightRequest) -> InsightResponse:
+    """Tính insights (không qua cache)"""
+    start, end = resolve_date_range(request)
+
+    # Ưu tiên daily cube (song song với distinct count); fallback pipeline trực tiếp
+    # nếu cube chưa phủ đủ khoảng ngày
+    cube, active_users, metadata = None, None, {}
+    if settings.insights_use_cube:
+        results, timings, errors = await gather_with_deadline({
+            "cube": lambda: insights_cube.query(start, end, request.segments.age_group),
+            "active_users": lambda: resolve_active_users(
+                start, end, request.segments, request.exact_active_users
+            ),
+        }, timeout=settings.insights_query_timeout, limit=settings.insights_max_concurrency)
+        cube, active_users = results.get("cube"), results.get("active_users")
+        metadata = {"source": "cube", "partial": False, "failed": errors, "timings_ms": timings}
+        if active_users is not None:
+            metadata["active_users_method"] = active_users["method"]
+            metadata["active_users_standard_error"] = active_users["standard_error"]
+
+    if cube is not None and active_users is not None:
+        total_users = active_users["count"]
+    else:
+        data = await fetch_aggregated_data(
+            start, end, request.segments,
+            active_users=active_users, exact_active_users=request.exact_active_users
+        )
+        total_users = data["total_users"]
+        metadata = {
+            **data["metadata"],
+            "failed": {**metadata.get("failed", {}), **data["metadata"]["failed"]},
+            "timings_ms": {**metadata.get("timings_ms", {}), **data["metadata"]["timings_ms"]},
+        }
+        cube = None
+
+    # Kiểm tra đủ dữ liệu (BR-41-04)
+    if total_users < 10:
+        response = generate_insufficient_data_response(total_users, start, end)
+    elif cube is not None:
+        response = analysis_from_cube(cube, total_users, start, end)
+    else:
+        response = await perform_analysis(data)
+    response.metadata = metadata
+    return response
+
+async def _compute_and_cache(request: InsightRequest, key: str) -> dict:
+    response = await compute_insights(request)
+    await set_cached_result(key, response)
+    return jsonable_encoder(response)
+
+# Các preset dashboard admin hay mở -> được làm nóng định kỳ
+PRESET_DATE_RANGES = ["last_7_days", "last_30_days", "last_90_days"]
+PRESET_AGE_GROUPS = [None, "0-17", "18-24", "25-34", "35-49", "50+", "unknown"]
+
+async def warm_presets() -> Dict[str, Any]:
+    """Làm mới trước các preset sắp hết hạn fresh để admin không phải chờ tính lại"""
+    refreshed, skipped, failed = 0, 0, 0
+    started = datetime.utcnow()
+    for date_range in PRESET_DATE_RANGES:
+        for age_group in PRESET_AGE_GROUPS:
+            request = InsightRequest(date_range=date_range, segments=SegmentFilter(age_group=age_group))
+            key = generate_cache_key(request)
+            cached = await redis_client.get(key)
+            age = None
+            if isinstance(cached, dict) and "cached_at" in cached:
+                age = datetime.utcnow().timestamp() - cached["cached_at"]
+            if age is not None and age < settings.insights_cache_fresh_ttl - settings.insights_warm_interval:
+                skipped += 1
+                continue
+            if await refresh_cached_result(request, key):
+                refreshed += 1
+            else:
+                failed += 1
+
+    summary = {
+        "refreshed": refreshed,
+        "skipped": skipped,
+        "failed": failed,
+        "duration_seconds": (datetime.utcnow() - started).total_seconds(),
+    }
+    logger.info(f"Aggregated insights warm-up: {summary}")
+    return summary
+
 # ---- API Endpoint ----
 @router.post("/analyze", response_model=InsightResponse)
 async def analyze_aggregated_insights(
@@ -395,42 +591,82 @@ async def analyze_aggregated_insights(
     Phân tích dữ liệu tổng hợp ẩn danh cho admin.
     - Yêu cầu API key trong header X-API-Key (khớp với SERVICE_API_KEY trong .env)
     - Trả về insights tổng hợp, đảm bảo ẩn danh và tối thiểu 10 users mỗi segment.
+    - Cache stale-while-revalidate: bản stale được trả ngay, một worker làm mới ở nền.
     """
     try:
-        # Xác định khoảng thời gian
-        end = request.end_date or datetime.utcnow()
-        if request.date_range == "last_7_days":
-            start = end - timedelta(days=7)
-        elif request.date_range == "last_30_days":
-            start = end - timedelta(days=30)
-        elif request.date_range == "last_90_days":
-            start = end - timedelta(days=90)
-        elif request.date_range == "custom" and request.start_date:
-            start = request.start_date
-        else:
-            start = end - timedelta(days=30)  # mặc định
-
         # Kiểm tra cache
         cache_key = generate_cache_key(request)
         cached = await get_cached_result(cache_key)
         if cached:
-            logger.info(f"Cache hit for {cache_key}")
-            return cached
-
-        # Lấy dữ liệu
-        data = await fetch_aggregated_data(start, end, request.segments)
+            response, stale = cached
+            if stale:
+                logger.info(f"Stale cache hit for {cache_key}, refreshing in background")
+                schedule_refresh(request, cache_key)
+            else:
+                logger.info(f"Cache hit for {cache_key}")
+            response.metadata = {**(response.metadata or {}), "cache": "stale" if stale else "fresh"}
+            return response
 
-        # Kiểm tra đủ dữ liệu (BR-41-04)
-        if data["total_users"] < 10:
-            response = generate_insufficient_data_response(data["total_users"], start, end)
-        else:
-            response = await perform_analysis(data)
+        # Cache miss: các request giống nhau chỉ tính một lần
+        key = single_flight.make_key("insights_analyze", {"cache_key": cache_key})
+        return await single_flight.do(key, lambda: _compute_and_cache(request, cache_key))
 
-        # Lưu cache (TTL 1 giờ)
-        await set_cached_result(cache_key, response)
+    except Exception as e:
+        logger.error(f"Error in aggregated insights: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
 
-        return response
+@router.post("/cube/refresh")
+async def refresh_insights_cube(
+    mode: str = "dirty",
+    days: Optional[int] = None,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Cập nhật daily cube (gọi từ BE scheduler).
+    - mode=dirty: chỉ tính lại các ngày có dữ liệu mới (incremental)
+    - mode=nightly: tính lại `days` ngày gần nhất
+    """
+    try:
+        if mode == "nightly":
+            return await insights_cube.run_nightly(days)
+        return await insights_cube.refresh_dirty()
+    except Exception as e:
+        logger.error(f"Insights cube refresh failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.post("/dimensions/refresh")
+async def refresh_user_dimensions(full: bool = False, api_key: str = Depends(verify_api_key)):
+    """
+    Job hằng ngày cho bảng chiều user -> nhóm tuổi (gọi từ BE scheduler).
+    - full=false: re-bucket các user sinh nhật hôm nay (tự backfill nếu bảng rỗng)
+    - full=true: tính lại toàn bộ
+    """
+    try:
+        if full:
+            return {"mode": "rebuild", "users": await user_dimension.rebuild_all()}
+        return await user_dimension.run_daily()
     except Exception as e:
-        logger.error(f"Error in aggregated insights: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+        logger.error(f"User dimension refresh failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.post("/active-users/backfill")
+async def backfill_active_users(days: int = 90, api_key: str = Depends(verify_api_key)):
+    """Dựng HyperLogLog active users cho N ngày gần nhất từ Mongo (chạy một lần khi triển khai)"""
+    if not redis_client.client:
+        raise HTTPException(status_code=503, detail="Redis unavailable")
+    try:
+        return await active_user_counter.backfill(days)
+    except Exception as e:
+        logger.error(f"Active user backfill failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.post("/cache/warm")
+async def warm_insights_cache(api_key: str = Depends(verify_api_key)):
+    """Làm nóng cache các preset (last_7/30/90_days x nhóm tuổi) - gọi từ BE scheduler"""
+    if not redis_client.client:
+        raise HTTPException(status_code=503, detail="Cache unavailable")
+    try:
+        return await warm_presets()
+    except Exception as e:
+        logger.error(f"Aggregated insights warm-up failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
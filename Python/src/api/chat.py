@@ -1,7 +1,15 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Optional
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from src.config import settings
 from src.models import ChatMessageRequest, SentimentRequest, ChatMessageResponse
 from src.core.cbt_agent import cbt_agent
 from src.core.sentiment import sentiment_analyzer
+from src.core.active_users import active_user_counter
+from src.database import redis_client
 import logging
 
 router = APIRouter(tags=["CBT Chat"])
@@ -13,13 +21,183 @@ async def process_message(request: ChatMessageRequest):
             user_input=request.text,
             session_state=request.session_state,
             user_context=request.user_context,
-            conversation_history=request.recent_messages
+            conversation_history=request.recent_messages,
+            session_id=request.session_id,
+            deadline=request.deadline_ms / 1000 if request.deadline_ms else None
         )
+        user_id = request.user_context.get("userId") or request.user_context.get("user_id")
+        if user_id:
+            active_user_counter.schedule_track(user_id, "chat")
         return ChatMessageResponse(**result)
     except Exception as e:
         logging.error(f"Chat processing error: {e}")
         raise HTTPException(status_code=500, detail="AI service error")
 
+async def _chat_frames(request: ChatMessageRequest) -> AsyncIterator[dict]:
+    """Frame meta -> token... -> final (hoặc error) cho một message, dùng chung cho NDJSON và WebSocket"""
+    user_id = request.user_context.get("userId") or request.user_context.get("user_id")
+    try:
+        async for frame in cbt_agent.process_message_stream(
+            user_input=request.text,
+            session_state=request.session_state,
+            user_context=request.user_context,
+            conversation_history=request.recent_messages,
+            session_id=request.session_id,
+            deadline=request.deadline_ms / 1000 if request.deadline_ms else None
+        ):
+            if frame["type"] == "final":
+                frame = {"type": "final", **ChatMessageResponse(**frame).dict()}
+            yield frame
+        if user_id:
+            active_user_counter.schedule_track(user_id, "chat")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.error(f"Chat streaming error: {e}")
+        yield {"type": "error", "detail": "AI service error"}
+
+@router.post("/process_message/stream")
+async def process_message_stream(request: ChatMessageRequest):
+    """
+    Như /process_message nhưng trả về NDJSON (mỗi dòng một frame):
+    meta (crisis/sentiment) -> token... -> final (exercise, next_state).
+    """
+    async def lines():
+        async for frame in _chat_frames(request):
+            yield json.dumps(frame, ensure_ascii=False, default=str) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+class ChatChannel:
+    """
+    Một kết nối WebSocket lâu dài từ một BE worker, multiplex nhiều phiên chat:
+    - {"type": "chat", "id", "session_id", "text", [session_state], [user_context], [recent_messages]}
+      session_state / user_context chỉ cần gửi lần đầu mỗi phiên trên kết nối; sau đó dùng bản đã nhớ
+      (next_state / risk_level được cập nhật từ frame final)
+      recent_messages chỉ cần khi không có bộ nhớ phiên trên Redis (server trả session_required để BE gửi lại)
+    - {"type": "cancel", "id"}, {"type": "forget", "session_id"}, {"type": "ping"}
+    Server trả về các frame meta/token/final/error kèm "id" của request.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.requests: Dict[str, asyncio.Task] = {}
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, frame: dict):
+        text = json.dumps(frame, ensure_ascii=False, default=str)
+        async with self._send_lock:
+            await self.websocket.send_text(text)
+
+    def _context(self, message: dict) -> Optional[Dict[str, Any]]:
+        """Context của phiên (đã nhớ, hoặc gộp với context gửi kèm frame); chỉ lưu lại sau khi frame hợp lệ"""
+        context = self.sessions.get(message.get("session_id"))
+        if message.get("session_state") is not None or message.get("user_context") is not None:
+            context = {
+                "session_state": message.get("session_state") or (context or {}).get("session_state") or {},
+                "user_context": message.get("user_context") or (context or {}).get("user_context") or {},
+            }
+        return context
+
+    async def start_chat(self, message: dict):
+        request_id = str(message.get("id") or "")
+        session_id = message.get("session_id")
+        if not request_id or not isinstance(session_id, str) or not session_id or not message.get("text"):
+            await self.send({"type": "error", "id": request_id, "detail": "invalid request"})
+            return
+        if len(self.requests) >= settings.chat_ws_max_inflight:
+            await self.send({"type": "error", "id": request_id, "detail": "too many requests"})
+            return
+
+        context = self._context(message)
+        if context is None or (not redis_client.client and message.get("recent_messages") is None):
+            # Kết nối mới / đã quên phiên / Redis down (không có lịch sử) -> BE gửi lại kèm context và lịch sử
+            await self.send({"type": "error", "id": request_id, "code": "session_required",
+                             "detail": "session context required"})
+            return
+
+        try:
+            request = ChatMessageRequest(
+                text=message["text"],
+                session_id=session_id,
+                session_state=context["session_state"],
+                user_context=context["user_context"],
+                recent_messages=message.get("recent_messages"),
+                deadline_ms=message.get("deadline_ms"),
+            )
+        except (ValidationError, TypeError, AttributeError) as e:
+            # Frame sai chỉ làm hỏng request này, không làm rớt kết nối dùng chung
+            logging.warning(f"Invalid chat frame {request_id}: {e}")
+            await self.send({"type": "error", "id": request_id, "detail": "invalid request"})
+            return
+        self.sessions[session_id] = context
+        task = asyncio.create_task(self._run(request_id, request))
+        self.requests[request_id] = task
+        task.add_done_callback(lambda _: self.requests.pop(request_id, None))
+
+    async def _run(self, request_id: str, request: ChatMessageRequest):
+        try:
+            async for frame in _chat_frames(request):
+                if frame["type"] == "final":
+                    context = self.sessions.get(request.session_id)
+                    if context is not None:
+                        context["session_state"] = {
+                            **context["session_state"],
+                            "state": frame.get("next_state"),
+                            "riskLevel": frame.get("risk_level", 0),
+                        }
+                await self.send({**frame, "id": request_id})
+        except (WebSocketDisconnect, RuntimeError):
+            pass  # kết nối đã đóng
+
+    def cancel_all(self):
+        for task in list(self.requests.values()):
+            task.cancel()
+
+@router.websocket("/ws")
+async def chat_channel(websocket: WebSocket):
+    # Middleware HTTP không áp dụng cho WebSocket -> kiểm tra API key ở handshake
+    if websocket.headers.get(settings.api_key_header) != settings.service_api_key:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    channel = ChatChannel(websocket)
+    logging.info("Chat channel connected")
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except json.JSONDecodeError:
+                await channel.send({"type": "error", "detail": "invalid json"})
+                continue
+            if not isinstance(message, dict):
+                await channel.send({"type": "error", "detail": "invalid frame"})
+                continue
+
+            kind = message.get("type")
+            if kind == "chat":
+                await channel.start_chat(message)
+            elif kind == "cancel":
+                task = channel.requests.get(str(message.get("id")))
+                if task:
+                    task.cancel()
+            elif kind == "forget":
+                session_id = message.get("session_id")
+                if isinstance(session_id, str):
+                    channel.sessions.pop(session_id, None)
+            elif kind == "ping":
+                await channel.send({"type": "pong"})
+    except WebSocketDisconnect:
+        logging.info("Chat channel disconnected")
+    finally:
+        channel.cancel_all()
+
 @router.post("/analyze_sentiment")
 async def analyze_sentiment(request: SentimentRequest):
     try:
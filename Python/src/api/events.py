@@ -0,0 +1,73 @@
+from fastapi import APIRouter, HTTPException
+from typing import Optional, Union
+from datetime import datetime
+import logging
+from pydantic import BaseModel
+
+from src.core.data_version import data_version
+from src.core.mood_anomaly import mood_anomaly_detector
+from src.core.insights_cube import insights_cube
+from src.core.user_dimension import user_dimension
+from src.core.active_users import active_user_counter
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+class UserChangedEvent(BaseModel):
+    user_id: str
+    operation: str = "upsert"  # upsert | delete
+
+class DataChangedEvent(BaseModel):
+    user_id: str
+    source: str = "checkin"  # checkin | journal
+    date: Optional[str] = None  # YYYY-MM-DD
+    mood: Optional[Union[int, str]] = None  # mood check-in 1-5
+    sentiment_score: Optional[float] = None  # sentiment journal -1..1
+
+@router.post("/data-changed")
+async def data_changed(event: DataChangedEvent):
+    """
+    BE gọi sau khi user ghi check-in / journal.
+    Tăng data version để các cache dẫn xuất (trends, ...) được tính lại,
+    và cập nhật detector mood dip / decline streak nếu có điểm mới.
+    """
+    try:
+        version = await data_version.bump(event.user_id, event.source)
+        await insights_cube.mark_dirty(event.date)
+        await active_user_counter.track(event.user_id, event.source, event.date)
+
+        # BR-22-01 / BR-22-02 cập nhật O(1) để BE hiện risk prompt ngay lúc check-in
+        detector = None
+        if event.mood is not None or event.sentiment_score is not None:
+            detector = await mood_anomaly_detector.update(
+                event.user_id, event.date, event.mood, event.sentiment_score
+            )
+
+        return {
+            "status": "ok",
+            "data_version": version,
+            "risk_flags": detector["risk_flags"] if detector else [],
+            "detector": detector,
+            "received_at": datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Failed to handle data-changed event for {event.user_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/user-changed")
+async def user_changed(event: UserChangedEvent):
+    """BE gọi khi tạo user / sửa hồ sơ (tuổi) để cập nhật bảng chiều nhóm tuổi cho analytics"""
+    try:
+        if event.operation == "delete":
+            await user_dimension.remove_user(event.user_id)
+            dimension = None
+        else:
+            dimension = await user_dimension.upsert_user(event.user_id)
+        return {
+            "status": "ok",
+            "age_group": dimension["age_group"] if dimension else None,
+            "received_at": datetime.utcnow().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"Failed to handle user-changed event for {event.user_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -5,6 +5,10 @@ from src.database import mongodb, redis_client, vector_store
 from src.core.embeddings import embedding_service
 from src.core.sentiment import sentiment_analyzer
 from src.core.summarization import summarization_service
+from src.core.llm_clients import llm_clients
+from src.core.llm_cache import llm_cache
+from src.core.llm_health import llm_health
+from src.core.llm_scheduler import llm_scheduler
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -66,7 +70,8 @@ async def health_check():
                     "status": "connected" if vector_status else "disconnected",
                     "type": "chromadb"
                 },
-                "ai_models": ai_status
+                "ai_models": ai_status,
+                "llm_pools": llm_clients.metrics()
             }
         }
         
@@ -76,4 +81,15 @@ async def health_check():
             "status": "unhealthy",
             "timestamp": datetime.now().isoformat(),
             "error": str(e)
-        }
\ No newline at end of file
+        }
+
+@router.get("/health/llm")
+async def llm_health_table():
+    """Bảng sức khỏe provider/model LLM (circuit breaker, latency, cooldown)"""
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "models": llm_health.snapshot(),
+        "pools": llm_clients.metrics(),
+        "scheduler": llm_scheduler.metrics(),
+        "cache": llm_cache.metrics()
+    }
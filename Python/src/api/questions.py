@@ -292,7 +292,9 @@ Return ONLY this exact format, nothing else:
                 {"role": "user", "content": user_prompt}
             ],
             temperature=0.7,
-            max_tokens=400
+            max_tokens=400,
+            priority="questions",
+            cache="questions"
         )
         content = response.get("text", "")
         logger.debug(f"LLM raw response for questions: {content[:300]}")
@@ -12,6 +12,7 @@ from .sentiment import router as sentiment_router
 from .chat import router as chat_router
 from .notifications import router as notifications_router
 from .aggregated_insights import router as aggregated_router
+from .events import router as events_router
 
 router.include_router(health_router, tags=["health"])
 router.include_router(questions_router, prefix="/questions", tags=["questions"])
@@ -22,4 +23,5 @@ router.include_router(actions_router, prefix="/actions", tags=["actions"])
 router.include_router(sentiment_router, prefix="/sentiment", tags=["sentiment"])
 router.include_router(chat_router, prefix="/chat", tags=["chat"])
 router.include_router(notifications_router, prefix="/notifications", tags=["notifications"])
-router.include_router(aggregated_router, prefix="/admin/analytics/aggregated", tags=["Aggregated Insights"])
\ No newline at end of file
+router.include_router(aggregated_router, prefix="/admin/analytics/aggregated", tags=["Aggregated Insights"])
+router.include_router(events_router, prefix="/events", tags=["events"])
\ No newline at end of file
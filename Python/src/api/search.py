@@ -1,9 +1,14 @@
 from fastapi import APIRouter, HTTPException
 from typing import List, Optional
+from datetime import datetime
 import logging
 from pydantic import BaseModel
 from src.database import mongodb, vector_store
 from src.core.embeddings import embedding_service
+from src.core.data_version import data_version
+from src.core.insights_cube import insights_cube
+from src.core.active_users import active_user_counter
+from src.core.mood_anomaly import mood_anomaly_detector
 import numpy as np
 from bson import ObjectId
 import asyncio
@@ -358,8 +363,32 @@ async def reindex_all_entries():
         logger.error(f"Re-indexing failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
+async def _entry_day(entry_id: str) -> Optional[str]:
+    """Ngày (UTC, như cube) của journal khi BE không gửi kèm; None nếu không tìm thấy"""
+    try:
+        doc = await mongodb.get_db().journal_entries.find_one({"_id": ObjectId(entry_id)}, {"created_at": 1})
+    except Exception as e:
+        logger.warning(f"Could not look up day of entry {entry_id}: {e}")
+        return None
+    created_at = doc.get("created_at") if doc else None
+    return created_at.strftime("%Y-%m-%d") if isinstance(created_at, datetime) else None
+
 @router.post("/sync/entry")
-async def sync_entry(entry_id: str, user_id: str, text: str, operation: str = "add"):
+async def sync_entry(entry_id: str, user_id: str, text: str, operation: str = "add", day: Optional[str] = None):
+    # Mọi thao tác ghi journal từ BE đều đi qua đây -> đánh dấu dữ liệu user đã đổi
+    await data_version.bump(user_id, "journal")
+    # Partial của cube theo ngày tạo entry (sửa / xóa journal cũ phải tính lại đúng ngày đó, không phải hôm nay)
+    await insights_cube.mark_dirty(day or await _entry_day(entry_id))
+    if operation in ["add", "update"]:
+        await active_user_counter.track(user_id, "journal")
+    try:
+        # Sentiment journal là một nguồn điểm của detector BR-22-01 / BR-22-02
+        if operation == "add":
+            await mood_anomaly_detector.add_journal(user_id, entry_id)
+        else:
+            await mood_anomaly_detector.invalidate(user_id)
+    except Exception as e:
+        logger.warning(f"Mood detector update failed for entry {entry_id}: {e}")
     try:
         if operation in ["add", "update"]:
             embedding = embedding_service.encode([text])[0].tolist()
@@ -1,11 +1,14 @@
 from fastapi import APIRouter, HTTPException
 from typing import Optional
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
 from pydantic import BaseModel
 from src.database import mongodb
 from src.core.summarization import summarization_service
 from src.core.daily_summary_generator import DailySummaryGenerator
+from src.core.daily_summary_batch import daily_summary_batch, day_window, fetch_checkins, save_daily_summary
+from src.core.period_summary import period_summary_service
+from src.core.single_flight import single_flight
 from bson import ObjectId
 
 router = APIRouter()
@@ -22,22 +25,64 @@ class DailySummaryResponse(BaseModel):
     generated_at: datetime
     type: str
 
+def _target_date(date: Optional[str]) -> datetime:
+    if date:
+        return datetime.strptime(date, "%Y-%m-%d")
+    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
 @router.post("/daily", response_model=DailySummaryResponse)
 async def generate_daily_summary(request: DailySummaryRequest):
+    # Thường đã được nightly batch tính sẵn -> chỉ là một lần đọc daily_summaries
+    if not request.force_regenerate:
+        cached = await _cached_daily_summary(request)
+        if cached:
+            return cached
+
+    # Chưa có (ngày hiện tại, user mới...) -> sinh on-demand;
+    # các request trùng (double-tap, BE retry) chờ chung một lần gọi LLM
+    key = single_flight.make_key("summary_daily", request.dict())
+    return await single_flight.do(key, lambda: _generate_daily_summary(request))
+
+async def _cached_daily_summary(request: DailySummaryRequest) -> Optional[DailySummaryResponse]:
+    try:
+        query_ids = [request.user_id]
+        if ObjectId.is_valid(request.user_id):
+            query_ids.insert(0, ObjectId(request.user_id))
+        existing = await mongodb.get_db().daily_summaries.find_one(
+            {"user_id": {"$in": query_ids}, "date": _target_date(request.date)},
+            {"summary": 1, "metadata": 1, "generated_at": 1}
+        )
+    except Exception as e:
+        logger.warning(f"Daily summary cache read failed: {e}")
+        return None
+    if not existing:
+        return None
+    return DailySummaryResponse(
+        summary=existing["summary"],
+        metadata=existing["metadata"],
+        generated_at=existing["generated_at"],
+        type="cached"
+    )
+
+@router.post("/daily/batch")
+async def run_daily_summary_batch(date: Optional[str] = None, force: bool = False):
+    """Nightly batch tính sẵn daily summary cho user có hoạt động trong ngày (gọi từ BE scheduler)"""
+    try:
+        return await daily_summary_batch.run(date, force)
+    except Exception as e:
+        logger.error(f"Daily summary batch failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+async def _generate_daily_summary(request: DailySummaryRequest) -> DailySummaryResponse:
     try:
-        if request.date:
-            target_date = datetime.strptime(request.date, "%Y-%m-%d")
-        else:
-            target_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        target_date = _target_date(request.date)
 
         db = mongodb.get_db()
 
         # Handle Timezone: Expand search window for journals/moods if we suspect TZ mismatch
         # Journals might be saved in UTC, while user local date is target_date.
         # User local "2026-03-13" (VN) is "2026-03-12 17:00 UTC" to "2026-03-13 16:59 UTC".
-        # We broaden the window to -7h and +17h from start of day UTC.
-        start_of_day = target_date - timedelta(hours=7) # VN offset back
-        end_of_day = target_date + timedelta(hours=24 + 5) # VN offset forward + buffer
+        start_of_day, end_of_day = day_window(target_date)
 
         # Parse user_id -> ObjectId when possible (dailycheckins uses ObjectId)
         user_object_id = None
@@ -46,23 +91,6 @@ async def generate_daily_summary(request: DailySummaryRequest):
         except Exception:
             user_object_id = None
 
-        if not request.force_regenerate:
-            existing_query_ids = [request.user_id]
-            if user_object_id is not None:
-                existing_query_ids.insert(0, user_object_id)
-
-            existing = await db.daily_summaries.find_one({
-                "user_id": {"$in": existing_query_ids},
-                "date": target_date
-            })
-            if existing:
-                return DailySummaryResponse(
-                    summary=existing["summary"],
-                    metadata=existing["metadata"],
-                    generated_at=existing["generated_at"],
-                    type="cached"
-                )
-        
         # Get journal entries for the day (support ObjectId + string, and deleted_at missing/empty)
         journal_user_ids = [request.user_id]
         if user_object_id is not None:
@@ -82,26 +110,8 @@ async def generate_daily_summary(request: DailySummaryRequest):
             }).to_list(length=None)
         
         # Get mood entries for the day (DailyCheckIn schema: user(ObjectId), date(YYYY-MM-DD), energy)
-        target_date_str = target_date.strftime("%Y-%m-%d")
-        moods = []
-        if user_object_id is not None:
-            moods = await db.dailycheckins.find(
-                {"user": user_object_id, "date": target_date_str},
-                {"date": 1, "createdAt": 1, "created_at": 1, "mood": 1, "energy": 1, "user": 1}
-            ).to_list(length=None)
-
-        if not moods:
-            # Try searching with just the date string (for UTC server matching "yesterday" logic)
-            yesterday_str = (target_date - timedelta(days=1)).strftime("%Y-%m-%d")
-            tomorrow_str = (target_date + timedelta(days=1)).strftime("%Y-%m-%d")
-            
-            moods = await db.dailycheckins.find(
-                {
-                    "user": user_object_id if user_object_id else request.user_id, 
-                    "date": {"$in": [target_date_str, yesterday_str, tomorrow_str]}
-                },
-                {"date": 1, "createdAt": 1, "created_at": 1, "mood": 1, "energy": 1, "user": 1}
-            ).to_list(length=None)
+        # Cùng cách tra với nightly batch: đúng ngày, không có thì ngày trước / sau
+        moods = (await fetch_checkins(db, journal_user_ids, target_date)).get(str(journal_user_ids[0]), [])
         
         # Get Onboarding preferences
         onboarding = await db.onboardings.find_one({"user": user_object_id})
@@ -112,7 +122,8 @@ async def generate_daily_summary(request: DailySummaryRequest):
 
         # Generate summary (pass onboarding to generator if possible)
         generator = DailySummaryGenerator()
-        result = await generator.generate(request.user_id, request.date, entries, moods, onboarding)
+        result = await generator.generate(request.user_id, request.date, entries, moods, onboarding,
+                                          force=request.force_regenerate)
 
         if result["type"] == "empty_day":
             # Không lưu vào daily_summaries, chỉ trả về
@@ -123,34 +134,8 @@ async def generate_daily_summary(request: DailySummaryRequest):
                 type="empty_day"
             )
         
-        now = datetime.now()
-        summary_doc = {
-            "user_id": user_object_id if user_object_id is not None else request.user_id,
-            "date": target_date,
-            "summary": result["summary"],
-            "metadata": result["metadata"],
-            "generated_at": now,
-            "updated_at": now
-        }
-
-        await db.daily_summaries.update_one(
-            {"user_id": summary_doc["user_id"], "date": target_date},
-            {"$set": {"summary": summary_doc["summary"], "metadata": summary_doc["metadata"], "generated_at": summary_doc["generated_at"], "updated_at": summary_doc["updated_at"]}, "$setOnInsert": {"created_at": now}},
-            upsert=True
-        )
-        
-        # Store the interaction
-        await db.ai_interactions.insert_one({
-            "user_id": request.user_id,
-            "type": "daily_summary",
-            "content": {
-                "summary": result["summary"],
-                "date": target_date.isoformat(),
-                "entry_count": result["metadata"]["entry_count"],
-                "mood_count": result["metadata"]["mood_count"]
-            },
-            "created_at": now
-        })
+        # Lưu daily_summaries + ai_interactions (dùng chung với nightly batch)
+        now = await save_daily_summary(db, request.user_id, target_date, result)
         
         return DailySummaryResponse(
             summary=result["summary"],
@@ -180,58 +165,19 @@ async def generate_daily_summary(request: DailySummaryRequest):
         )
 
 @router.post("/weekly")
-async def generate_weekly_summary(user_id: str):
-    """Generate weekly summary (aggregate of 7 days)"""
+async def generate_weekly_summary(user_id: str, date: Optional[str] = None, force_regenerate: bool = False):
+    """Weekly summary (7 ngày kết thúc ở `date`), dựng từ daily_summaries + rollup theo ngày"""
+    return await _period_summary(user_id, "weekly", date, force_regenerate)
+
+@router.post("/monthly")
+async def generate_monthly_summary(user_id: str, date: Optional[str] = None, force_regenerate: bool = False):
+    """Monthly summary (30 ngày kết thúc ở `date`), cùng cách dựng với weekly"""
+    return await _period_summary(user_id, "monthly", date, force_regenerate)
+
+async def _period_summary(user_id: str, period: str, date: Optional[str], force: bool) -> dict:
     try:
-        # Get date range (last 7 days)
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=7)
-        
-        db = mongodb.get_db()
-        
-        # Get journal entries for the week
-        entries = await db.journal_entries.find({
-            "user_id": user_id,
-            "created_at": {"$gte": start_date, "$lte": end_date},
-            "deleted_at": None
-        }).to_list(length=None)
-        
-        # Get mood entries for the week
-        moods = await db.mood_entries.find({
-            "user_id": user_id,
-            "created_at": {"$gte": start_date, "$lte": end_date}
-        }).to_list(length=None)
-        
-        # Analyze weekly patterns
-        from collections import Counter
-        mood_counts = Counter([m.get('mood', 'unknown') for m in moods])
-        
-        # Generate weekly summary
-        summary = f"Weekly Review: You recorded {len(entries)} journal entries and {len(moods)} mood check-ins. "
-        
-        if mood_counts:
-            most_common_mood, count = mood_counts.most_common(1)[0]
-            summary += f"Your most common mood was '{most_common_mood}' ({count} times). "
-        
-        if entries:
-            summary += "Reflecting on your journal entries shows consistent engagement with your thoughts and feelings. "
-        
-        summary += "Keep up the good work in your self-care journey!"
-        
-        return {
-            "summary": summary,
-            "period": {
-                "start": start_date.isoformat(),
-                "end": end_date.isoformat()
-            },
-            "stats": {
-                "entry_count": len(entries),
-                "mood_count": len(moods),
-                "mood_distribution": dict(mood_counts)
-            },
-            "generated_at": datetime.now().isoformat()
-        }
-        
+        key = single_flight.make_key(f"summary_{period}", {"user_id": user_id, "date": date, "force": force})
+        return await single_flight.do(key, lambda: period_summary_service.summarize(user_id, period, date, force))
     except Exception as e:
-        logger.error(f"Failed to generate weekly summary: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        logger.error(f"Failed to generate {period} summary: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, field_validator, SecretStr
 from dotenv import load_dotenv
@@ -48,6 +48,7 @@ class Settings(BaseSettings):
     # OpenAI 
     openai_api_key: Optional[SecretStr] = Field(default=None)
     openai_model: str = Field(default="gpt-4o-mini")
+    openai_timeout: float = Field(default=12.0)
 
     # Gemini
     gemini_api_key: Optional[SecretStr] = Field(default=None)
@@ -57,6 +58,60 @@ class Settings(BaseSettings):
     )
     gemini_temperature: float = Field(default=0.7)
     gemini_max_tokens: int = Field(default=500)
+    gemini_timeout: float = Field(default=10.0)
+
+    # LLM HTTP connection pools (dùng chung cho OpenAI / Gemini)
+    llm_max_connections: int = Field(default=50)
+    llm_max_keepalive_connections: int = Field(default=20)
+    llm_keepalive_expiry: float = Field(default=60.0)
+
+    # LLM circuit breaker
+    llm_breaker_failure_threshold: int = Field(default=3)
+    llm_breaker_cooldown: float = Field(default=30.0)
+    llm_breaker_max_cooldown: float = Field(default=300.0)
+    llm_breaker_long_cooldown: float = Field(default=3600.0)  # 404 / sai key
+    llm_latency_window: int = Field(default=100)
+
+    # Hedged LLM requests (chat)
+    llm_hedging_enabled: bool = Field(default=True)
+    llm_hedge_default_delay: float = Field(default=2.0)  # khi chưa có số liệu p95
+    llm_hedge_min_delay: float = Field(default=0.5)
+    llm_hedge_max_delay: float = Field(default=4.0)
+    chat_llm_deadline: float = Field(default=9.0)  # trần cho phần LLM, sau đó dùng rule-based response
+
+    # Ngân sách thời gian (SLA) cho một lượt chat: tiền xử lý -> LLM -> rule-based
+    chat_turn_deadline: float = Field(default=10.0)
+    chat_preprocess_budget: float = Field(default=2.5)  # sentiment / embedding / bộ nhớ phiên / retrieval
+    chat_fallback_reserve: float = Field(default=0.5)  # luôn chừa lại cho rule-based + finalize
+    llm_min_attempt_time: float = Field(default=1.0)  # ngân sách còn ít hơn thì không thử thêm model
+
+    # LLM scheduler: concurrency / tokens-per-minute theo provider, hàng đợi theo lớp ưu tiên
+    llm_max_concurrency: Dict[str, int] = Field(default={"openai": 16, "gemini": 16, "default": 8})
+    llm_tpm_budget: Dict[str, int] = Field(default={"openai": 150000, "gemini": 500000})  # 0 = không giới hạn
+    llm_tpm_share: Dict[str, float] = Field(
+        default={"chat": 1.0, "summary": 0.9, "questions": 0.75, "notifications": 0.5}
+    )
+    llm_queue_timeout: Dict[str, float] = Field(
+        default={"chat": 5.0, "summary": 30.0, "questions": 8.0, "notifications": 3.0}
+    )
+    llm_max_queue: Dict[str, int] = Field(
+        default={"chat": 200, "summary": 50, "questions": 50, "notifications": 20}
+    )
+
+    # Bộ nhớ phiên chat trên Redis (cửa sổ message + tóm tắt cuộn)
+    chat_memory_window: int = Field(default=10)  # số message giữ nguyên văn
+    chat_memory_compress_batch: int = Field(default=6)  # tràn bao nhiêu message thì nén
+    chat_memory_ttl: int = Field(default=604800)
+    chat_memory_lock_ttl: int = Field(default=60)
+    chat_summary_max_chars: int = Field(default=1200)
+    chat_ws_max_inflight: int = Field(default=64)  # request đồng thời trên một kết nối WebSocket
+
+    # Cache response LLM theo nội dung prompt (opt-in theo call-site, TTL giây)
+    llm_cache_enabled: bool = Field(default=True)
+    llm_cache_max_entries: int = Field(default=2000)
+    llm_cache_ttl: Dict[str, int] = Field(
+        default={"notifications": 21600, "questions": 3600, "daily_summary": 86400}
+    )
     
     # Security
     secret_key: str
@@ -68,6 +123,50 @@ class Settings(BaseSettings):
     embedding_batch_size: int = Field(default=32)
     max_summary_length: int = Field(default=200)
     similarity_threshold: float = Field(default=0.65)
+
+    # Single-flight (gộp request trùng lặp)
+    single_flight_distributed: bool = Field(default=False)
+    single_flight_lock_ttl: int = Field(default=60)
+    single_flight_result_ttl: int = Field(default=10)
+    single_flight_wait_timeout: float = Field(default=45.0)
+    single_flight_poll_interval: float = Field(default=0.1)
+
+    # Trend cache (ETag theo data version)
+    trend_cache_ttl: int = Field(default=86400)
+
+    # Online anomaly detector (BR-22-01 / BR-22-02)
+    anomaly_ewma_alpha: float = Field(default=0.3)
+    anomaly_state_ttl: int = Field(default=90 * 86400)
+    anomaly_rebuild_days: int = Field(default=30)
+    anomaly_lock_ttl: int = Field(default=10)
+    anomaly_lock_wait_timeout: float = Field(default=3.0)
+
+    # Mood forecast (nightly batch fit)
+    forecast_horizon_days: int = Field(default=14)
+    forecast_history_days: int = Field(default=180)
+    forecast_fallback_days: int = Field(default=30)
+    forecast_min_days: int = Field(default=7)
+    forecast_prophet_min_days: int = Field(default=21)
+    forecast_workers: int = Field(default=2)
+    forecast_batch_size: int = Field(default=200)
+
+    # Daily summary (nightly batch tính sẵn vào daily_summaries)
+    daily_summary_batch_size: int = Field(default=200)  # số user mỗi lần đọc bulk
+    daily_summary_batch_concurrency: int = Field(default=4)  # số lượt sinh đồng thời (vẫn qua llm_scheduler)
+
+    # Aggregated insights (admin)
+    insights_batch_size: int = Field(default=1000)
+    insights_use_cube: bool = Field(default=True)
+    insights_cube_rebuild_days: int = Field(default=3)
+    insights_cube_max_dirty_days: int = Field(default=100)
+    insights_query_timeout: float = Field(default=20.0)  # deadline chung cho các sub-query
+    insights_max_concurrency: int = Field(default=4)
+    insights_cache_fresh_ttl: int = Field(default=3600)
+    insights_cache_stale_ttl: int = Field(default=86400)
+    insights_refresh_lock_ttl: int = Field(default=120)
+    insights_warm_interval: int = Field(default=900)  # chu kỳ BE scheduler gọi /cache/warm
+    active_users_mode: str = Field(default="hll")  # hll | exact
+    active_users_hll_ttl: int = Field(default=400 * 86400)
     
     # Paths
     models_cache_dir: str = Field(default="./models_cache")
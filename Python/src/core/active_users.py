@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from src.config import settings
+from src.database import mongodb, redis_client
+from src.core.insights_cube import SOURCE_COLLECTIONS, activity_union_stages
+from src.core.user_dimension import user_dimension
+
+logger = logging.getLogger(__name__)
+
+FEATURES = ["journal", "checkin", "chat"]
+
+# Sai số chuẩn của HyperLogLog trong Redis (16384 register)
+HLL_STANDARD_ERROR = 0.0081
+
+class ActiveUserCounter:
+    """
+    Đếm user active (distinct) xấp xỉ bằng HyperLogLog:
+    một sketch theo ngày x tính năng, và một sketch theo ngày x nhóm tuổi.
+    Đếm cho một khoảng ngày = PFCOUNT trên hợp các sketch, O(số ngày).
+    """
+
+    KEY_PREFIX = "hll:active"
+    SINCE_KEY = "hll:active:since"  # ngày đầu tiên sketch có đủ dữ liệu
+
+    def __init__(self):
+        # Giữ reference tới các task track nền để không bị GC giữa chừng
+        self._tasks: set = set()
+
+    def _feature_key(self, feature: str, day: str) -> str:
+        return f"{self.KEY_PREFIX}:{feature}:{day}"
+
+    def _age_key(self, age_group: str, day: str) -> str:
+        return f"{self.KEY_PREFIX}:age:{age_group}:{day}"
+
+    async def _age_group(self, user_id: str) -> str:
+        db = mongodb.get_db()
+        doc = await db[user_dimension.collection_name].find_one({"_id": str(user_id)}, {"age_group": 1})
+        return doc["age_group"] if doc else "unknown"
+
+    async def track(self, user_id: str, feature: str, day: Optional[str] = None):
+        """Gọi trên mỗi lần ghi (check-in, journal, chat)"""
+        if not redis_client.client or feature not in FEATURES:
+            return
+        day = (day or datetime.utcnow().strftime("%Y-%m-%d"))[:10]
+        uid = str(user_id)
+        try:
+            age_group = await self._age_group(uid)
+        except Exception:
+            age_group = "unknown"
+
+        ttl = settings.active_users_hll_ttl
+        await redis_client.pfadd(self._feature_key(feature, day), uid, expire=ttl)
+        await redis_client.pfadd(self._age_key(age_group, day), uid, expire=ttl)
+        # Hôm nay chỉ được đếm từ lúc bắt đầu track (thiếu phần đầu ngày) -> ngày đủ dữ liệu đầu tiên là ngày mai;
+        # /active-users/backfill sẽ lùi mốc này về đầu khoảng đã dựng từ Mongo
+        first_full_day = (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%d")
+        await redis_client.setnx(self.SINCE_KEY, first_full_day)
+
+    def schedule_track(self, user_id: str, feature: str, day: Optional[str] = None):
+        """track chạy nền cho hot path (chat): lookup nhóm tuổi không cộng vào thời gian trả lời"""
+        if not redis_client.client or feature not in FEATURES:
+            return
+        task = asyncio.create_task(self._safe_track(user_id, feature, day))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _safe_track(self, user_id: str, feature: str, day: Optional[str]):
+        try:
+            await self.track(user_id, feature, day)
+        except Exception as e:
+            logger.error(f"Active user tracking failed for {user_id}: {e}")
+
+    async def count(self, start: datetime, end: datetime, age_group: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Ước lượng số user active trong [start, end].
+        Trả về None nếu sketch chưa phủ khoảng ngày (caller dùng đếm chính xác).
+        """
+        if not redis_client.client:
+            return None
+        since = await redis_client.get(self.SINCE_KEY)
+        first = start.strftime("%Y-%m-%d")
+        if not since or first < str(since):
+            return None
+
+        days = [
+            (start.date() + timedelta(days=i)).isoformat()
+            for i in range((end.date() - start.date()).days + 1)
+        ]
+        if age_group and age_group != "all":
+            keys = [self._age_key(age_group, d) for d in days]
+        else:
+            keys = [self._feature_key(f, d) for d in days for f in FEATURES]
+
+        estimate = await redis_client.pfcount(*keys)
+        if estimate is None:
+            return None
+        return {"estimate": estimate, "standard_error": HLL_STANDARD_ERROR}
+
+    async def backfill(self, days: int) -> Dict[str, Any]:
+        """Dựng sketch cho N ngày gần nhất từ Mongo (một lần khi triển khai)"""
+        db = mongodb.get_db()
+        end = datetime.utcnow()
+        start = datetime.combine((end - timedelta(days=days - 1)).date(), datetime.min.time())
+        pipeline = activity_union_stages(start, end, with_day=True) + [
+            {"$group": {"_id": {"uid": "$uid", "day": "$day", "kind": "$kind"}}},
+            {"$lookup": {
+                "from": user_dimension.collection_name,
+                "localField": "_id.uid",
+                "foreignField": "_id",
+                "as": "dimension",
+            }},
+            {"$project": {
+                "_id": 0,
+                "uid": "$_id.uid",
+                "day": "$_id.day",
+                "kind": "$_id.kind",
+                "age_group": {"$ifNull": [{"$arrayElemAt": ["$dimension.age_group", 0]}, "unknown"]},
+            }},
+        ]
+
+        buffered: Dict[str, List[str]] = {}
+        added = 0
+
+        async def flush():
+            for key, uids in buffered.items():
+                await redis_client.pfadd(key, *uids, expire=settings.active_users_hll_ttl)
+            buffered.clear()
+
+        cursor = db[SOURCE_COLLECTIONS["journal"]].aggregate(
+            pipeline, allowDiskUse=True, batchSize=settings.insights_batch_size
+        )
+        async for row in cursor:
+            if not row.get("uid") or not row.get("day"):
+                continue
+            buffered.setdefault(self._feature_key(row["kind"], row["day"]), []).append(row["uid"])
+            buffered.setdefault(self._age_key(row["age_group"], row["day"]), []).append(row["uid"])
+            added += 1
+            if added % settings.insights_batch_size == 0:
+                await flush()
+        await flush()
+
+        since = start.strftime("%Y-%m-%d")
+        current = await redis_client.get(self.SINCE_KEY)
+        if current and str(current) < since:
+            since = str(current)
+        await redis_client.set(self.SINCE_KEY, since)
+        summary = {"days": days, "user_days": added, "since": since}
+        logger.info(f"Active user sketches backfilled: {summary}")
+        return summary
+
+active_user_counter = ActiveUserCounter()
@@ -1,16 +1,26 @@
 import logging
 import asyncio
 import random
-from typing import Dict, Any, Optional, List
+import time
+from typing import Dict, Any, Optional, List, AsyncIterator
 from src.core.sentiment import sentiment_analyzer
 from src.core.crisis_detection import detect_crisis, get_crisis_response
 from src.core.cbt_knowledge import cbt_kb
 from src.core.gemini_client import gemini_client
-from src.core.llm import call_llm
+from src.core.llm import call_llm, stream_llm
+from src.core.chat_memory import chat_memory
 from src.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Dùng khi sentiment không kịp trong ngân sách tiền xử lý (cùng shape với analyze_journal_entry)
+NEUTRAL_SENTIMENT = {
+    "sentiment": {"sentiment": "neutral", "score": 0.0, "confidence": 0.0, "raw": {"fallback": True}},
+    "emotions": [],
+    "overall_score": 0.0,
+    "dominant_emotion": "neutral",
+}
+
 class CBTChatAgent:
     def __init__(self):
         pass
@@ -21,16 +31,184 @@ class CBTChatAgent:
         session_state: Dict[str, Any],
         user_context: Optional[Dict[str, Any]] = None,
         conversation_history: Optional[List[Dict[str, Any]]] = None,
+        session_id: Optional[str] = None,
+        deadline: Optional[float] = None,
     ) -> Dict[str, Any]:
+        """
+        deadline (giây): ngân sách còn lại của caller cho lượt chat này (tối đa chat_turn_deadline).
+        Mỗi stage dùng một phần ngân sách; hết phần dành cho LLM thì trả lời rule-based.
+        """
+        turn_end = self._turn_end(deadline)
+        turn = await self._prepare_turn(user_input, session_state, conversation_history, session_id, turn_end)
+        if turn["crisis"]:
+            chat_memory.schedule_append(session_id, user_input, turn["crisis"]["text"])
+            return turn["crisis"]
 
-        # 1. Crisis detection
+        # 4. Generate response with LLM (Prefer OpenAI for ChatBot)
+        started = time.perf_counter()
+        response_text = None
+        llm_budget = self._llm_budget(turn_end)
+        if llm_budget > 0:
+            response_text = await self._generate_with_openai(
+                user_input,
+                turn["sentiment"],
+                user_context,
+                turn["history"],
+                turn["techniques"],
+                turn["user_message_count"],
+                turn["current_state"],
+                turn["summary"],
+                deadline=llm_budget
+            )
+        turn["timings"]["llm"] = round((time.perf_counter() - started) * 1000, 1)
+        result = self._finalize_turn(turn, user_input, session_state, response_text)
+        chat_memory.schedule_append(session_id, user_input, result["text"])
+        return result
+
+    async def process_message_stream(
+        self,
+        user_input: str,
+        session_state: Dict[str, Any],
+        user_context: Optional[Dict[str, Any]] = None,
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+        session_id: Optional[str] = None,
+        deadline: Optional[float] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Bản streaming của process_message, yield từng frame:
+        - {"type": "meta"}: crisis / sentiment / technique (có ngay trước khi gọi LLM)
+        - {"type": "token", "text"}: từng đoạn text LLM khi về tới
+        - {"type": "final"}: response đầy đủ như process_message (exercise, next_state...)
+        """
+        turn_end = self._turn_end(deadline)
+        turn = await self._prepare_turn(user_input, session_state, conversation_history, session_id, turn_end)
+        if turn["crisis"]:
+            crisis = turn["crisis"]
+            chat_memory.schedule_append(session_id, user_input, crisis["text"])
+            yield {"type": "meta", "is_crisis": True, "risk_level": crisis["risk_level"],
+                   "sentiment": None, "technique": None, "timings_ms": crisis["metadata"]["timings_ms"]}
+            yield {"type": "token", "text": crisis["text"]}
+            yield {"type": "final", **crisis}
+            return
+
+        techniques = turn["techniques"]
+        yield {
+            "type": "meta",
+            "is_crisis": False,
+            "risk_level": session_state.get("riskLevel", 0),
+            "sentiment": turn["sentiment"],
+            "technique": techniques[0]['metadata'].get('technique') if techniques else None,
+            "timings_ms": dict(turn["timings"]),
+        }
+
+        messages = self._build_messages(
+            user_input,
+            turn["sentiment"],
+            user_context,
+            turn["history"],
+            techniques,
+            turn["user_message_count"],
+            turn["current_state"],
+            turn["summary"]
+        )
+        chunks = []
+        started = time.perf_counter()
+        llm_budget = self._llm_budget(turn_end)
+        if llm_budget > 0:
+            async for chunk in stream_llm(
+                messages=messages,
+                temperature=settings.gemini_temperature,
+                first_token_deadline=llm_budget
+            ):
+                if not chunks:
+                    turn["timings"]["llm_first_token"] = round((time.perf_counter() - started) * 1000, 1)
+                chunks.append(chunk)
+                yield {"type": "token", "text": chunk}
+        turn["timings"]["llm"] = round((time.perf_counter() - started) * 1000, 1)
+
+        response_text = "".join(chunks).strip()
+        result = self._finalize_turn(turn, user_input, session_state, response_text)
+        chat_memory.schedule_append(session_id, user_input, result["text"])
+        if not response_text:
+            # LLM không trả lời -> gửi câu rule-based như một token duy nhất
+            yield {"type": "token", "text": result["text"]}
+        yield {"type": "final", **result}
+
+    @staticmethod
+    def _turn_end(deadline: Optional[float]) -> float:
+        """Mốc perf_counter mà lượt chat phải trả lời xong"""
+        budget = settings.chat_turn_deadline
+        if deadline:
+            budget = min(budget, deadline)
+        return time.perf_counter() + budget
+
+    @staticmethod
+    def _llm_budget(turn_end: float) -> float:
+        """Phần ngân sách cho LLM: phần còn lại trừ phần chừa cho rule-based, tối đa chat_llm_deadline"""
+        remaining = turn_end - time.perf_counter() - settings.chat_fallback_reserve
+        return min(settings.chat_llm_deadline, remaining)
+
+    async def _prepare_turn(
+        self,
+        user_input: str,
+        session_state: Dict[str, Any],
+        conversation_history: Optional[List[Dict[str, Any]]],
+        session_id: Optional[str] = None,
+        turn_end: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        Các bước trước khi gọi LLM, chạy theo stage đồng thời:
+        sentiment và embedding của câu (dùng chung cho retrieval) khởi động ngay trong thread,
+        trong lúc đó crisis regex + nhận diện ngôn ngữ chạy trên event loop.
+        Phát hiện crisis -> hủy các stage còn lại và trả về ngay.
+        Các stage chỉ được chờ trong chat_preprocess_budget; stage quá hạn bị bỏ qua (giá trị mặc định).
+        """
+        timings: Dict[str, float] = {}
+        skipped: List[str] = []
+        turn_started = time.perf_counter()
+        stage_end = turn_started + settings.chat_preprocess_budget
+        if turn_end is not None:
+            stage_end = min(stage_end, turn_end - settings.chat_fallback_reserve)
+
+        async def bounded(name: str, awaitable, default):
+            try:
+                return await asyncio.wait_for(awaitable, timeout=max(0.0, stage_end - time.perf_counter()))
+            except asyncio.TimeoutError:
+                logger.warning(f"Chat stage '{name}' exceeded the preprocess budget, continuing without it")
+                skipped.append(name)
+                return default
+
+        async def timed(name: str, func, *args):
+            started = time.perf_counter()
+            try:
+                return await asyncio.to_thread(func, *args)
+            finally:
+                timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+        # 1. Khởi động các stage nặng (CPU, model) song song
+        sentiment_task = asyncio.create_task(timed("sentiment", sentiment_analyzer.analyze_journal_entry, user_input))
+        embedding_task = asyncio.create_task(timed("embedding", cbt_kb.encode_query, user_input))
+        # Ưu tiên bộ nhớ phiên trên Redis (cửa sổ + tóm tắt cuộn); lịch sử BE gửi kèm chỉ là dự phòng
+        memory_task = None
+        if session_id:
+            memory_task = asyncio.create_task(chat_memory.load(session_id))
+
+        # 2. Crisis detection + language (regex, rất nhanh) trong lúc chờ
+        started = time.perf_counter()
         is_crisis, risk_level, language = detect_crisis(user_input)
+        lang = language or ("vi" if self._is_vietnamese(user_input) else "en")
+        timings["crisis"] = round((time.perf_counter() - started) * 1000, 2)
+
         if is_crisis:
-            if not language:
-                language = "vi" if self._is_vietnamese(user_input) else "en"
-                
-            return {
-                "text": get_crisis_response(language),
+            pending = [t for t in (sentiment_task, embedding_task, memory_task) if t]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            timings.pop("sentiment", None)
+            timings.pop("embedding", None)
+            timings["total"] = round((time.perf_counter() - turn_started) * 1000, 1)
+            return {"crisis": {
+                "text": get_crisis_response(lang),
                 "is_crisis": True,
                 "risk_level": risk_level,
                 "next_state": "crisis",
@@ -38,41 +216,74 @@ class CBTChatAgent:
                 "technique": None,
                 "exercise": None,
                 "intent": "crisis_response",
-            }
+                "metadata": {"timings_ms": timings},
+            }}
         
-        # 2 & 3. Sentiment analysis AND Retrieval
+        # 3. Retrieval trên embedding đã tính (chỉ còn một phép nhân ma trận)
         current_state = session_state.get("state", "initial")
+        summary = ""
+        history = conversation_history
         user_message_count = 1
-        if conversation_history:
+        memory = None
+        if memory_task:
+            memory = await bounded("memory", memory_task, {"summary": "", "messages": [], "user_messages": 0})
+            if not (memory["messages"] or memory["summary"]) and conversation_history is not None:
+                memory = None  # Redis down / phiên đã hết hạn -> dùng lịch sử BE gửi kèm
+        if memory:
+            history, summary = memory["messages"], memory["summary"]
+            user_message_count += memory["user_messages"]
+        elif conversation_history:
             user_message_count += sum(1 for msg in conversation_history if msg.get('sender') == 'user')
 
-        # Detect language early to filter techniques and select exercise
-        is_vi = self._is_vietnamese(user_input)
-        lang = "vi" if is_vi else "en"
-        
-        query = user_input
-        sentiment_task = asyncio.to_thread(sentiment_analyzer.analyze_journal_entry, user_input)
-        
+        try:
+            query_emb = await bounded("embedding", embedding_task, None)
+        except Exception as e:
+            logger.warning(f"Query embedding failed, retrieval will encode again: {e}")
+            query_emb = None
+
+        started = time.perf_counter()
         if current_state in ["initial", "assessment"]:
             # Exploration phase: fetch exploratory questions in user's language only
-            techniques_task = cbt_kb.retrieve_techniques(query=query, category="exploratory", k=3, lang=lang)
+            retrieval = cbt_kb.retrieve_techniques(
+                query=user_input, category="exploratory", k=3, lang=lang, query_emb=query_emb
+            )
         else:
             # Intervention phase: fetch all technique types in user's language  
-            techniques_task = cbt_kb.retrieve_techniques(query, k=6, lang=lang)
-            
-        # Execute both tasks concurrently
-        sentiment_result, techniques = await asyncio.gather(sentiment_task, techniques_task)
-        
-        # 4. Generate response with LLM (Prefer OpenAI for ChatBot)
-        response_text = await self._generate_with_openai(
-            user_input,
-            sentiment_result,
-            user_context,
-            conversation_history,
-            techniques,
-            user_message_count,
-            current_state
-        )
+            retrieval = cbt_kb.retrieve_techniques(user_input, k=6, lang=lang, query_emb=query_emb)
+        techniques = await bounded("retrieval", retrieval, [])
+        timings["retrieval"] = round((time.perf_counter() - started) * 1000, 2)
+
+        sentiment_result = await bounded("sentiment", sentiment_task, NEUTRAL_SENTIMENT)
+        timings["preprocess_total"] = round((time.perf_counter() - turn_started) * 1000, 1)
+        return {
+            "crisis": None,
+            "sentiment": sentiment_result,
+            "techniques": techniques,
+            "current_state": current_state,
+            "user_message_count": user_message_count,
+            "lang": lang,
+            "history": history,
+            "summary": summary,
+            "timings": timings,
+            "skipped": skipped,
+            "started": turn_started,
+        }
+
+    def _finalize_turn(
+        self,
+        turn: Dict[str, Any],
+        user_input: str,
+        session_state: Dict[str, Any],
+        response_text: Optional[str],
+    ) -> Dict[str, Any]:
+        """Các bước sau khi có text từ LLM: fallback, exercise, next state"""
+        conversation_history = turn["history"]
+        sentiment_result = turn["sentiment"]
+        techniques = turn["techniques"]
+        current_state = turn["current_state"]
+        user_message_count = turn["user_message_count"]
+        lang = turn["lang"]
+        is_crisis = False
 
         # Fallback if AI fails completely
         if not response_text:
@@ -134,6 +345,13 @@ class CBTChatAgent:
             "is_crisis": False,
             "risk_level": session_state.get("riskLevel", 0),
             "next_state": next_state,
+            "metadata": {
+                "timings_ms": {
+                    **turn["timings"],
+                    "total": round((time.perf_counter() - turn["started"]) * 1000, 1),
+                },
+                "skipped_stages": turn["skipped"],
+            },
         }
     
     async def _generate_with_openai(
@@ -144,13 +362,41 @@ class CBTChatAgent:
         history: Optional[List],
         techniques: List[Dict],
         user_message_count: int,
-        current_state: str
+        current_state: str,
+        summary: str = "",
+        deadline: Optional[float] = None
     ) -> Optional[str]:
-        """Xây dựng messages cho OpenAI (hoặc LLM chung), ưu tiên OpenAI."""
+        """Gọi LLM (ưu tiên OpenAI) với messages đã xây dựng."""
+        messages = self._build_messages(
+            user_input, sentiment, user_context, history, techniques, user_message_count, current_state, summary
+        )
+
+        # Gọi LLM qua wrapper (ưu tiên OpenAI)
+        result = await call_llm(
+            messages=messages,
+            temperature=settings.gemini_temperature,
+            hedge=True,
+            deadline=deadline or settings.chat_llm_deadline,
+            priority="chat"
+        )
+        return result.get("text")
+
+    def _build_messages(
+        self,
+        user_input: str,
+        sentiment: Dict,
+        user_context: Optional[Dict],
+        history: Optional[List],
+        techniques: List[Dict],
+        user_message_count: int,
+        current_state: str,
+        summary: str = ""
+    ) -> List[Dict[str, str]]:
+        """Xây dựng messages cho OpenAI (hoặc LLM chung)."""
         
         # 1. Tạo system instruction
         system_instruction = self._build_system_instruction(
-            sentiment, user_context, techniques, user_message_count, current_state
+            sentiment, user_context, techniques, user_message_count, current_state, summary
         )
 
         # 2. Xây dựng danh sách messages (OpenAI format)
@@ -158,22 +404,18 @@ class CBTChatAgent:
         
         # Thêm lịch sử nếu có
         if history:
-            history_len = len(history)
-            recent = history[max(0, history_len-5):history_len]
+            recent = history[-settings.chat_memory_window:]
             for msg in recent:
                 role = "user" if msg['sender'] == 'user' else "assistant"
                 messages.append({"role": role, "content": msg['text']})
         
         # Thêm input hiện tại
         messages.append({"role": "user", "content": user_input})
-
-        # 3. Gọi LLM qua wrapper (ưu tiên OpenAI)
-        result = await call_llm(messages=messages, temperature=settings.gemini_temperature)
-        return result.get("text")
+        return messages
     
     def _build_system_instruction(self, sentiment: Dict, user_context: Optional[Dict],
                                   techniques: List[Dict], user_message_count: int,
-                                  current_state: str) -> str:
+                                  current_state: str, summary: str = "") -> str:
         """Tạo system instruction cho LLM."""
         context_str = ""
         if user_context:
@@ -226,6 +468,7 @@ CBT CONSTRAINTS:
 Context:
   User sentiment: {sentiment_label} | Primary emotion: {primary_emotion}
   {f"Recent moods: {context_str}" if context_str else ""}
+  {f"Earlier in this session (summary): {summary}" if summary else ""}
 
 Respond now. Be warm, structured, and CBT-compliant."""
         return instruction
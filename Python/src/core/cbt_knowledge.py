@@ -1,18 +1,95 @@
+import hashlib
+import json
 import logging
 from typing import List, Dict, Optional
+import numpy as np
 from sentence_transformers import SentenceTransformer
 from src.database.vector_store import vector_store
+from src.core.embeddings import embedding_service
+from src.utils.helpers import masked_top_k
 from src.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Danh sách kỹ thuật CBT (Bilingual)
+SEED_DOCUMENTS = [
+    # Exploratory (English & Vietnamese)
+    "What's been going on in your mind lately?",
+    "Dạo này trong lòng bạn đang có chuyện gì thế?",
+    "How does that feeling show up in your body?",
+    "Cảm giác đó biểu hiện trong cơ thể bạn như thế nào?",
+    "Can you tell me more about what triggered this?",
+    "Bạn có thể chia sẻ thêm về điều gì đã dẫn đến cảm giác này không?",
+    "What thoughts are running through your head right now?",
+    "Những suy nghĩ nào đang chạy qua đầu bạn lúc này?",
+    "If this feeling had a shape or color, what would it be?",
+    "Nếu cảm xúc này có hình dáng hay màu sắc, nó sẽ trông như thế nào?",
+    
+    # Cognitive / Intervention (English & Vietnamese)
+    "Cognitive Restructuring: Identify automatic negative thoughts and challenge them with evidence.",
+    "Tái cấu trúc nhận thức: Xác định các suy nghĩ tiêu cực tự động và thử thách chúng bằng bằng chứng thực tế.",
+    "Behavioral Activation: Schedule one small pleasant activity today.",
+    "Kích hoạt hành vi: Lên kế hoạch cho một hoạt động nhỏ bạn yêu thích trong hôm nay.",
+    "Mindful Breathing: Inhale for 4 counts, hold for 4, exhale for 4. Repeat 5 times.",
+    "Thở chánh niệm: Hít vào 4 nhịp, giữ 4 nhịp, thở ra 4 nhịp. Lặp lại 5 lần.",
+    "Gratitude Practice: Name three things you're grateful for right now.",
+    "Thực hành lòng biết ơn: Hãy gọi tên 3 điều bạn cảm thấy biết ơn ngay lúc này.",
+    "Grounding Technique (5-4-3-2-1): Acknowledge 5 things you see, 4 you can touch, 3 you hear, 2 you smell, 1 you taste.",
+    "Kỹ thuật tiếp đất (5-4-3-2-1): Nhận diện 5 thứ bạn thấy, 4 thứ bạn chạm được, 3 âm thanh, 2 mùi hương, 1 vị giác.",
+    "Pleasant Activity Scheduling: Plan one activity you used to enjoy, even if you don't feel like it right now.",
+    "Lên lịch hoạt động thú vị: Lên kế hoạch một hoạt động bạn từng yêu thích, dù hiện tại bạn chưa thấy hứng thú lắm."
+]
+
+SEED_METADATAS = [
+    {"technique": "exploratory_question", "category": "exploratory", "lang": "en"},
+    {"technique": "exploratory_question", "category": "exploratory", "lang": "vi"},
+    {"technique": "exploratory_question", "category": "exploratory", "lang": "en"},
+    {"technique": "exploratory_question", "category": "exploratory", "lang": "vi"},
+    {"technique": "exploratory_question", "category": "exploratory", "lang": "en"},
+    {"technique": "exploratory_question", "category": "exploratory", "lang": "vi"},
+    {"technique": "exploratory_question", "category": "exploratory", "lang": "en"},
+    {"technique": "exploratory_question", "category": "exploratory", "lang": "vi"},
+    {"technique": "exploratory_question", "category": "exploratory", "lang": "en"},
+    {"technique": "exploratory_question", "category": "exploratory", "lang": "vi"},
+    {"technique": "cognitive_restructuring", "category": "cognitive", "lang": "en"},
+    {"technique": "cognitive_restructuring", "category": "cognitive", "lang": "vi"},
+    {"technique": "behavioral_activation", "category": "behavioral", "lang": "en"},
+    {"technique": "behavioral_activation", "category": "behavioral", "lang": "vi"},
+    {"technique": "breathing", "category": "grounding", "lang": "en"},
+    {"technique": "breathing", "category": "grounding", "lang": "vi"},
+    {"technique": "gratitude", "category": "positive", "lang": "en"},
+    {"technique": "gratitude", "category": "positive", "lang": "vi"},
+    {"technique": "grounding_54321", "category": "grounding", "lang": "en"},
+    {"technique": "grounding_54321", "category": "grounding", "lang": "vi"},
+    {"technique": "pleasant_activity", "category": "behavioral", "lang": "en"},
+    {"technique": "pleasant_activity", "category": "behavioral", "lang": "vi"}
+]
+
+# Đổi seed -> đổi version -> collection được seed lại khi khởi động
+SEED_VERSION = hashlib.md5(
+    json.dumps([SEED_DOCUMENTS, SEED_METADATAS], ensure_ascii=False).encode()
+).hexdigest()[:12]
+
 class CBTKnowledgeBase:    
+    """
+    Thư viện kỹ thuật CBT. Chroma là nguồn lưu trữ; khi khởi động toàn bộ thư viện (vài chục
+    documents) được nạp vào RAM thành ma trận numpy đã chuẩn hóa cùng mask theo lang/category,
+    nên mỗi lượt chat chỉ là một phép nhân ma trận + argpartition, không gọi Chroma.
+    """
+
     def __init__(self):
         self.collection_name = "cbt_techniques"
         self.embedder = None
-        self._init_embedder()
+        self._documents: List[str] = []
+        self._metadatas: List[Dict] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._masks: Dict[tuple, np.ndarray] = {}
     
     def _init_embedder(self):
+        # Dùng chung model của embedding_service nếu đã load (cùng settings.embedding_model)
+        if embedding_service.model is not None:
+            self.embedder = embedding_service.model
+            return
         try:
             self.embedder = SentenceTransformer(settings.embedding_model)
             logger.info(f"Loaded embedding model: {settings.embedding_model}")
@@ -21,72 +98,30 @@ class CBTKnowledgeBase:
             raise
     
     async def ensure_collection(self):
-        """Đảm bảo collection tồn tại, nếu chưa có thì seed dữ liệu"""
-        stats = vector_store.get_stats(self.collection_name)
-        if not stats.get("exists") or stats.get("document_count", 0) == 0:
+        """Đảm bảo collection tồn tại và đúng phiên bản seed, rồi nạp vào bộ nhớ"""
+        if self.embedder is None:
+            self._init_embedder()
+
+        data = await vector_store.get_all(self.collection_name)
+        versions = {(m or {}).get("seed_version") for m in data.get("metadatas") or []}
+        if not data.get("ids") or versions != {SEED_VERSION}:
+            if data.get("ids"):
+                logger.info("CBT seed changed, re-seeding collection")
+                await vector_store.reset_collection(self.collection_name)
             await self._seed_initial_data()
+            data = await vector_store.get_all(self.collection_name)
+
+        self._load_index(data.get("documents") or [], data.get("metadatas") or [], data.get("embeddings"))
     
     async def _seed_initial_data(self):
         logger.info("Seeding initial CBT data...")
-        
-        # Danh sách kỹ thuật CBT (Bilingual)
-        documents = [
-            # Exploratory (English & Vietnamese)
-            "What's been going on in your mind lately?",
-            "Dạo này trong lòng bạn đang có chuyện gì thế?",
-            "How does that feeling show up in your body?",
-            "Cảm giác đó biểu hiện trong cơ thể bạn như thế nào?",
-            "Can you tell me more about what triggered this?",
-            "Bạn có thể chia sẻ thêm về điều gì đã dẫn đến cảm giác này không?",
-            "What thoughts are running through your head right now?",
-            "Những suy nghĩ nào đang chạy qua đầu bạn lúc này?",
-            "If this feeling had a shape or color, what would it be?",
-            "Nếu cảm xúc này có hình dáng hay màu sắc, nó sẽ trông như thế nào?",
-            
-            # Cognitive / Intervention (English & Vietnamese)
-            "Cognitive Restructuring: Identify automatic negative thoughts and challenge them with evidence.",
-            "Tái cấu trúc nhận thức: Xác định các suy nghĩ tiêu cực tự động và thử thách chúng bằng bằng chứng thực tế.",
-            "Behavioral Activation: Schedule one small pleasant activity today.",
-            "Kích hoạt hành vi: Lên kế hoạch cho một hoạt động nhỏ bạn yêu thích trong hôm nay.",
-            "Mindful Breathing: Inhale for 4 counts, hold for 4, exhale for 4. Repeat 5 times.",
-            "Thở chánh niệm: Hít vào 4 nhịp, giữ 4 nhịp, thở ra 4 nhịp. Lặp lại 5 lần.",
-            "Gratitude Practice: Name three things you're grateful for right now.",
-            "Thực hành lòng biết ơn: Hãy gọi tên 3 điều bạn cảm thấy biết ơn ngay lúc này.",
-            "Grounding Technique (5-4-3-2-1): Acknowledge 5 things you see, 4 you can touch, 3 you hear, 2 you smell, 1 you taste.",
-            "Kỹ thuật tiếp đất (5-4-3-2-1): Nhận diện 5 thứ bạn thấy, 4 thứ bạn chạm được, 3 âm thanh, 2 mùi hương, 1 vị giác.",
-            "Pleasant Activity Scheduling: Plan one activity you used to enjoy, even if you don't feel like it right now.",
-            "Lên lịch hoạt động thú vị: Lên kế hoạch một hoạt động bạn từng yêu thích, dù hiện tại bạn chưa thấy hứng thú lắm."
-        ]
-        
-        metadatas = [
-            {"technique": "exploratory_question", "category": "exploratory", "lang": "en"},
-            {"technique": "exploratory_question", "category": "exploratory", "lang": "vi"},
-            {"technique": "exploratory_question", "category": "exploratory", "lang": "en"},
-            {"technique": "exploratory_question", "category": "exploratory", "lang": "vi"},
-            {"technique": "exploratory_question", "category": "exploratory", "lang": "en"},
-            {"technique": "exploratory_question", "category": "exploratory", "lang": "vi"},
-            {"technique": "exploratory_question", "category": "exploratory", "lang": "en"},
-            {"technique": "exploratory_question", "category": "exploratory", "lang": "vi"},
-            {"technique": "exploratory_question", "category": "exploratory", "lang": "en"},
-            {"technique": "exploratory_question", "category": "exploratory", "lang": "vi"},
-            {"technique": "cognitive_restructuring", "category": "cognitive", "lang": "en"},
-            {"technique": "cognitive_restructuring", "category": "cognitive", "lang": "vi"},
-            {"technique": "behavioral_activation", "category": "behavioral", "lang": "en"},
-            {"technique": "behavioral_activation", "category": "behavioral", "lang": "vi"},
-            {"technique": "breathing", "category": "grounding", "lang": "en"},
-            {"technique": "breathing", "category": "grounding", "lang": "vi"},
-            {"technique": "gratitude", "category": "positive", "lang": "en"},
-            {"technique": "gratitude", "category": "positive", "lang": "vi"},
-            {"technique": "grounding_54321", "category": "grounding", "lang": "en"},
-            {"technique": "grounding_54321", "category": "grounding", "lang": "vi"},
-            {"technique": "pleasant_activity", "category": "behavioral", "lang": "en"},
-            {"technique": "pleasant_activity", "category": "behavioral", "lang": "vi"}
-        ]
+        documents = SEED_DOCUMENTS
+        metadatas = [{**meta, "seed_version": SEED_VERSION} for meta in SEED_METADATAS]
         
         ids = [f"cbt_{i}" for i in range(len(documents))]
         
         # Tạo embeddings
-        embeddings = self.embedder.encode(documents).tolist()
+        embeddings = self.embedder.encode(documents, normalize_embeddings=True).tolist()
         
         # Thêm vào vector store
         await vector_store.add_documents(
@@ -98,14 +133,74 @@ class CBTKnowledgeBase:
         )
         logger.info(f"Seeded {len(documents)} CBT documents")
     
+    def _load_index(self, documents: List[str], metadatas: List[Dict], embeddings) -> None:
+        """Ma trận embedding đã chuẩn hóa + mask boolean cho mọi tổ hợp (lang, category)"""
+        if embeddings is None or len(documents) == 0:
+            logger.warning("CBT library is empty, retrieval will use the vector store")
+            self._matrix = None
+            return
+
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._matrix = matrix / np.where(norms == 0, 1.0, norms)
+        self._documents = list(documents)
+        self._metadatas = [dict(m or {}) for m in metadatas]
+
+        langs = np.array([m.get("lang") for m in self._metadatas], dtype=object)
+        categories = np.array([m.get("category") for m in self._metadatas], dtype=object)
+        self._masks = {}
+        for lang in set(langs) | {None}:
+            for category in set(categories) | {None}:
+                mask = np.ones(len(documents), dtype=bool)
+                if lang is not None:
+                    mask &= langs == lang
+                if category is not None:
+                    mask &= categories == category
+                self._masks[(lang, category)] = mask
+        logger.info(f"CBT library loaded in memory: {len(documents)} techniques")
+
+    def encode_query(self, query: str) -> np.ndarray:
+        """Embedding đã chuẩn hóa của câu truy vấn (blocking, gọi qua to_thread)"""
+        if self.embedder is None:
+            self._init_embedder()
+        return np.asarray(self.embedder.encode(query, normalize_embeddings=True), dtype=np.float32)
+
     async def retrieve_techniques(
+        self,
+        query: str,
+        category: Optional[str] = None,
+        k: int = 3,
+        lang: Optional[str] = None,
+        query_emb: Optional[np.ndarray] = None
+    ) -> List[Dict]:
+        """Truy vấn các kỹ thuật CBT phù hợp (query_emb: embedding đã tính sẵn từ encode_query)"""
+        if self._matrix is None:
+            return await self._retrieve_from_store(query, category, k, lang)
+
+        mask = self._masks.get((lang, category))
+        if mask is None:
+            return []  # lang/category không có trong thư viện
+        if query_emb is None:
+            query_emb = self.encode_query(query)
+        return [
+            {
+                "text": self._documents[i],
+                "metadata": self._metadatas[i],
+                "score": score
+            }
+            for i, score in masked_top_k(self._matrix, query_emb, mask, k)
+        ]
+
+    async def _retrieve_from_store(
         self,
         query: str,
         category: Optional[str] = None,
         k: int = 3,
         lang: Optional[str] = None
     ) -> List[Dict]:
-        """Truy vấn các kỹ thuật CBT phù hợp"""
+        """Truy vấn trực tiếp Chroma (khi thư viện chưa nạp được vào bộ nhớ)"""
+        if self.embedder is None:
+            self._init_embedder()
         # Tạo embedding cho query
         query_emb = self.embedder.encode(query).tolist()
         
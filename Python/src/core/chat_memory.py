@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from src.config import settings
+from src.database import redis_client
+from src.core.llm import call_llm
+from src.utils.helpers import truncate_text
+
+logger = logging.getLogger(__name__)
+
+class ChatMemory:
+    """
+    Bộ nhớ phiên chat phía server (Redis, theo session_id):
+    - list các message gần nhất (cửa sổ cố định)
+    - tóm tắt cuộn (rolling summary) của phần hội thoại đã ra khỏi cửa sổ
+    Prompt luôn có kích thước giới hạn dù phiên chat dài bao nhiêu; lịch sử BE gửi kèm chỉ dùng khi Redis không có.
+    """
+
+    KEY_PREFIX = "chat:session"
+
+    def __init__(self):
+        # Giữ reference tới các task cập nhật nền để không bị GC giữa chừng
+        self._tasks: set = set()
+
+    def _messages_key(self, session_id: str) -> str:
+        return f"{self.KEY_PREFIX}:{session_id}:messages"
+
+    def _meta_key(self, session_id: str) -> str:
+        return f"{self.KEY_PREFIX}:{session_id}:meta"
+
+    async def load(self, session_id: str) -> Dict[str, Any]:
+        """{summary, messages (cửa sổ gần nhất), user_messages (tổng số message của user)}"""
+        empty = {"summary": "", "messages": [], "user_messages": 0}
+        if not redis_client.client or not session_id:
+            return empty
+        messages = await redis_client.lrange(self._messages_key(session_id), -settings.chat_memory_window, -1)
+        meta = await redis_client.hgetall(self._meta_key(session_id))
+        return {
+            "summary": meta.get("summary", ""),
+            "messages": [m for m in messages if isinstance(m, dict)],
+            "user_messages": int(meta.get("user_messages", 0) or 0),
+        }
+
+    async def append_turn(self, session_id: str, user_text: str, bot_text: str):
+        """Ghi một lượt chat; nén phần tràn khỏi cửa sổ khi đủ một batch"""
+        ttl = settings.chat_memory_ttl
+        length = await redis_client.rpush(
+            self._messages_key(session_id),
+            {"sender": "user", "text": user_text},
+            {"sender": "bot", "text": bot_text},
+            expire=ttl,
+        )
+        await redis_client.hincrby(self._meta_key(session_id), "user_messages", 1, expire=ttl)
+        if length > settings.chat_memory_window + settings.chat_memory_compress_batch:
+            await self.compress(session_id)
+
+    def schedule_append(self, session_id: Optional[str], user_text: str, bot_text: str):
+        """Cập nhật bộ nhớ sau khi đã trả lời user (không chặn response)"""
+        if not session_id or not redis_client.client or not bot_text:
+            return
+        task = asyncio.create_task(self._safe_append(session_id, user_text, bot_text))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _safe_append(self, session_id: str, user_text: str, bot_text: str):
+        try:
+            await self.append_turn(session_id, user_text, bot_text)
+        except Exception as e:
+            logger.error(f"Chat memory update failed for {session_id}: {e}")
+
+    async def compress(self, session_id: str) -> bool:
+        """Gộp các message tràn khỏi cửa sổ vào tóm tắt cuộn (một worker mỗi session)"""
+        lock_key = f"{self.KEY_PREFIX}:{session_id}:compress"
+        token = await redis_client.acquire_lock(lock_key, settings.chat_memory_lock_ttl)
+        if not token:
+            return False
+        try:
+            key = self._messages_key(session_id)
+            messages = await redis_client.lrange(key, 0, -1)
+            overflow = len(messages) - settings.chat_memory_window
+            if overflow <= 0:
+                return False
+
+            meta = await redis_client.hgetall(self._meta_key(session_id))
+            summary = await self._summarize(meta.get("summary", ""), messages[:overflow])
+            await redis_client.hset(self._meta_key(session_id), {"summary": summary})
+            # Chỉ cắt đúng phần đã tóm tắt ở đầu list (message mới có thể vừa được thêm vào cuối)
+            await redis_client.ltrim(key, overflow, -1)
+            return True
+        finally:
+            await redis_client.release_lock(lock_key, token)
+
+    async def _summarize(self, summary: str, messages: List[Dict[str, Any]]) -> str:
+        transcript = "\n".join(
+            f"{'User' if m.get('sender') == 'user' else 'Assistant'}: {m.get('text', '')}"
+            for m in messages if isinstance(m, dict)
+        )
+        max_chars = settings.chat_summary_max_chars
+        prompt = (
+            f"Current summary of the conversation:\n{summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}\n\n"
+            f"Update the summary to include the new messages. Keep the user's key feelings, situations, "
+            f"thoughts discussed and any techniques already tried. Write in the conversation's language, "
+            f"at most {max_chars} characters, plain text."
+        )
+        result = await call_llm(
+            [
+                {"role": "system", "content": "You maintain a concise running summary of a CBT support conversation."},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.3,
+            max_tokens=max_chars // 3,
+            priority="summary",
+        )
+        text = (result.get("text") or "").strip()
+        if not text:
+            # LLM không có -> nối thô rồi cắt, vẫn giữ được kích thước giới hạn
+            text = f"{summary}\n{transcript}".strip()
+            return truncate_text(text[-max_chars * 2:], max_chars)
+        return truncate_text(text, max_chars)
+
+    async def clear(self, session_id: str):
+        await redis_client.delete(self._messages_key(session_id), self._meta_key(session_id))
+
+chat_memory = ChatMemory()
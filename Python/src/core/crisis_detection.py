@@ -1,47 +1,93 @@
 import re
-from typing import Tuple
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
-VIETNAMESE_PATTERNS = [
-    r"(tôi|mình|em)\s+(không muốn sống|muốn chết|tự tử|tự sát)",
-    r"buông xuôi",
-    r"kết thúc cuộc đời",
-    r"chết đi",
-    r"không còn muốn sống",
-    r"tự tử",
-    r"tự sát",
+# (tên rule, pattern, mức độ nghiêm trọng 1-10)
+VIETNAMESE_RULES = [
+    ("vi_self_intent", r"(tôi|mình|em)\s+(không muốn sống|muốn chết|tự tử|tự sát)", 10),
+    ("vi_give_up", r"buông xuôi", 8),
+    ("vi_end_life", r"kết thúc cuộc đời", 10),
+    ("vi_die", r"chết đi", 9),
+    ("vi_no_will_to_live", r"không còn muốn sống", 10),
+    ("vi_suicide", r"tự tử", 9),
+    ("vi_suicide_alt", r"tự sát", 9),
 ]
 
-ENGLISH_PATTERNS = [
-    r"\b(kill|end|take)\s+(myself|my life|my own life)\b",
-    r"\b(commit|attempt)\s+suicide\b",
-    r"\bwant\s+to\s+die\b",
-    r"\bbetter\s+off\s+dead\b",
-    r"\bno\s+reason\s+to\s+live\b",
-    r"\bharm\s+myself\b",
-    r"\bsuicidal\b",
-    r"\bcut(\s+myself)?\b",
-    r"\bhang\s+myself\b",
-    r"\boverdose\b",
+ENGLISH_RULES = [
+    ("en_kill_self", r"\b(kill|end|take)\s+(myself|my life|my own life)\b", 10),
+    ("en_suicide_act", r"\b(commit|attempt)\s+suicide\b", 10),
+    ("en_want_die", r"\bwant\s+to\s+die\b", 9),
+    ("en_better_dead", r"\bbetter\s+off\s+dead\b", 9),
+    ("en_no_reason", r"\bno\s+reason\s+to\s+live\b", 9),
+    ("en_self_harm", r"\bharm\s+myself\b", 8),
+    ("en_suicidal", r"\bsuicidal\b", 9),
+    ("en_cut", r"\bcut(\s+myself)?\b", 7),
+    ("en_hang", r"\bhang\s+myself\b", 10),
+    ("en_overdose", r"\boverdose\b", 8),
 ]
 
+# Giữ tên cũ cho code đang import danh sách pattern
+VIETNAMESE_PATTERNS = [pattern for _, pattern, _ in VIETNAMESE_RULES]
+ENGLISH_PATTERNS = [pattern for _, pattern, _ in ENGLISH_RULES]
 
-def detect_crisis(text: str) -> Tuple[bool, int, str]:
-    text_lower = text.lower()
+def _compile(rules: List[Tuple[str, str, int]]) -> Tuple["re.Pattern", List[Tuple[str, "re.Pattern", int]]]:
+    """
+    Gộp các rule thành một regex alternation (non-capturing, để sre còn tối ưu được khi quét).
+    Chỉ khi có khớp mới dò lại rule nào đã khớp tại vị trí đó (alternation chọn nhánh đầu tiên khớp).
+    """
+    combined = re.compile("|".join(f"(?:{pattern})" for _, pattern, _ in rules))
+    compiled = [(name, re.compile(pattern), severity) for name, pattern, severity in rules]
+    return combined, compiled
+
+def _rule_at(rules: List[Tuple[str, "re.Pattern", int]], text: str, pos: int) -> Tuple[str, int]:
+    for name, pattern, severity in rules:
+        if pattern.match(text, pos):
+            return name, severity
+    return rules[0][0], rules[0][2]
+
+# Tiếng Việt được kiểm tra trước (giữ thứ tự ưu tiên cũ)
+_MATCHERS = [
+    ("vi", *_compile(VIETNAMESE_RULES)),
+    ("en", *_compile(ENGLISH_RULES)),
+]
 
-    for pattern in VIETNAMESE_PATTERNS:
-        if re.search(pattern, text_lower):
-            logger.warning(f"Crisis detected (VI): '{pattern}' in '{text[:50]}...'")
-            return True, 9, "vi"
+def normalize_text(text: str) -> str:
+    """NFC (dấu tiếng Việt dạng tổ hợp -> dựng sẵn) + lowercase, để pattern khớp bất kể bộ gõ"""
+    return unicodedata.normalize("NFC", text or "").lower()
 
-    for pattern in ENGLISH_PATTERNS:
-        if re.search(pattern, text_lower):
-            logger.warning(f"Crisis detected (EN): '{pattern}' in '{text[:50]}...'")
-            return True, 9, "en"
+def scan_crisis(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Quét một lần mỗi ngôn ngữ bằng regex đã compile.
+    Trả về rule nặng nhất của ngôn ngữ đầu tiên có khớp: {rule, severity, language, match}, hoặc None.
+    """
+    normalized = normalize_text(text)
+    for language, matcher, rules in _MATCHERS:
+        best = None
+        for match in matcher.finditer(normalized):
+            rule, severity = _rule_at(rules, normalized, match.start())
+            if best is None or severity > best["severity"]:
+                best = {"rule": rule, "severity": severity, "language": language, "match": match.group(0)}
+        if best:
+            return best
+    return None
 
-    return False, 0, ""
+def scan_batch(texts: Iterable[str]) -> List[Optional[Dict[str, Any]]]:
+    """scan_crisis cho nhiều văn bản (quét offline journal đã lưu)"""
+    return [scan_crisis(text) for text in texts]
+
+def detect_crisis(text: str) -> Tuple[bool, int, str]:
+    result = scan_crisis(text)
+    if not result:
+        return False, 0, ""
+
+    logger.warning(
+        f"Crisis detected ({result['language'].upper()}): rule '{result['rule']}' "
+        f"severity {result['severity']} in '{text[:50]}...'"
+    )
+    return True, result["severity"], result["language"]
 
 
 def get_crisis_response(language: str) -> str:
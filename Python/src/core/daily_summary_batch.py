@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+
+from src.config import settings
+from src.database import mongodb
+from src.core.daily_summary_generator import DailySummaryGenerator
+
+logger = logging.getLogger(__name__)
+
+CHECKIN_PROJECTION = {"date": 1, "createdAt": 1, "created_at": 1, "mood": 1, "energy": 1, "user": 1}
+
+def day_window(target_date: datetime) -> Tuple[datetime, datetime]:
+    """
+    Khung thời gian tìm journal của một ngày: journal lưu theo UTC, ngày của user theo giờ VN,
+    nên mở rộng -7h / +29h quanh 00:00 của target_date.
+    """
+    return target_date - timedelta(hours=7), target_date + timedelta(hours=24 + 5)
+
+async def fetch_checkins(db, user_ids: List[Any], target_date: datetime) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Check-in của target_date cho nhiều user, gom theo str(user id).
+    User không có check-in đúng ngày -> thử ngày trước / sau (date string do server UTC ghi có thể lệch một ngày).
+    """
+    target_str = target_date.strftime("%Y-%m-%d")
+    moods: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    async for checkin in db.dailycheckins.find({"user": {"$in": user_ids}, "date": target_str}, CHECKIN_PROJECTION):
+        moods[str(checkin["user"])].append(checkin)
+
+    missing = [u for u in user_ids if str(u) not in moods]
+    if missing:
+        nearby = [(target_date - timedelta(days=1)).strftime("%Y-%m-%d"),
+                  (target_date + timedelta(days=1)).strftime("%Y-%m-%d")]
+        async for checkin in db.dailycheckins.find({"user": {"$in": missing}, "date": {"$in": nearby}},
+                                                   CHECKIN_PROJECTION):
+            moods[str(checkin["user"])].append(checkin)
+    return moods
+
+def summary_user_id(user_id: Any) -> Any:
+    """user_id lưu trong daily_summaries: ObjectId nếu hợp lệ, ngược lại giữ string"""
+    try:
+        return ObjectId(str(user_id))
+    except Exception:
+        return str(user_id)
+
+async def save_daily_summary(db, user_id: str, target_date: datetime, result: Dict[str, Any]) -> datetime:
+    """Upsert daily_summaries (user, ngày) và ghi ai_interactions; trả về thời điểm sinh"""
+    now = datetime.now()
+    await db.daily_summaries.update_one(
+        {"user_id": summary_user_id(user_id), "date": target_date},
+        {"$set": {"summary": result["summary"], "metadata": result["metadata"], "generated_at": now, "updated_at": now},
+         "$setOnInsert": {"created_at": now}},
+        upsert=True
+    )
+    await db.ai_interactions.insert_one({
+        "user_id": str(user_id),
+        "type": "daily_summary",
+        "content": {
+            "summary": result["summary"],
+            "date": target_date.isoformat(),
+            "entry_count": result["metadata"]["entry_count"],
+            "mood_count": result["metadata"]["mood_count"]
+        },
+        "created_at": now
+    })
+    return now
+
+class DailySummaryBatch:
+    """
+    Nightly batch tính sẵn daily summary cho các user có hoạt động trong ngày:
+    tìm user active, đọc journal / check-in / onboarding theo lô (một query mỗi collection),
+    sinh summary với số lượt đồng thời giới hạn (LLM vẫn đi qua llm_scheduler, lớp "summary"),
+    ghi vào daily_summaries để /summary/daily chỉ còn là một lần đọc cache.
+    """
+
+    def __init__(self):
+        self.generator = DailySummaryGenerator()
+
+    async def run(self, date: Optional[str] = None, force: bool = False) -> Dict[str, Any]:
+        """
+        date: YYYY-MM-DD, mặc định là hôm qua (ngày vừa kết thúc).
+        force: sinh lại cả những user đã có summary của ngày đó.
+        """
+        if date:
+            target_date = datetime.strptime(date, "%Y-%m-%d")
+        else:
+            target_date = (datetime.now() - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        db = mongodb.get_db()
+        started = datetime.utcnow()
+
+        user_ids = await self._active_users(db, target_date)
+        considered = len(user_ids)
+        if not force and user_ids:
+            existing = await db.daily_summaries.distinct(
+                "user_id", {"date": target_date, "user_id": {"$in": user_ids + [str(u) for u in user_ids]}}
+            )
+            done = {str(u) for u in existing}
+            user_ids = [u for u in user_ids if str(u) not in done]
+
+        counts = {"generated": 0, "fallback": 0, "empty": 0, "failed": 0}
+        semaphore = asyncio.Semaphore(settings.daily_summary_batch_concurrency)
+        for i in range(0, len(user_ids), settings.daily_summary_batch_size):
+            chunk = user_ids[i:i + settings.daily_summary_batch_size]
+            entries, moods, onboardings = await self._fetch(db, chunk, target_date)
+            results = await asyncio.gather(
+                *[self._generate_one(semaphore, db, str(uid), target_date,
+                                     entries.get(str(uid), []), moods.get(str(uid), []), onboardings.get(str(uid)),
+                                     force)
+                  for uid in chunk],
+                return_exceptions=True
+            )
+            for uid, result in zip(chunk, results):
+                if isinstance(result, Exception):
+                    counts["failed"] += 1
+                    logger.warning(f"Daily summary failed for {uid}: {result}")
+                else:
+                    counts[result] += 1
+
+        summary = {
+            "date": target_date.strftime("%Y-%m-%d"),
+            "users_considered": considered,
+            "already_cached": considered - len(user_ids),
+            **counts,
+            "duration_seconds": (datetime.utcnow() - started).total_seconds(),
+        }
+        logger.info(f"Daily summary batch finished: {summary}")
+        return summary
+
+    async def _active_users(self, db, target_date: datetime) -> List[Any]:
+        """User có journal trong khung day_window (như _fetch / endpoint) hoặc check-in với date = ngày đó"""
+        start_of_day, end_of_day = day_window(target_date)
+        journal_users = await db.journal_entries.distinct("user_id", {
+            "created_at": {"$gte": start_of_day, "$lte": end_of_day},
+            "deleted_at": {"$in": [None, ""]}
+        })
+        checkin_users = await db.dailycheckins.distinct("user", {"date": target_date.strftime("%Y-%m-%d")})
+
+        users: Dict[str, Any] = {}
+        for uid in list(journal_users) + list(checkin_users):
+            if uid is not None:
+                users.setdefault(str(uid), summary_user_id(uid))
+        return list(users.values())
+
+    async def _fetch(self, db, user_ids: List[Any], target_date: datetime) -> Tuple[Dict, Dict, Dict]:
+        """journal / check-in / onboarding của cả lô user, gom theo str(user id)"""
+        object_ids = [u for u in user_ids if isinstance(u, ObjectId)]
+        all_ids = user_ids + [str(u) for u in object_ids]
+        start_of_day, end_of_day = day_window(target_date)
+
+        entries = defaultdict(list)
+        async for entry in db.journal_entries.find(
+            {"user_id": {"$in": all_ids}, "created_at": {"$gte": start_of_day, "$lte": end_of_day},
+             "deleted_at": {"$in": [None, ""]}},
+            {"user_id": 1, "text": 1, "created_at": 1}
+        ):
+            entries[str(entry["user_id"])].append(entry)
+
+        moods = await fetch_checkins(db, all_ids, target_date)
+
+        onboardings = {}
+        async for doc in db.onboardings.find({"$or": [{"user": {"$in": all_ids}}, {"userId": {"$in": all_ids}}]}):
+            owner = doc.get("user") or doc.get("userId")
+            onboardings.setdefault(str(owner), doc)
+        return entries, moods, onboardings
+
+    async def _generate_one(self, semaphore: asyncio.Semaphore, db, user_id: str, target_date: datetime,
+                            entries: List[Dict], moods: List[Dict], onboarding: Optional[Dict],
+                            force: bool = False) -> str:
+        async with semaphore:
+            result = await self.generator.generate(
+                user_id, target_date.strftime("%Y-%m-%d"), entries, moods, onboarding, force=force
+            )
+        if result["type"] == "empty_day":
+            return "empty"
+        if not result["metadata"].get("ai_generated"):
+            # LLM không dùng được -> không lưu bản rule-based, lần mở đầu tiên sẽ sinh lại on-demand
+            return "fallback"
+        await save_daily_summary(db, user_id, target_date, result)
+        return "generated"
+
+daily_summary_batch = DailySummaryBatch()
@@ -18,11 +18,13 @@ class DailySummaryGenerator:
         date: str,
         entries: List[Dict],
         moods: List[Dict],
-        onboarding: Optional[Dict] = None
+        onboarding: Optional[Dict] = None,
+        force: bool = False
     ) -> Dict[str, Any]:
         """
         Tạo daily summary dạng bullet points ngắn gọn.
         Trả về dict gồm summary (chuỗi nhiều dòng, mỗi dòng 1 bullet) và metadata chi tiết.
+        force: caller yêu cầu sinh lại -> bỏ qua LLM response cache.
         """
         # 1. Kiểm tra dữ liệu đầu vào (exception 1-EF)
         if not entries and not moods:
@@ -75,16 +77,19 @@ class DailySummaryGenerator:
         )
 
         # 4. Gọi OpenAI (có fallback)
+        ai_generated = False
         try:
             messages = [
                 {"role": "system", "content": system_instruction},
                 {"role": "user", "content": prompt}
             ]
-            ai_result = await call_llm(messages, temperature=0.7)
+            ai_result = await call_llm(messages, temperature=0.7, priority="summary",
+                                       cache=None if force else "daily_summary")
             ai_text = ai_result.get("text")
             if not ai_text:
                 raise RuntimeError("AI returned empty response")
             summary = ai_text.strip()
+            ai_generated = True
         except Exception as e:
             logger.error(f"AI generation failed: {e}, using rule-based fallback")
             summary = self._rule_based_fallback(len(entries), len(moods), avg_mood, dominant_mood)
@@ -102,7 +107,8 @@ class DailySummaryGenerator:
                 "dominant_mood": dominant_mood,
                 "has_journal": len(entries) > 0,
                 "has_mood": len(moods) > 0,
-                "sentiment_summary": sentiment
+                "sentiment_summary": sentiment,
+                "ai_generated": ai_generated
             },
             "type": "full_summary" if (entries or moods) else "empty_day"
         }
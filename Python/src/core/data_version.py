@@ -0,0 +1,51 @@
+import logging
+import time
+from typing import Optional
+
+from src.database.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+class DataVersionTracker:
+    """
+    Bộ đếm phiên bản dữ liệu theo user (Redis INCR).
+    Mỗi lần user ghi check-in / journal thì version tăng, các cache dẫn xuất
+    (trend analysis, ...) dùng version này để biết khi nào cần tính lại.
+    Key chưa có (user mới, hoặc bị evict) được khởi tạo bằng timestamp ms thay vì 0,
+    để bộ đếm sau khi mất key không lặp lại các version đã phát ra trước đó.
+    """
+
+    KEY_PREFIX = "user:data_version"
+
+    def _key(self, user_id: str) -> str:
+        return f"{self.KEY_PREFIX}:{user_id}"
+
+    async def _seed(self, key: str):
+        await redis_client.setnx(key, int(time.time() * 1000))
+
+    async def get(self, user_id: str) -> Optional[int]:
+        """Version hiện tại; None nếu không đọc được (Redis không khả dụng / lỗi) -> caller không được cache."""
+        if not redis_client.client:
+            return None
+        key = self._key(user_id)
+        try:
+            value = await redis_client.client.get(key)
+            if value is None:
+                await self._seed(key)
+                value = await redis_client.client.get(key)
+            return int(value) if value is not None else None
+        except Exception as e:
+            logger.warning(f"Data version read failed for user {user_id}: {e}")
+            return None
+
+    async def bump(self, user_id: str, source: Optional[str] = None) -> int:
+        """Tăng version sau khi user ghi dữ liệu mới."""
+        if not redis_client.client:
+            return 0
+        key = self._key(str(user_id))
+        await self._seed(key)
+        version = await redis_client.incr(key)
+        logger.debug(f"Data version for user {user_id} -> {version} ({source or 'unknown'})")
+        return version
+
+data_version = DataVersionTracker()
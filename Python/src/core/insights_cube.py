@@ -0,0 +1,343 @@
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from src.config import settings
+from src.database import mongodb, redis_client
+from src.core.user_dimension import user_dimension
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Pipeline building blocks (dùng chung cho phân tích trực tiếp và cube)
+# -------------------------------------------------------------------
+
+def numeric_count(field: str) -> dict:
+    return {"$sum": {"$cond": [{"$isNumber": field}, 1, 0]}}
+
+def safe_avg(sum_field: str, n_field: str) -> dict:
+    return {"$cond": [{"$gt": [n_field, 0]}, {"$divide": [sum_field, n_field]}, None]}
+
+def _day_of(field) -> dict:
+    return {"$dateToString": {"format": "%Y-%m-%d", "date": field}}
+
+# Nguồn hoạt động -> collection
+SOURCE_COLLECTIONS = {
+    "journal": "journal_entries",
+    "checkin": "dailycheckins",
+    "chat": "chat_sessions",
+}
+
+def source_stages(kind: str, start: datetime, end: datetime, with_day: bool = False) -> List[dict]:
+    """
+    $match + $project của một nguồn trong khoảng [start, end] thành luồng
+    {uid, kind, label, score, energy, risk[, day]}.
+    """
+    date_range = {"$gte": start, "$lte": end}
+
+    if kind == "journal":
+        match = {"created_at": date_range, "deleted_at": None}
+        project = {
+            "uid": {"$toString": "$user_id"},
+            "score": "$sentiment.score",
+            "label": "$sentiment.sentiment",
+        }
+        day = _day_of("$created_at")
+    elif kind == "checkin":
+        # DailyCheckIn lưu date dạng 'YYYY-MM-DD'
+        match = {"date": {"$gte": start.strftime("%Y-%m-%d"), "$lte": end.strftime("%Y-%m-%d")}}
+        project = {
+            "uid": {"$toString": "$user"},
+            "energy": "$energy",
+            "label": {"$toString": "$mood"},
+        }
+        day = {"$substrBytes": ["$date", 0, 10]}
+    elif kind == "chat":
+        # BE lưu camelCase, giữ tương thích snake_case cũ
+        match = {"$or": [{"startTime": date_range}, {"start_time": date_range}]}
+        project = {
+            "uid": {"$toString": {"$ifNull": ["$userId", "$user_id"]}},
+            "risk": {"$ifNull": ["$riskLevel", "$risk_level"]},
+        }
+        day = _day_of({"$ifNull": ["$startTime", "$start_time"]})
+    else:
+        raise ValueError(f"Unknown activity source: {kind}")
+
+    project = {"_id": 0, "kind": kind, **project}
+    if with_day:
+        project["day"] = day
+    return [{"$match": match}, {"$project": project}]
+
+def activity_union_stages(start: datetime, end: datetime, with_day: bool = False) -> List[dict]:
+    """
+    Journal + check-in + chat trong một luồng (pipeline chạy trên journal_entries,
+    các nguồn khác nối vào bằng $unionWith).
+    """
+    stages = source_stages("journal", start, end, with_day)
+    for kind in ("checkin", "chat"):
+        stages.append({"$unionWith": {
+            "coll": SOURCE_COLLECTIONS[kind],
+            "pipeline": source_stages(kind, start, end, with_day),
+        }})
+    return stages
+
+def per_user_group_stages(by_day: bool = False) -> List[dict]:
+    """
+    Gom theo (user[, ngày], loại, nhãn) -> đếm nhãn gọn thay vì $push toàn bộ danh sách,
+    rồi gom theo user[, ngày]. _id kết quả là uid (hoặc {uid, day}).
+    """
+    key = {"uid": "$uid", "kind": "$kind", "label": "$label"}
+    if by_day:
+        key["day"] = "$day"
+
+    def count_of(kind: str) -> dict:
+        return {"$sum": {"$cond": [{"$eq": ["$_id.kind", kind]}, "$n", 0]}}
+
+    return [
+        {"$group": {
+            "_id": key,
+            "n": {"$sum": 1},
+            "score_sum": {"$sum": "$score"},
+            "score_n": numeric_count("$score"),
+            "energy_sum": {"$sum": "$energy"},
+            "energy_n": numeric_count("$energy"),
+            "risk_sum": {"$sum": "$risk"},
+            "risk_n": numeric_count("$risk"),
+        }},
+        {"$group": {
+            "_id": {"uid": "$_id.uid", "day": "$_id.day"} if by_day else "$_id.uid",
+            "journal_count": count_of("journal"),
+            "checkin_count": count_of("checkin"),
+            "chat_count": count_of("chat"),
+            "score_sum": {"$sum": "$score_sum"},
+            "score_n": {"$sum": "$score_n"},
+            "energy_sum": {"$sum": "$energy_sum"},
+            "energy_n": {"$sum": "$energy_n"},
+            "risk_sum": {"$sum": "$risk_sum"},
+            "risk_n": {"$sum": "$risk_n"},
+            "labels": {"$push": {"kind": "$_id.kind", "label": "$_id.label", "n": "$n"}},
+        }},
+    ]
+
+def age_group_stages(uid_field: str = "_id") -> List[dict]:
+    """Join bảng chiều user_dimensions (uid -> nhóm tuổi), user chưa có trong bảng là 'unknown'"""
+    return [
+        {"$lookup": {
+            "from": user_dimension.collection_name,
+            "localField": uid_field,
+            "foreignField": "_id",
+            "as": "dimension",
+        }},
+        {"$addFields": {"age_group": {"$ifNull": [
+            {"$arrayElemAt": ["$dimension.age_group", 0]}, "unknown"
+        ]}}},
+        {"$project": {"dimension": 0}},
+    ]
+
+# -------------------------------------------------------------------
+# Daily cohort cube
+# -------------------------------------------------------------------
+
+MOMENT_FIELDS = [
+    "active_users", "journal_count", "checkin_count", "chat_count",
+    "mood_n", "mood_sum", "mood_sumsq",
+    "x_sum", "x_sumsq", "xy_sum",
+    "energy_sum", "energy_n", "risk_sum", "risk_n",
+]
+
+def _cube_pipeline(start: datetime, end: datetime) -> List[dict]:
+    """
+    Partial aggregates theo (ngày, nhóm tuổi). Đơn vị quan sát là user-ngày:
+    x = số journal của user trong ngày, y = sentiment trung bình của user trong ngày.
+    """
+    def if_mood(expr) -> dict:
+        return {"$cond": [{"$ne": ["$mood", None]}, expr, None]}
+
+    return activity_union_stages(start, end, with_day=True) + per_user_group_stages(by_day=True) + [
+        {"$addFields": {"mood": safe_avg("$score_sum", "$score_n")}},
+    ] + age_group_stages(uid_field="_id.uid") + [
+        {"$facet": {
+            "moments": [
+                {"$group": {
+                    "_id": {"day": "$_id.day", "age_group": "$age_group"},
+                    "active_users": {"$sum": 1},
+                    "journal_count": {"$sum": "$journal_count"},
+                    "checkin_count": {"$sum": "$checkin_count"},
+                    "chat_count": {"$sum": "$chat_count"},
+                    "mood_n": {"$sum": {"$cond": [{"$ne": ["$mood", None]}, 1, 0]}},
+                    "mood_sum": {"$sum": "$mood"},
+                    "mood_sumsq": {"$sum": if_mood({"$multiply": ["$mood", "$mood"]})},
+                    "x_sum": {"$sum": if_mood("$journal_count")},
+                    "x_sumsq": {"$sum": if_mood({"$multiply": ["$journal_count", "$journal_count"]})},
+                    "xy_sum": {"$sum": if_mood({"$multiply": ["$journal_count", "$mood"]})},
+                    "energy_sum": {"$sum": "$energy_sum"},
+                    "energy_n": {"$sum": "$energy_n"},
+                    "risk_sum": {"$sum": "$risk_sum"},
+                    "risk_n": {"$sum": "$risk_n"},
+                }},
+            ],
+            "histograms": [
+                {"$unwind": "$labels"},
+                {"$match": {"labels.label": {"$ne": None}, "labels.kind": {"$in": ["journal", "checkin"]}}},
+                {"$group": {
+                    "_id": {
+                        "day": "$_id.day", "age_group": "$age_group",
+                        "kind": "$labels.kind", "label": "$labels.label",
+                    },
+                    "n": {"$sum": "$labels.n"},
+                }},
+            ],
+        }},
+    ]
+
+class InsightsCube:
+    """
+    Bảng partial aggregate theo (ngày, nhóm tuổi) cho admin analytics.
+    Mọi khoảng ngày / segment được trả lời bằng cách cộng tối đa ~90 partial nhỏ,
+    không phụ thuộc số lượng user.
+    """
+
+    collection_name = "insight_daily_cube"
+    days_collection_name = "insight_cube_days"
+    DIRTY_KEY = "insights:cube:dirty"
+
+    async def mark_dirty(self, day: Optional[str] = None):
+        """Đánh dấu một ngày cần tính lại (gọi khi có ghi dữ liệu mới)"""
+        if not redis_client.client:
+            return
+        day = (day or datetime.utcnow().strftime("%Y-%m-%d"))[:10]
+        await redis_client.sadd(self.DIRTY_KEY, day)
+
+    async def build_days(self, days: List[str]) -> Dict[str, Any]:
+        """Tính lại partial cho các ngày (YYYY-MM-DD) và ghi đè vào cube"""
+        if not days:
+            return {"days": 0, "partials": 0}
+        db = mongodb.get_db()
+        started = datetime.utcnow()
+        days = sorted(set(days))
+
+        # Quét theo từng khoảng ngày liên tiếp để tránh đọc lại những ngày không cần
+        written = 0
+        for first, last in _contiguous_ranges(days):
+            start = datetime.strptime(first, "%Y-%m-%d")
+            end = datetime.strptime(last, "%Y-%m-%d") + timedelta(days=1) - timedelta(microseconds=1)
+            cursor = db.journal_entries.aggregate(_cube_pipeline(start, end), allowDiskUse=True)
+            facet = (await cursor.to_list(length=1) or [{"moments": [], "histograms": []}])[0]
+
+            partials: Dict[tuple, Dict[str, Any]] = {}
+            for row in facet["moments"]:
+                key = (row["_id"]["day"], row["_id"]["age_group"])
+                partials[key] = {
+                    "date": key[0],
+                    "age_group": key[1],
+                    **{f: row.get(f) or 0 for f in MOMENT_FIELDS},
+                    "sentiment_hist": {},
+                    "mood_hist": {},
+                }
+            for row in facet["histograms"]:
+                key = (row["_id"]["day"], row["_id"]["age_group"])
+                if key in partials:
+                    hist = "sentiment_hist" if row["_id"]["kind"] == "journal" else "mood_hist"
+                    partials[key][hist][str(row["_id"]["label"])] = row["n"]
+
+            ops = [
+                UpdateOne({"date": p["date"], "age_group": p["age_group"]},
+                          {"$set": {**p, "updated_at": started}}, upsert=True)
+                for p in partials.values()
+            ]
+            if ops:
+                await db[self.collection_name].bulk_write(ops, ordered=False)
+            # Partial không còn dữ liệu (vd. journal bị xóa) thì loại bỏ
+            await db[self.collection_name].delete_many(
+                {"date": {"$gte": first, "$lte": last}, "updated_at": {"$lt": started}}
+            )
+            await db[self.days_collection_name].bulk_write([
+                UpdateOne({"date": d}, {"$set": {"date": d, "built_at": started}}, upsert=True)
+                for d in days if first <= d <= last
+            ], ordered=False)
+            written += len(ops)
+
+        summary = {
+            "days": len(days),
+            "partials": written,
+            "duration_seconds": (datetime.utcnow() - started).total_seconds(),
+        }
+        logger.info(f"Insights cube rebuilt: {summary}")
+        return summary
+
+    async def run_nightly(self, days: Optional[int] = None) -> Dict[str, Any]:
+        """Nightly: tính lại N ngày gần nhất (bắt dữ liệu trễ / đổi nhóm tuổi)"""
+        days = days or settings.insights_cube_rebuild_days
+        today = datetime.utcnow().date()
+        return await self.build_days([(today - timedelta(days=i)).isoformat() for i in range(days)])
+
+    async def refresh_dirty(self) -> Dict[str, Any]:
+        """Incremental: chỉ tính lại các ngày có ghi dữ liệu mới kể từ lần chạy trước"""
+        days = []
+        if redis_client.client:
+            days = await redis_client.spop(self.DIRTY_KEY, settings.insights_cube_max_dirty_days)
+        try:
+            summary = await self.build_days([str(d) for d in days])
+        except Exception:
+            # Build lỗi (Mongo timeout, ...) -> trả các ngày về tập dirty, lần chạy sau tính lại
+            if days:
+                await redis_client.sadd(self.DIRTY_KEY, *days)
+            raise
+        summary["dirty_days"] = sorted(str(d) for d in days)
+        return summary
+
+    async def query(self, start: datetime, end: datetime, age_group: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Cộng các partial trong khoảng ngày. Trả về None nếu cube chưa phủ đủ các ngày
+        (caller fallback về pipeline trực tiếp).
+        """
+        db = mongodb.get_db()
+        first, last = start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+        expected = (end.date() - start.date()).days + 1
+        built = await db[self.days_collection_name].count_documents({"date": {"$gte": first, "$lte": last}})
+        if built < expected:
+            return None
+
+        query: Dict[str, Any] = {"date": {"$gte": first, "$lte": last}}
+        if age_group and age_group != "all":
+            query["age_group"] = age_group
+        partials = await db[self.collection_name].find(query, {"_id": 0}).to_list(length=None)
+        return merge_partials(partials)
+
+def merge_partials(partials: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Cộng các partial (tổng theo toàn khoảng và theo nhóm tuổi)"""
+    totals = {f: 0 for f in MOMENT_FIELDS}
+    by_age: Dict[str, Dict[str, float]] = {}
+    sentiment_hist, mood_hist = Counter(), Counter()
+
+    for p in partials:
+        group = by_age.setdefault(p["age_group"], {f: 0 for f in MOMENT_FIELDS})
+        for f in MOMENT_FIELDS:
+            totals[f] += p.get(f, 0)
+            group[f] += p.get(f, 0)
+        sentiment_hist.update(p.get("sentiment_hist", {}))
+        mood_hist.update(p.get("mood_hist", {}))
+
+    return {
+        "totals": totals,
+        "by_age": by_age,
+        "sentiment_hist": dict(sentiment_hist),
+        "mood_hist": dict(mood_hist),
+        "partials": len(partials),
+    }
+
+def _contiguous_ranges(days: List[str]) -> List[tuple]:
+    """['2026-01-01', '2026-01-02', '2026-01-05'] -> [('2026-01-01', '2026-01-02'), ('2026-01-05', '2026-01-05')]"""
+    ranges = []
+    for d in days:
+        current = datetime.strptime(d, "%Y-%m-%d").date()
+        if ranges and (current - datetime.strptime(ranges[-1][1], "%Y-%m-%d").date()).days == 1:
+            ranges[-1][1] = d
+        else:
+            ranges.append([d, d])
+    return [tuple(r) for r in ranges]
+
+insights_cube = InsightsCube()
@@ -1,59 +1,280 @@
-from openai import AsyncOpenAI
+import asyncio
+import time
+from typing import Dict, Optional
 from src.config import settings
 from src.core.gemini_client import gemini_client
+from src.core.llm_clients import llm_clients
+from src.core.llm_cache import llm_cache
+from src.core.llm_health import llm_health
+from src.core.llm_scheduler import LLMOverloaded, estimate_tokens, llm_scheduler
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def call_llm(messages: list, temperature: float = 0.7, max_tokens: int = 500) -> dict:
-    """
-    Điều phối gọi LLM:
-    1. Thử OpenAI trước (Ưu tiên theo yêu cầu người dùng).
-    2. Nếu OpenAI fail (hết tiền/429/timeout), thử Gemini (fallback).
-    3. Nếu cả hai fail, trả về rỗng để dùng rule-based.
-    """
-    # 1. Thử OpenAI trước
-    openai_key = settings.get_openai_api_key()
-    if openai_key:
-        try:
-            client = AsyncOpenAI(api_key=openai_key, timeout=12.0)
-            response = await client.chat.completions.create(
-                model=settings.openai_model,
+def _to_gemini_prompt(messages: list) -> tuple:
+    """Chuyển messages (OpenAI format) sang (prompt, system_instruction) cho Gemini"""
+    system_instruction = ""
+    user_prompt = ""
+    
+    for msg in messages:
+        if msg["role"] == "system":
+            system_instruction += msg["content"] + "\n"
+        elif msg["role"] == "user":
+            user_prompt += msg["content"] + "\n"
+        elif msg["role"] == "assistant":
+            user_prompt += f"Assistant: {msg['content']}\n"
+    
+    return user_prompt.strip(), system_instruction.strip() if system_instruction else None
+
+def _candidates() -> dict:
+    """provider:model -> (provider, model), theo thứ tự ưu tiên (OpenAI trước)"""
+    candidates = {}
+    if llm_clients.openai():
+        candidates[llm_health.key("openai", settings.openai_model)] = ("openai", settings.openai_model)
+    for model in gemini_client.models():
+        candidates[llm_health.key("gemini", model)] = ("gemini", model)
+    return candidates
+
+async def _call_provider(provider: str, model: str, messages: list, temperature: float, max_tokens: int,
+                         timeout: Optional[float] = None) -> str:
+    """timeout: phần ngân sách còn lại của caller, thay cho timeout mặc định nếu ngắn hơn"""
+    if provider == "openai":
+        options = {"timeout": min(settings.openai_timeout, timeout)} if timeout else {}
+        async with llm_clients.track("openai"):
+            response = await llm_clients.openai().chat.completions.create(
+                model=model,
                 messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens,
+                **options,
             )
-            text = response.choices[0].message.content.strip() if response.choices and response.choices[0].message.content else ""
+        if response.choices and response.choices[0].message.content:
+            return response.choices[0].message.content.strip()
+        return ""
+
+    prompt, system_instruction = _to_gemini_prompt(messages)
+    return await gemini_client.call_model(model, prompt, system_instruction, timeout=timeout) or ""
+
+def _hedge_delay(key: str) -> float:
+    """Chờ bao lâu trước khi bắn request dự phòng: p95 latency của model đang chạy"""
+    p95 = llm_health.p95_latency_ms(key)
+    delay = p95 / 1000 if p95 is not None else settings.llm_hedge_default_delay
+    return min(max(delay, settings.llm_hedge_min_delay), settings.llm_hedge_max_delay)
+
+async def _attempt(key: str, provider: str, model: str, messages: list, temperature: float, max_tokens: int,
+                   priority: str, timeout: Optional[float] = None) -> str:
+    try:
+        async with llm_scheduler.slot(provider, priority, estimate_tokens(messages, max_tokens), timeout=timeout):
+            async with llm_health.guard(key):
+                text = await _call_provider(provider, model, messages, temperature, max_tokens, timeout)
+                if not text:
+                    raise ValueError("empty response")
+    except (LLMOverloaded, asyncio.CancelledError):
+        # Bị scheduler shed, hoặc bị hủy khi còn chờ slot (hedge thua / hết deadline):
+        # không phải lỗi của model, nhưng phải nhả lượt half-open đã giữ trong try_acquire
+        llm_health.release(key)
+        raise
+    return text
+
+async def call_llm(
+    messages: list,
+    temperature: float = 0.7,
+    max_tokens: int = 500,
+    hedge: bool = False,
+    deadline: Optional[float] = None,
+    priority: str = "summary",
+    cache: Optional[str] = None
+) -> dict:
+    """
+    Điều phối gọi LLM qua circuit breaker dùng chung (llm_health):
+    1. Chỉ thử các provider/model đang khỏe; model đã đo latency được thử theo thứ tự nhanh nhất,
+       model chưa có số liệu giữ thứ tự ưu tiên (OpenAI trước, rồi chuỗi Gemini).
+    2. Model lỗi (429/404/timeout liên tiếp) bị bỏ qua tới khi hết cooldown, không chờ inline.
+    3. hedge=True: nếu model đang chạy chưa trả lời sau ~p95 latency của nó, bắn thêm model kế tiếp
+       song song, lấy câu trả lời tốt đầu tiên và hủy phần còn lại.
+    4. deadline (giây): mỗi lần thử chỉ dùng phần ngân sách còn lại; model không kịp trả lời trong phần
+       còn lại (theo latency đã đo) bị bỏ qua; hết hạn thì hủy tất cả và trả về rỗng để caller dùng rule-based.
+    5. priority (chat/summary/questions/notifications): lớp ưu tiên trong llm_scheduler;
+       request bị shed được coi như model đó không dùng được.
+    6. cache (tên call-site, opt-in): dùng lại response của prompt giống hệt trong TTL của call-site.
+    """
+    candidates = _candidates()
+    cache_ttl = llm_cache.ttl(cache)
+    if cache_ttl:
+        for provider, model in candidates.values():
+            text = llm_cache.get(llm_cache.key(provider, model, messages, temperature, max_tokens))
             if text:
-                return {"text": text}
-        except Exception as e:
-            logger.warning(f"OpenAI primary call failed: {e}")
+                llm_cache.record(cache, hit=True)
+                return {"text": text, "cached": True}
+        llm_cache.record(cache, hit=False)
+
+    queue = llm_health.rank(list(candidates))
+    running: Dict[asyncio.Task, str] = {}
+    hedging = hedge and settings.llm_hedging_enabled
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline if deadline else None
+
+    def launch() -> Optional[str]:
+        while queue:
+            key = queue.pop(0)
+            remaining = end - loop.time() if end is not None else None
+            if remaining is not None and not llm_health.fits_budget(key, remaining):
+                logger.debug(f"Skipping {key}: {remaining:.1f}s left of {deadline}s")
+                continue
+            if llm_health.try_acquire(key):
+                provider, model = candidates[key]
+                task = asyncio.create_task(
+                    _attempt(key, provider, model, messages, temperature, max_tokens, priority, remaining)
+                )
+                running[task] = key
+                return key
+        return None
 
-    # 2. Thử Gemini (Dự phòng)
     try:
-        system_instruction = ""
-        user_prompt = ""
-        
-        for msg in messages:
-            if msg["role"] == "system":
-                system_instruction += msg["content"] + "\n"
-            elif msg["role"] == "user":
-                user_prompt += msg["content"] + "\n"
-            elif msg["role"] == "assistant":
-                user_prompt += f"Assistant: {msg['content']}\n"
-        
-        gemini_text = await gemini_client.generate_response(
-            prompt=user_prompt.strip(),
-            system_instruction=system_instruction.strip() if system_instruction else None
-        )
-        
-        if gemini_text:
-            logger.info("Successfully used Gemini as fallback.")
-            return {"text": gemini_text}
-            
-    except Exception as ge:
-        logger.error(f"Gemini fallback also failed: {ge}")
-
-    # 3. Nếu tất cả đều fail
-    logger.error("All AI providers (OpenAI & Gemini) are currently unavailable.")
-    return {"text": ""}
\ No newline at end of file
+        last_key = launch()
+        while running:
+            timeout = _hedge_delay(last_key) if hedging and queue else None
+            if end is not None:
+                remaining = end - loop.time()
+                if remaining <= 0:
+                    logger.warning(f"LLM deadline of {deadline}s exceeded, falling back")
+                    break
+                timeout = remaining if timeout is None else min(timeout, remaining)
+
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if hedging and queue and (end is None or loop.time() < end):
+                    hedged_key = launch()
+                    if hedged_key:
+                        logger.info(f"Hedging slow {last_key} with {hedged_key}")
+                        last_key = hedged_key
+                continue
+
+            for task in done:
+                key = running.pop(task)
+                if task.exception() is None:
+                    if not key.startswith("openai:"):
+                        logger.info(f"Successfully used {key} as fallback.")
+                    if cache_ttl:
+                        provider, model = candidates[key]
+                        llm_cache.set(llm_cache.key(provider, model, messages, temperature, max_tokens), task.result(), cache_ttl)
+                    return {"text": task.result()}
+                logger.warning(f"LLM call failed on {key}: {task.exception()}")
+
+            # Model vừa lỗi -> thử model kế tiếp ngay (nếu không còn request nào đang chạy)
+            if not running:
+                last_key = launch()
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    # Nếu tất cả đều fail / hết deadline
+    if end is None or loop.time() < end:
+        logger.error("All AI providers (OpenAI & Gemini) are currently unavailable.")
+    return {"text": ""}
+
+async def _stream_provider(provider: str, model: str, messages: list, temperature: float, max_tokens: int):
+    """Yield từng đoạn text từ streaming API của provider"""
+    if provider == "openai":
+        async with llm_clients.track("openai"):
+            stream = await llm_clients.openai().chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        return
+
+    prompt, system_instruction = _to_gemini_prompt(messages)
+    async for text in gemini_client.stream_model(model, prompt, system_instruction):
+        yield text
+
+async def stream_llm(
+    messages: list,
+    temperature: float = 0.7,
+    max_tokens: int = 500,
+    first_token_deadline: Optional[float] = None,
+    priority: str = "chat"
+):
+    """
+    Bản streaming của call_llm: yield token ngay khi provider trả về.
+    Fallback sang model kế tiếp chỉ khi model lỗi TRƯỚC token đầu tiên;
+    lỗi giữa chừng thì dừng stream (text đã gửi cho user không thể thay).
+    Hết first_token_deadline mà chưa có token nào -> kết thúc rỗng, caller dùng rule-based.
+    """
+    candidates = _candidates()
+    loop = asyncio.get_running_loop()
+    end = loop.time() + first_token_deadline if first_token_deadline else None
+    tokens = estimate_tokens(messages, max_tokens)
+
+    for key in llm_health.rank(list(candidates)):
+        if end is not None and not llm_health.fits_budget(key, end - loop.time()):
+            logger.debug(f"Skipping {key} for stream: first token deadline too close")
+            continue
+        if not llm_health.try_acquire(key):
+            continue
+        provider, model = candidates[key]
+        try:
+            async with llm_scheduler.slot(provider, priority, tokens,
+                                          timeout=end - loop.time() if end is not None else None):
+                started = time.perf_counter()
+                stream = _stream_provider(provider, model, messages, temperature, max_tokens)
+                emitted = False
+                settled = False  # đã ghi kết quả của model (success / failure) cho lượt này chưa
+                try:
+                    while True:
+                        timeout = None
+                        if not emitted and end is not None:
+                            timeout = end - loop.time()
+                            if timeout <= 0:
+                                raise asyncio.TimeoutError("first token deadline exceeded")
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), timeout=timeout)
+                        except StopAsyncIteration:
+                            break
+                        emitted = True
+                        yield chunk
+                    settled = True
+                    if emitted:
+                        llm_health.record_success(key, (time.perf_counter() - started) * 1000)
+                    else:
+                        llm_health.record_failure(key, ValueError("empty response"))
+                except Exception as e:
+                    settled = True
+                    llm_health.record_failure(key, e)
+                    logger.warning(f"LLM stream failed on {key}: {e}")
+                    if emitted:
+                        return
+                    if end is not None and loop.time() >= end:
+                        logger.warning(f"No LLM token within {first_token_deadline}s, falling back")
+                        return
+                    continue
+                finally:
+                    await stream.aclose()
+                    if not settled:
+                        # Bị hủy, hoặc consumer ngừng đọc giữa chừng (GeneratorExit không phải Exception):
+                        # vẫn phải chốt lượt half-open, không thì model bị bỏ qua tới hết đời process
+                        if emitted:
+                            llm_health.record_success(key, (time.perf_counter() - started) * 1000)
+                        else:
+                            llm_health.release(key)
+
+                if emitted:
+                    if provider != "openai":
+                        logger.info(f"Successfully streamed from {key} as fallback.")
+                    return
+        except asyncio.CancelledError:
+            # Bị hủy khi còn chờ slot (lúc đang stream thì finally ở trên đã chốt): nhả lượt half-open
+            llm_health.release(key)
+            raise
+        except LLMOverloaded as e:
+            llm_health.release(key)
+            logger.warning(f"LLM stream shed on {key}: {e}")
+
+    logger.error("All AI providers (OpenAI & Gemini) are currently unavailable.")
\ No newline at end of file
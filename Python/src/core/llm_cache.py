@@ -0,0 +1,77 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from src.config import settings
+
+class LLMResponseCache:
+    """
+    Cache response LLM theo nội dung (in-process LRU), opt-in theo call-site:
+    key = hash(provider, model, messages đã chuẩn hóa, temperature làm tròn, max_tokens).
+    Prompt giống hệt nhau (vd. cùng category/time_of_day/mood) trả về ngay, không tốn lượt gọi.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, text)
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def key(provider: str, model: str, messages: list, temperature: float, max_tokens: int) -> str:
+        normalized = [
+            {"role": m.get("role"), "content": " ".join(str(m.get("content", "")).split())}
+            for m in messages
+        ]
+        payload = json.dumps(
+            {"p": provider, "m": model, "msg": normalized, "t": round(temperature, 1), "n": max_tokens},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @staticmethod
+    def ttl(site: Optional[str]) -> int:
+        if not site or not settings.llm_cache_enabled:
+            return 0
+        return settings.llm_cache_ttl.get(site, 0)
+
+    def _site_stats(self, site: str) -> Dict[str, int]:
+        return self._stats.setdefault(site, {"hits": 0, "misses": 0})
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, text = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return text
+
+    def set(self, key: str, text: str, ttl: int):
+        if ttl <= 0 or not text:
+            return
+        self._entries[key] = (time.monotonic() + ttl, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > settings.llm_cache_max_entries:
+            self._entries.popitem(last=False)
+
+    def record(self, site: str, hit: bool):
+        self._site_stats(site)["hits" if hit else "misses"] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        sites = {}
+        for site, stats in self._stats.items():
+            total = stats["hits"] + stats["misses"]
+            sites[site] = {**stats, "hit_rate": round(stats["hits"] / total, 3) if total else None}
+        return {
+            "entries": len(self._entries),
+            "max_entries": settings.llm_cache_max_entries,
+            "sites": sites,
+        }
+
+llm_cache = LLMResponseCache()
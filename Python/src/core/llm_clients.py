@@ -0,0 +1,143 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI
+from google import genai
+from google.genai import types
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+class LLMClientManager:
+    """
+    Client LLM dùng chung toàn process: một AsyncOpenAI và một genai.Client,
+    mỗi cái giữ một HTTP connection pool (keep-alive) thay vì tạo client mới mỗi lần gọi.
+    """
+
+    PROVIDERS = ("openai", "gemini")
+
+    def __init__(self):
+        self._openai: Optional[AsyncOpenAI] = None
+        self._openai_http: Optional[httpx.AsyncClient] = None
+        self._gemini: Optional[genai.Client] = None
+        self._stats: Dict[str, Dict[str, Any]] = {p: self._empty_stats() for p in self.PROVIDERS}
+
+    @staticmethod
+    def _empty_stats() -> Dict[str, Any]:
+        return {"requests": 0, "errors": 0, "in_flight": 0, "total_latency_ms": 0.0, "created_at": None}
+
+    @staticmethod
+    def _limits() -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=settings.llm_max_connections,
+            max_keepalive_connections=settings.llm_max_keepalive_connections,
+            keepalive_expiry=settings.llm_keepalive_expiry,
+        )
+
+    def openai(self) -> Optional[AsyncOpenAI]:
+        """AsyncOpenAI dùng chung (None nếu chưa cấu hình key)"""
+        if self._openai is None:
+            api_key = settings.get_openai_api_key()
+            if not api_key:
+                return None
+            self._openai_http = httpx.AsyncClient(
+                limits=self._limits(),
+                timeout=httpx.Timeout(settings.openai_timeout, connect=5.0),
+            )
+            self._openai = AsyncOpenAI(
+                api_key=api_key,
+                timeout=settings.openai_timeout,
+                http_client=self._openai_http,
+            )
+            self._stats["openai"]["created_at"] = time.time()
+            logger.info("OpenAI client pool created")
+        return self._openai
+
+    def gemini(self) -> Optional[genai.Client]:
+        """genai.Client dùng chung (None nếu chưa cấu hình key)"""
+        if self._gemini is None:
+            api_key = settings.get_gemini_api_key()
+            if not api_key:
+                return None
+            try:
+                self._gemini = genai.Client(
+                    api_key=api_key,
+                    http_options=types.HttpOptions(async_client_args={"limits": self._limits()}),
+                )
+            except Exception as e:
+                # google-genai cũ chưa hỗ trợ async_client_args -> dùng pool mặc định của SDK
+                logger.debug(f"Gemini client without custom pool limits: {e}")
+                self._gemini = genai.Client(api_key=api_key)
+            self._stats["gemini"]["created_at"] = time.time()
+            logger.info("Gemini client pool created")
+        return self._gemini
+
+    @asynccontextmanager
+    async def track(self, provider: str):
+        """Đo số request, lỗi, đang chạy và latency theo provider"""
+        stats = self._stats[provider]
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            stats["errors"] += 1
+            raise
+        finally:
+            stats["in_flight"] -= 1
+            stats["total_latency_ms"] += (time.perf_counter() - started) * 1000
+
+    @staticmethod
+    def _pool_connections(http_client: Optional[httpx.AsyncClient]) -> Optional[Dict[str, int]]:
+        """Số connection trong pool httpx (best effort, dựa trên httpcore)"""
+        pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return None
+        idle = sum(1 for c in connections if c.is_idle())
+        return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+    def metrics(self) -> Dict[str, Any]:
+        result = {}
+        for provider, stats in self._stats.items():
+            done = stats["requests"] - stats["in_flight"]
+            result[provider] = {
+                "initialized": stats["created_at"] is not None,
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+                "in_flight": stats["in_flight"],
+                "avg_latency_ms": round(stats["total_latency_ms"] / done, 1) if done else None,
+            }
+        result["openai"]["pool"] = self._pool_connections(self._openai_http)
+        result["limits"] = {
+            "max_connections": settings.llm_max_connections,
+            "max_keepalive_connections": settings.llm_max_keepalive_connections,
+            "keepalive_expiry": settings.llm_keepalive_expiry,
+        }
+        return result
+
+    async def close(self):
+        """Đóng các connection pool (gọi trong lifespan shutdown)"""
+        if self._openai is not None:
+            try:
+                await self._openai.close()
+            except Exception as e:
+                logger.warning(f"Error closing OpenAI client: {e}")
+            self._openai = None
+            self._openai_http = None
+        if self._gemini is not None:
+            aclose = getattr(getattr(self._gemini, "aio", None), "aclose", None)
+            if aclose:
+                try:
+                    await aclose()
+                except Exception as e:
+                    logger.warning(f"Error closing Gemini client: {e}")
+            self._gemini = None
+        logger.info("LLM client pools closed")
+
+llm_clients = LLMClientManager()
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Loại lỗi -> cách xử lý của circuit breaker
+RATE_LIMITED = "rate_limited"
+NOT_FOUND = "not_found"
+AUTH = "auth"
+TIMEOUT = "timeout"
+ERROR = "error"
+
+def classify_error(error: BaseException) -> Tuple[str, Optional[float]]:
+    """Phân loại lỗi provider -> (loại, retry_after giây nếu có)"""
+    if isinstance(error, asyncio.TimeoutError) or "timeout" in type(error).__name__.lower():
+        return TIMEOUT, None
+
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    message = str(error)
+
+    if status == 429 or "429" in message or "RESOURCE_EXHAUSTED" in message:
+        retry_after = None
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers and headers.get("retry-after"):
+            try:
+                retry_after = float(headers["retry-after"])
+            except ValueError:
+                pass
+        if retry_after is None:
+            match = re.search(r"retry in (\d+(?:\.\d+)?)s", message, re.IGNORECASE)
+            if match:
+                retry_after = float(match.group(1))
+        return RATE_LIMITED, retry_after
+    if status == 404 or "404" in message or "NOT_FOUND" in message:
+        return NOT_FOUND, None
+    if status in (401, 403) or "PERMISSION_DENIED" in message or "invalid_api_key" in message:
+        return AUTH, None
+    return ERROR, None
+
+class LLMHealthTable:
+    """
+    Circuit breaker dùng chung cho chuỗi fallback LLM, theo từng provider:model.
+    Ghi nhận lỗi gần đây, latency, retry-after; model không khỏe bị bỏ qua tới khi hết cooldown
+    (sau đó cho một request thử - half-open), request được định tuyến tới model khỏe nhanh nhất.
+    """
+
+    def __init__(self):
+        self._table: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def key(provider: str, model: str) -> str:
+        return f"{provider}:{model}"
+
+    def _entry(self, key: str) -> Dict[str, Any]:
+        if key not in self._table:
+            self._table[key] = {
+                "successes": 0,
+                "failures": 0,
+                "consecutive_failures": 0,
+                "open_until": 0.0,
+                "last_error": None,
+                "last_error_kind": None,
+                "latency_ewma_ms": None,
+                "latencies": deque(maxlen=settings.llm_latency_window),
+                "probing": False,
+            }
+        return self._table[key]
+
+    def is_available(self, key: str) -> bool:
+        return self._entry(key)["open_until"] <= time.time()
+
+    def try_acquire(self, key: str) -> bool:
+        """
+        True nếu được phép gọi model này lúc này. Hết cooldown thì chỉ cho đúng một
+        request thử (half-open) cho tới khi có kết quả.
+        """
+        entry = self._entry(key)
+        if entry["open_until"] > time.time():
+            return False
+        if entry["consecutive_failures"] > 0 and entry["open_until"] > 0:
+            if entry["probing"]:
+                return False
+            entry["probing"] = True
+        return True
+
+    def release(self, key: str):
+        """Request bị hủy giữa chừng: không tính thành công/lỗi, nhả lượt half-open"""
+        self._entry(key)["probing"] = False
+
+    def record_success(self, key: str, latency_ms: float):
+        entry = self._entry(key)
+        entry["successes"] += 1
+        entry["consecutive_failures"] = 0
+        entry["open_until"] = 0.0
+        entry["probing"] = False
+        entry["latencies"].append(latency_ms)
+        alpha = 0.3
+        entry["latency_ewma_ms"] = latency_ms if entry["latency_ewma_ms"] is None else (
+            alpha * latency_ms + (1 - alpha) * entry["latency_ewma_ms"]
+        )
+
+    def record_failure(self, key: str, error: BaseException) -> str:
+        kind, retry_after = classify_error(error)
+        entry = self._entry(key)
+        entry["failures"] += 1
+        entry["consecutive_failures"] += 1
+        entry["probing"] = False
+        entry["last_error"] = str(error)[:200]
+        entry["last_error_kind"] = kind
+
+        cooldown = 0.0
+        if kind in (NOT_FOUND, AUTH):
+            # Model không tồn tại / key sai: không thử lại trong thời gian dài
+            cooldown = settings.llm_breaker_long_cooldown
+        elif kind == RATE_LIMITED:
+            cooldown = retry_after if retry_after is not None else settings.llm_breaker_cooldown
+        elif entry["consecutive_failures"] >= settings.llm_breaker_failure_threshold:
+            # Lỗi liên tiếp: cooldown tăng dần theo số lần
+            over = entry["consecutive_failures"] - settings.llm_breaker_failure_threshold
+            cooldown = min(settings.llm_breaker_cooldown * (2 ** over), settings.llm_breaker_max_cooldown)
+
+        if cooldown > 0:
+            entry["open_until"] = time.time() + cooldown
+            logger.warning(f"LLM circuit open for {key} ({kind}) for {cooldown:.0f}s")
+        return kind
+
+    @asynccontextmanager
+    async def guard(self, key: str):
+        """Bao một lần gọi model: ghi latency khi thành công, ghi lỗi khi thất bại"""
+        started = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Bị hủy (vd. request khác đã trả lời trước) -> không tính là lỗi
+            self.release(key)
+            raise
+        except Exception as e:
+            self.record_failure(key, e)
+            raise
+        else:
+            self.record_success(key, (time.perf_counter() - started) * 1000)
+
+    def p95_latency_ms(self, key: str) -> Optional[float]:
+        latencies = sorted(self._entry(key)["latencies"])
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+    def fits_budget(self, key: str, remaining: float) -> bool:
+        """
+        Còn đủ thời gian để thử model này không: ít nhất llm_min_attempt_time
+        và latency điển hình (EWMA) của model nếu đã đo được.
+        """
+        expected_ms = self._entry(key)["latency_ewma_ms"] or 0.0
+        return remaining >= max(settings.llm_min_attempt_time, expected_ms / 1000)
+
+    def rank(self, keys: List[str]) -> List[str]:
+        """
+        Các model khỏe, model đã đo latency xếp trước theo latency tăng dần,
+        model chưa có số liệu giữ thứ tự ưu tiên ban đầu.
+        """
+        healthy = [k for k in keys if self.is_available(k)]
+        return sorted(healthy, key=lambda k: self._entry(k)["latency_ewma_ms"] or float("inf"))
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        result = {}
+        for key, entry in self._table.items():
+            result[key] = {
+                "state": "open" if entry["open_until"] > now else (
+                    "half_open" if entry["consecutive_failures"] and entry["open_until"] else "closed"
+                ),
+                "cooldown_remaining_s": round(max(0.0, entry["open_until"] - now), 1),
+                "successes": entry["successes"],
+                "failures": entry["failures"],
+                "consecutive_failures": entry["consecutive_failures"],
+                "last_error_kind": entry["last_error_kind"],
+                "last_error": entry["last_error"],
+                "latency_ewma_ms": round(entry["latency_ewma_ms"], 1) if entry["latency_ewma_ms"] else None,
+                "latency_p95_ms": self.p95_latency_ms(key),
+            }
+        return result
+
+llm_health = LLMHealthTable()
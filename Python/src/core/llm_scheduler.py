@@ -0,0 +1,189 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Lớp ưu tiên, số nhỏ hơn = được phục vụ trước
+PRIORITIES = {"chat": 0, "summary": 1, "questions": 2, "notifications": 3}
+
+class LLMOverloaded(Exception):
+    """Request bị loại (shed) vì provider đã quá tải cho lớp ưu tiên này"""
+
+def estimate_tokens(messages: list, max_tokens: int) -> int:
+    """Ước lượng token của một lần gọi (~4 ký tự / token cho prompt + max_tokens cho output)"""
+    chars = sum(len(str(m.get("content", ""))) for m in messages)
+    return chars // 4 + max_tokens
+
+class LLMScheduler:
+    """
+    Điều phối mọi lần gọi LLM trong process theo từng provider:
+    - giới hạn số request đồng thời và ngân sách tokens-per-minute (cửa sổ trượt 60s)
+    - hàng đợi ưu tiên chat > summary > questions > notifications
+    - lớp ưu tiên thấp chỉ được dùng một phần TPM, chờ ngắn hơn và bị shed trước khi chat bị ảnh hưởng
+    """
+
+    WINDOW = 60.0
+
+    def __init__(self):
+        self._providers: Dict[str, Dict[str, Any]] = {}
+        self._seq = itertools.count()
+        self._stats: Dict[str, Dict[str, Any]] = {
+            name: {"admitted": 0, "shed": 0, "timed_out": 0,
+                   "queue_ms": deque(maxlen=settings.llm_latency_window)}
+            for name in PRIORITIES
+        }
+
+    def _state(self, provider: str) -> Dict[str, Any]:
+        if provider not in self._providers:
+            self._providers[provider] = {
+                "in_flight": 0,
+                "usage": deque(),  # (timestamp, tokens) trong cửa sổ TPM
+                "waiters": [],     # heap (priority, seq, future, tokens, name)
+                "timer": None,
+            }
+        return self._providers[provider]
+
+    @staticmethod
+    def _limits(provider: str) -> tuple:
+        concurrency = settings.llm_max_concurrency.get(provider, settings.llm_max_concurrency.get("default", 8))
+        tpm = settings.llm_tpm_budget.get(provider, settings.llm_tpm_budget.get("default", 0))
+        return concurrency, tpm
+
+    def _used_tokens(self, state: Dict[str, Any], now: float) -> int:
+        usage = state["usage"]
+        while usage and usage[0][0] <= now - self.WINDOW:
+            usage.popleft()
+        return sum(tokens for _, tokens in usage)
+
+    def _fits(self, provider: str, state: Dict[str, Any], name: str, tokens: int, now: float) -> bool:
+        concurrency, tpm = self._limits(provider)
+        if state["in_flight"] >= concurrency:
+            return False
+        if tpm <= 0:
+            return True
+        # Lớp ưu tiên thấp chỉ được dùng tới một tỉ lệ TPM, phần còn lại dành cho chat
+        share = settings.llm_tpm_share.get(name, 1.0)
+        return self._used_tokens(state, now) + tokens <= tpm * share
+
+    def _grant(self, state: Dict[str, Any], tokens: int, now: float):
+        state["in_flight"] += 1
+        state["usage"].append((now, tokens))
+
+    def _dispatch(self, provider: str):
+        """Cấp slot cho các request đang chờ theo thứ tự ưu tiên"""
+        state = self._state(provider)
+        if state["timer"] is not None:
+            state["timer"].cancel()
+            state["timer"] = None
+        waiters = state["waiters"]
+        now = time.monotonic()
+        while waiters:
+            _, _, future, tokens, name = waiters[0]
+            if future.done():
+                heapq.heappop(waiters)
+                continue
+            if not self._fits(provider, state, name, tokens, now):
+                break
+            heapq.heappop(waiters)
+            self._grant(state, tokens, now)
+            future.set_result(True)
+
+        # Còn người chờ vì hết TPM (không phải vì concurrency) -> hẹn lại khi cửa sổ trượt
+        if waiters and state["usage"] and state["timer"] is None:
+            concurrency, _ = self._limits(provider)
+            if state["in_flight"] < concurrency:
+                delay = max(0.05, state["usage"][0][0] + self.WINDOW - now)
+                state["timer"] = asyncio.get_running_loop().call_later(delay, self._dispatch, provider)
+
+    @asynccontextmanager
+    async def slot(self, provider: str, priority: str, tokens: int, timeout: Optional[float] = None):
+        """
+        Giữ một slot của provider trong suốt lần gọi; raise LLMOverloaded nếu bị shed
+        hoặc chờ quá thời gian cho phép của lớp ưu tiên (hoặc timeout của caller, nếu ngắn hơn).
+        """
+        name = priority if priority in PRIORITIES else "summary"
+        state = self._state(provider)
+        stats = self._stats[name]
+        started = time.monotonic()
+
+        _, tpm = self._limits(provider)
+        if tpm > 0 and tokens > tpm:
+            tokens = tpm  # một request lớn hơn cả ngân sách vẫn phải chạy được
+
+        queued_ahead = sum(1 for w in state["waiters"] if w[0] <= PRIORITIES[name] and not w[2].done())
+        if queued_ahead == 0 and self._fits(provider, state, name, tokens, started):
+            self._grant(state, tokens, started)
+        else:
+            if queued_ahead >= settings.llm_max_queue.get(name, 50):
+                stats["shed"] += 1
+                raise LLMOverloaded(f"{provider} queue full for {name}")
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(state["waiters"], (PRIORITIES[name], next(self._seq), future, tokens, name))
+            self._dispatch(provider)
+            wait = settings.llm_queue_timeout.get(name, 10.0)
+            if timeout is not None:
+                wait = min(wait, max(0.0, timeout))
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout=wait)
+            except asyncio.TimeoutError:
+                if future.done() and not future.cancelled():
+                    pass  # được cấp đúng lúc hết hạn -> vẫn dùng
+                else:
+                    future.cancel()
+                    self._dispatch(provider)
+                    stats["timed_out"] += 1
+                    raise LLMOverloaded(f"{provider} busy, {name} waited too long")
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release(provider)
+                else:
+                    future.cancel()
+                    self._dispatch(provider)
+                raise
+
+        stats["admitted"] += 1
+        stats["queue_ms"].append((time.monotonic() - started) * 1000)
+        try:
+            yield
+        finally:
+            self._release(provider)
+
+    def _release(self, provider: str):
+        state = self._state(provider)
+        state["in_flight"] = max(0, state["in_flight"] - 1)
+        self._dispatch(provider)
+
+    def metrics(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        providers = {}
+        for provider, state in self._providers.items():
+            concurrency, tpm = self._limits(provider)
+            providers[provider] = {
+                "in_flight": state["in_flight"],
+                "max_concurrency": concurrency,
+                "queued": sum(1 for w in state["waiters"] if not w[2].done()),
+                "tokens_last_minute": self._used_tokens(state, now),
+                "tpm_budget": tpm or None,
+            }
+
+        classes = {}
+        for name, stats in self._stats.items():
+            waits: List[float] = sorted(stats["queue_ms"])
+            classes[name] = {
+                "admitted": stats["admitted"],
+                "shed": stats["shed"],
+                "timed_out": stats["timed_out"],
+                "queue_ms_avg": round(sum(waits) / len(waits), 1) if waits else None,
+                "queue_ms_p95": round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 1) if waits else None,
+            }
+        return {"providers": providers, "priorities": classes}
+
+llm_scheduler = LLMScheduler()
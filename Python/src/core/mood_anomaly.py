@@ -0,0 +1,324 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+
+from src.config import settings
+from src.database import mongodb, redis_client
+
+logger = logging.getLogger(__name__)
+
+# Số ngày dữ liệu tối thiểu để bật BR-22-01 / BR-22-02 (giống analyze_trends)
+MIN_DAYS = 7
+WINDOW = 7
+
+def mood_number_to_score(mood_val) -> Optional[float]:
+    """Mood 1-5 -> score -1..+1 (cùng công thức với trends.aggregate_daily_scores)"""
+    try:
+        return (int(mood_val) - 3) / 2.0
+    except (TypeError, ValueError):
+        return None
+
+def journal_sentiment(doc: Dict[str, Any]) -> Optional[float]:
+    """Điểm sentiment BE lưu khi tạo journal (/sentiment/analyze, cùng thang với trends); None nếu chưa có"""
+    try:
+        return float((doc.get("sentiment") or {})["score"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def journal_date(doc: Dict[str, Any]) -> Optional[str]:
+    """Ngày của journal theo created_at (cùng cách group với trends.aggregate_daily_scores)"""
+    raw = doc.get("created_at")
+    if raw is None:
+        return None
+    return raw.date().isoformat() if hasattr(raw, "date") else str(raw)[:10]
+
+def empty_state() -> Dict[str, Any]:
+    """
+    State của detector:
+    - base: thống kê đã chốt tới hết ngày trước (EWMA, variance, streak, 6 điểm gần nhất)
+    - today: điểm của ngày hiện tại, có thể còn thay đổi trong ngày (check-in sửa, journal thêm)
+    """
+    return {
+        "count": 0,
+        "ewma": None,
+        "ewm_var": 0.0,
+        "last_score": None,
+        "decline_streak": 0,
+        "recent": [],
+        "today_date": None,
+        "today_mood": None,
+        "today_sentiment_sum": 0.0,
+        "today_sentiment_count": 0,
+    }
+
+def today_score(state: Dict[str, Any]) -> Optional[float]:
+    """overall_score của ngày hiện tại: mood 0.6 + sentiment 0.4 (như aggregate_daily_scores)"""
+    mood = state.get("today_mood")
+    sentiment = None
+    if state.get("today_sentiment_count"):
+        sentiment = state["today_sentiment_sum"] / state["today_sentiment_count"]
+    if mood is not None and sentiment is not None:
+        return mood * 0.6 + sentiment * 0.4
+    if mood is not None:
+        return mood
+    return sentiment
+
+def _fold(state: Dict[str, Any], score: float, alpha: float) -> None:
+    """Chốt điểm một ngày vào base - O(1)"""
+    if state["ewma"] is None:
+        state["ewma"] = score
+        state["ewm_var"] = 0.0
+    else:
+        diff = score - state["ewma"]
+        incr = alpha * diff
+        state["ewma"] += incr
+        state["ewm_var"] = (1 - alpha) * (state["ewm_var"] + diff * incr)
+
+    last = state["last_score"]
+    state["decline_streak"] = state["decline_streak"] + 1 if last is not None and score < last else 0
+    state["last_score"] = score
+    state["recent"] = (state["recent"] + [score])[-(WINDOW - 1):]
+    state["count"] += 1
+
+def update_state(
+    state: Dict[str, Any],
+    date: str,
+    mood_score: Optional[float] = None,
+    sentiment_score: Optional[float] = None,
+    alpha: float = 0.3
+) -> bool:
+    """
+    Cập nhật state với dữ liệu mới của ngày `date` (YYYY-MM-DD).
+    Trả về False nếu dữ liệu thuộc ngày cũ hơn ngày hiện tại (bỏ qua, cần rebuild).
+    """
+    current = state.get("today_date")
+    if current is not None and date < current:
+        return False
+
+    if current is not None and date > current:
+        pending = today_score(state)
+        if pending is not None:
+            _fold(state, pending, alpha)
+        state["today_mood"] = None
+        state["today_sentiment_sum"] = 0.0
+        state["today_sentiment_count"] = 0
+
+    state["today_date"] = date
+    if mood_score is not None:
+        # Check-in được upsert theo ngày nên giá trị mới thay thế giá trị cũ
+        state["today_mood"] = mood_score
+    if sentiment_score is not None:
+        state["today_sentiment_sum"] += sentiment_score
+        state["today_sentiment_count"] += 1
+    return True
+
+def evaluate(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Tính cờ BR-22-01 / BR-22-02 từ state - O(1)"""
+    score = today_score(state)
+    if score is None:
+        return {"risk_flags": [], "data_points": state["count"], "today_score": None}
+
+    data_points = state["count"] + 1
+    window = (state["recent"] + [score])[-WINDOW:]
+    seven_day_avg = sum(window) / len(window)
+
+    last = state["last_score"]
+    streak = state["decline_streak"] + 1 if last is not None and score < last else 0
+
+    risk_flags: List[str] = []
+    if data_points >= MIN_DAYS:
+        # BR-22-01: giảm > 20% so với trung bình 7 ngày (dịch thang -1..1 sang 0..2)
+        if (score + 1) < (seven_day_avg + 1) * 0.8:
+            risk_flags.append("mood_dip_detected")
+        # BR-22-02: 7 ngày liên tiếp giảm = 6 lần giảm liên tiếp
+        if streak >= WINDOW - 1:
+            risk_flags.append("continuous_negative_trend")
+
+    zscore = None
+    if state["ewma"] is not None and state["ewm_var"] > 1e-9:
+        zscore = (score - state["ewma"]) / state["ewm_var"] ** 0.5
+
+    return {
+        "risk_flags": risk_flags,
+        "data_points": data_points,
+        "today_date": state["today_date"],
+        "today_score": score,
+        "seven_day_average": seven_day_avg,
+        "decline_streak": streak,
+        "ewma": state["ewma"],
+        "ewm_std": state["ewm_var"] ** 0.5,
+        "zscore": zscore,
+    }
+
+class MoodAnomalyDetector:
+    """
+    Detector online theo user, state lưu trong Redis (một JSON nhỏ / user).
+    Nguồn điểm: mood check-in (/events/data-changed) và sentiment journal (search.sync_entry).
+    load -> update_state -> save chạy dưới Redis lock theo user để hai sự kiện đồng thời không ghi đè nhau.
+    """
+
+    KEY_PREFIX = "trends:detector"
+
+    def _key(self, user_id: str) -> str:
+        return f"{self.KEY_PREFIX}:{user_id}"
+
+    def _lock_key(self, user_id: str) -> str:
+        return f"{self._key(user_id)}:lock"
+
+    async def _acquire(self, user_id: str) -> Optional[str]:
+        """Chờ lock state của user tới anomaly_lock_wait_timeout; None nếu không giữ được"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.anomaly_lock_wait_timeout
+        while True:
+            token = await redis_client.acquire_lock(self._lock_key(user_id), settings.anomaly_lock_ttl)
+            if token or loop.time() >= deadline:
+                return token
+            await asyncio.sleep(0.05)
+
+    async def _load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        if not redis_client.client:
+            return None
+        state = await redis_client.get(self._key(user_id))
+        return state if isinstance(state, dict) else None
+
+    async def _save(self, user_id: str, state: Dict[str, Any]):
+        if redis_client.client:
+            await redis_client.set(self._key(user_id), state, expire=settings.anomaly_state_ttl)
+
+    async def rebuild(self, user_id: str, until_date: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Dựng lại state từ các check-in và sentiment journal gần đây (dùng khi chưa có state hoặc có dữ liệu trễ).
+        Chỉ đọc đủ số ngày để phủ cửa sổ 7 ngày + chuỗi giảm, không chạy trend analysis / model sentiment.
+        """
+        db = mongodb.get_db()
+        query_ids: List[Any] = [user_id]
+        try:
+            query_ids.insert(0, ObjectId(user_id))
+        except Exception:
+            pass
+
+        query: Dict[str, Any] = {"user": {"$in": query_ids}}
+        if until_date:
+            query["date"] = {"$lte": until_date}
+        docs = await db.dailycheckins.find(
+            query, {"date": 1, "mood": 1}
+        ).sort("date", -1).limit(settings.anomaly_rebuild_days).to_list(length=settings.anomaly_rebuild_days)
+
+        end = datetime.strptime(until_date, "%Y-%m-%d") + timedelta(days=1) if until_date else datetime.utcnow()
+        journals = await db.journal_entries.find(
+            {
+                "user_id": {"$in": query_ids},
+                "created_at": {"$gte": end - timedelta(days=settings.anomaly_rebuild_days), "$lt": end},
+                "deleted_at": {"$in": [None, ""]},
+                "sentiment.score": {"$ne": None},
+            },
+            {"created_at": 1, "sentiment": 1}
+        ).sort("created_at", -1).to_list(length=settings.anomaly_rebuild_days * 20)
+
+        days: Dict[str, Dict[str, Any]] = {}
+        for doc in docs:
+            score = mood_number_to_score(doc.get("mood"))
+            if doc.get("date") and score is not None:
+                days.setdefault(str(doc["date"])[:10], {"mood": None, "sentiments": []})["mood"] = score
+        for doc in journals:
+            date, score = journal_date(doc), journal_sentiment(doc)
+            if date and score is not None:
+                days.setdefault(date, {"mood": None, "sentiments": []})["sentiments"].append(score)
+
+        state = empty_state()
+        alpha = settings.anomaly_ewma_alpha
+        for date in sorted(days):
+            update_state(state, date, mood_score=days[date]["mood"], alpha=alpha)
+            for score in days[date]["sentiments"]:
+                update_state(state, date, sentiment_score=score, alpha=alpha)
+        return state
+
+    async def _apply(
+        self,
+        user_id: str,
+        state: Optional[Dict[str, Any]],
+        date: str,
+        mood_score: Optional[float],
+        sentiment_score: Optional[float]
+    ) -> Dict[str, Any]:
+        if state is None:
+            # Lần đầu: seed từ lịch sử tới hôm trước, rồi áp dữ liệu mới
+            previous_day = (datetime.strptime(date, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+            state = await self.rebuild(user_id, until_date=previous_day)
+
+        if not update_state(state, date, mood_score, sentiment_score, settings.anomaly_ewma_alpha):
+            logger.info(f"Late data for user {user_id} on {date}, rebuilding detector state")
+            state = await self.rebuild(user_id)
+        return state
+
+    async def update(
+        self,
+        user_id: str,
+        date: Optional[str] = None,
+        mood: Optional[Any] = None,
+        sentiment_score: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Cập nhật với điểm mới của user và trả về cờ rủi ro ngay lập tức"""
+        date = (date or datetime.now().strftime("%Y-%m-%d"))[:10]
+        mood_score = mood_number_to_score(mood) if mood is not None else None
+
+        if not redis_client.client:
+            return evaluate(await self._apply(user_id, None, date, mood_score, sentiment_score))
+
+        token = await self._acquire(user_id)
+        if not token:
+            # Worker khác giữ lock quá lâu: không ghi đè state của nó, bỏ state để lần sau dựng lại từ Mongo
+            logger.warning(f"Detector state for user {user_id} is locked, answering from a rebuild")
+            state = await self.rebuild(user_id)
+            await redis_client.delete(self._key(user_id))
+            return evaluate(state)
+        try:
+            state = await self._apply(user_id, await self._load(user_id), date, mood_score, sentiment_score)
+            await self._save(user_id, state)
+        finally:
+            await redis_client.release_lock(self._lock_key(user_id), token)
+        return evaluate(state)
+
+    async def add_journal(self, user_id: str, entry_id: str) -> Optional[Dict[str, Any]]:
+        """Đưa sentiment của journal vừa tạo vào detector (điểm đọc từ Mongo, không chạy lại model)"""
+        try:
+            entry_oid = ObjectId(entry_id)
+        except Exception:
+            return None
+        doc = await mongodb.get_db().journal_entries.find_one({"_id": entry_oid}, {"created_at": 1, "sentiment": 1})
+        score = journal_sentiment(doc) if doc else None
+        date = journal_date(doc) if doc else None
+        if score is None or date is None:
+            return None
+        return await self.update(user_id, date, sentiment_score=score)
+
+    async def invalidate(self, user_id: str):
+        """Journal bị sửa / xóa làm đổi điểm của ngày cũ -> bỏ state, lần sau dựng lại từ Mongo"""
+        if not redis_client.client:
+            return
+        token = await self._acquire(user_id)
+        try:
+            await redis_client.delete(self._key(user_id))
+        finally:
+            if token:
+                await redis_client.release_lock(self._lock_key(user_id), token)
+
+    async def get_flags(self, user_id: str) -> Dict[str, Any]:
+        state = await self._load(user_id)
+        if state is None:
+            state = await self.rebuild(user_id)
+            # Chỉ lưu khi giữ được lock và chưa worker nào kịp ghi state mới hơn
+            token = await redis_client.acquire_lock(self._lock_key(user_id), settings.anomaly_lock_ttl) \
+                if redis_client.client else None
+            if token:
+                try:
+                    if await self._load(user_id) is None:
+                        await self._save(user_id, state)
+                finally:
+                    await redis_client.release_lock(self._lock_key(user_id), token)
+        return evaluate(state)
+
+mood_anomaly_detector = MoodAnomalyDetector()
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, date as date_cls
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from src.config import settings
+from src.database import mongodb
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Model fitting (chạy trong process pool của batch job, KHÔNG chạy trên request path)
+# -------------------------------------------------------------------
+
+def _future_dates(last_date: str, horizon: int) -> List[str]:
+    start = date_cls.fromisoformat(last_date)
+    return [(start + timedelta(days=i)).isoformat() for i in range(1, horizon + 1)]
+
+def _clip(values) -> List[float]:
+    return [round(float(v), 3) for v in np.clip(values, -1.0, 1.0)]
+
+def _fit_prophet(dates: List[str], values: List[float], horizon: int) -> Dict[str, Any]:
+    import pandas as pd
+    from prophet import Prophet
+
+    model = Prophet(
+        daily_seasonality=False,
+        yearly_seasonality=False,
+        weekly_seasonality=len(values) >= 14,
+        interval_width=0.8,
+    )
+    model.fit(pd.DataFrame({"ds": pd.to_datetime(dates), "y": values}))
+    future = pd.DataFrame({"ds": pd.to_datetime(_future_dates(dates[-1], horizon))})
+    fc = model.predict(future)
+    return {
+        "model": "prophet",
+        "yhat": _clip(fc["yhat"]),
+        "lower": _clip(fc["yhat_lower"]),
+        "upper": _clip(fc["yhat_upper"]),
+    }
+
+def _fit_linear(dates: List[str], values: List[float], horizon: int) -> Dict[str, Any]:
+    from sklearn.linear_model import Ridge
+
+    def features(ds: List[str], origin: date_cls) -> np.ndarray:
+        rows = []
+        for d in ds:
+            day = date_cls.fromisoformat(d)
+            weekday = [0.0] * 7
+            weekday[day.weekday()] = 1.0
+            rows.append([(day - origin).days] + weekday)
+        return np.array(rows)
+
+    origin = date_cls.fromisoformat(dates[0])
+    X = features(dates, origin)
+    y = np.asarray(values)
+    model = Ridge(alpha=1.0).fit(X, y)
+    resid_std = float(np.std(y - model.predict(X)))
+    yhat = model.predict(features(_future_dates(dates[-1], horizon), origin))
+    return {
+        "model": "ridge_weekday",
+        "yhat": _clip(yhat),
+        "lower": _clip(yhat - 1.28 * resid_std),
+        "upper": _clip(yhat + 1.28 * resid_std),
+    }
+
+def fit_user_forecast(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fit forecast cho một user. Hàm top-level để pickle được sang ProcessPoolExecutor.
+    payload: {"user_id", "dates": [YYYY-MM-DD...], "values": [-1..1...], "horizon"}
+    """
+    dates, values, horizon = payload["dates"], payload["values"], payload["horizon"]
+    result = None
+    if len(values) >= settings.forecast_prophet_min_days:
+        try:
+            result = _fit_prophet(dates, values, horizon)
+        except Exception as e:
+            logger.warning(f"Prophet fit failed for {payload['user_id']}: {e}")
+    if result is None:
+        result = _fit_linear(dates, values, horizon)
+
+    result.update({
+        "user_id": payload["user_id"],
+        "dates": _future_dates(dates[-1], horizon),
+        "last_observed_date": dates[-1],
+        "data_points": len(values),
+    })
+    return result
+
+# -------------------------------------------------------------------
+# Fallback rẻ trên request path: Holt linear exponential smoothing
+# -------------------------------------------------------------------
+
+def exponential_smoothing_forecast(
+    values: List[float],
+    horizon: int,
+    alpha: float = 0.5,
+    beta: float = 0.2,
+    phi: float = 0.9
+) -> Dict[str, List[float]]:
+    """Holt's damped linear trend - O(n), không cần fit model"""
+    warmup = min(len(values) - 1, 3)
+    level = values[0]
+    trend = (values[warmup] - values[0]) / warmup if warmup > 0 else 0.0
+    residuals = []
+    for value in values[1:]:
+        residuals.append(value - (level + phi * trend))
+        prev_level = level
+        level = alpha * value + (1 - alpha) * (level + phi * trend)
+        trend = beta * (level - prev_level) + (1 - beta) * phi * trend
+
+    resid_std = float(np.std(residuals)) if residuals else 0.3
+    damping = np.cumsum(phi ** np.arange(1, horizon + 1))
+    yhat = level + damping * trend
+    spread = 1.28 * resid_std * np.sqrt(np.arange(1, horizon + 1))
+    return {"yhat": _clip(yhat), "lower": _clip(yhat - spread), "upper": _clip(yhat + spread)}
+
+# -------------------------------------------------------------------
+# Service
+# -------------------------------------------------------------------
+
+def _mood_to_score(mood) -> Optional[float]:
+    try:
+        return (int(mood) - 3) / 2.0
+    except (TypeError, ValueError):
+        return None
+
+def _daily_series(entries: List[Dict[str, Any]]) -> Dict[str, List]:
+    """[{date, mood}] -> chuỗi điểm theo ngày (trung bình nếu một ngày có nhiều bản ghi)"""
+    by_date: Dict[str, List[float]] = {}
+    for e in entries:
+        score = _mood_to_score(e.get("mood"))
+        if e.get("date") and score is not None:
+            by_date.setdefault(str(e["date"])[:10], []).append(score)
+    dates = sorted(by_date)
+    return {"dates": dates, "values": [float(np.mean(by_date[d])) for d in dates]}
+
+class MoodForecastService:
+    """Đọc forecast đã fit sẵn (nightly batch), fallback exponential smoothing"""
+
+    collection_name = "mood_forecasts"
+
+    async def get_forecast(self, user_id: str, horizon: int) -> Dict[str, Any]:
+        db = mongodb.get_db()
+        today = datetime.now().date().isoformat()
+
+        doc = await db[self.collection_name].find_one({"user_id": str(user_id)}, {"_id": 0})
+        if doc:
+            points = [
+                {"date": d, "mood_score": y, "lower": lo, "upper": up}
+                for d, y, lo, up in zip(doc["dates"], doc["yhat"], doc["lower"], doc["upper"])
+                if d >= today
+            ][:horizon]
+            if len(points) >= horizon:
+                return {
+                    "points": points,
+                    "model": doc["model"],
+                    "source": "batch",
+                    "fitted_at": doc.get("fitted_at"),
+                    "data_points": doc.get("data_points", 0),
+                }
+
+        return await self._fallback(user_id, horizon, today)
+
+    async def _fallback(self, user_id: str, horizon: int, today: str) -> Dict[str, Any]:
+        """User chưa được fit (hoặc forecast đã hết hạn): smoothing trên 30 ngày gần nhất"""
+        db = mongodb.get_db()
+        query_ids: List[Any] = [user_id]
+        try:
+            query_ids.insert(0, ObjectId(user_id))
+        except Exception:
+            pass
+
+        since = (datetime.now() - timedelta(days=settings.forecast_fallback_days)).strftime("%Y-%m-%d")
+        entries = await db.dailycheckins.find(
+            {"user": {"$in": query_ids}, "date": {"$gte": since}},
+            {"date": 1, "mood": 1}
+        ).to_list(length=None)
+        series = _daily_series(entries)
+
+        if len(series["values"]) < 3:
+            return {"points": [], "model": None, "source": "insufficient_data",
+                    "fitted_at": None, "data_points": len(series["values"])}
+
+        fc = exponential_smoothing_forecast(series["values"], horizon + 7)
+        points = [
+            {"date": d, "mood_score": y, "lower": lo, "upper": up}
+            for d, y, lo, up in zip(_future_dates(series["dates"][-1], horizon + 7),
+                                    fc["yhat"], fc["lower"], fc["upper"])
+            if d >= today
+        ][:horizon]
+        return {"points": points, "model": "holt_smoothing", "source": "fallback",
+                "fitted_at": None, "data_points": len(series["values"])}
+
+    async def run_batch(self, days: Optional[int] = None, horizon: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Nightly batch: lấy chuỗi mood của tất cả user active trong một aggregation,
+        fit song song trong process pool, bulk upsert vào mood_forecasts.
+        """
+        days = days or settings.forecast_history_days
+        horizon = horizon or settings.forecast_horizon_days
+        db = mongodb.get_db()
+        since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+        started = datetime.utcnow()
+
+        cursor = db.dailycheckins.aggregate([
+            {"$match": {"date": {"$gte": since}}},
+            {"$group": {"_id": "$user", "entries": {"$push": {"date": "$date", "mood": "$mood"}}}},
+        ], allowDiskUse=True)
+
+        payloads = []
+        async for doc in cursor:
+            series = _daily_series(doc["entries"])
+            if len(series["values"]) >= settings.forecast_min_days:
+                payloads.append({"user_id": str(doc["_id"]), "horizon": horizon, **series})
+
+        loop = asyncio.get_running_loop()
+        fitted, failed = 0, 0
+        with ProcessPoolExecutor(max_workers=settings.forecast_workers) as pool:
+            for i in range(0, len(payloads), settings.forecast_batch_size):
+                chunk = payloads[i:i + settings.forecast_batch_size]
+                results = await asyncio.gather(
+                    *[loop.run_in_executor(pool, fit_user_forecast, p) for p in chunk],
+                    return_exceptions=True
+                )
+                ops = []
+                for payload, result in zip(chunk, results):
+                    if isinstance(result, Exception):
+                        failed += 1
+                        logger.warning(f"Forecast fit failed for {payload['user_id']}: {result}")
+                        continue
+                    result["fitted_at"] = datetime.utcnow()
+                    ops.append(UpdateOne({"user_id": result["user_id"]}, {"$set": result}, upsert=True))
+                if ops:
+                    await db[self.collection_name].bulk_write(ops, ordered=False)
+                    fitted += len(ops)
+
+        summary = {
+            "users_considered": len(payloads),
+            "fitted": fitted,
+            "failed": failed,
+            "duration_seconds": (datetime.utcnow() - started).total_seconds(),
+        }
+        logger.info(f"Mood forecast batch finished: {summary}")
+        return summary
+
+mood_forecast_service = MoodForecastService()
@@ -81,7 +81,10 @@ async def generate_notification_content(user_context: dict, category: str, time_
     prompt = prompts.get(category, prompts["mood_check"])
     try:
         # Fixed typo: call_lll -> call_llm
-        response = await call_llm([{"role": "user", "content": prompt}], temperature=0.7, max_tokens=250)
+        response = await call_llm(
+            [{"role": "user", "content": prompt}], temperature=0.7, max_tokens=250,
+            priority="notifications", cache="notifications"
+        )
         text = response["text"]
         text = text.strip().replace("```json", "").replace("```", "")
         import json
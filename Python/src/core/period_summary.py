@@ -0,0 +1,211 @@
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+
+from src.database import mongodb
+from src.core.daily_summary_batch import summary_user_id
+from src.core.daily_summary_generator import DailySummaryGenerator
+from src.core.llm import call_llm
+from src.utils.helpers import truncate_text
+
+logger = logging.getLogger(__name__)
+
+# Số ngày của mỗi loại kỳ (cửa sổ trượt kết thúc ở ngày được hỏi)
+PERIOD_DAYS = {"weekly": 7, "monthly": 30}
+LOCAL_TZ = "+07:00"  # ngày của user theo giờ VN (cùng giả định với day_window)
+
+class PeriodSummaryService:
+    """
+    Summary tuần / tháng dựng từ các tầng đã có sẵn thay vì đọc lại mọi journal:
+    - map: mỗi ngày -> một dòng ngắn (daily_summaries đã sinh + rollup số liệu tính trên Mongo)
+    - reduce: gộp số liệu cả kỳ + một lần gọi LLM nhỏ trên các dòng ngắn đó
+    Kết quả cache trong period_summaries theo (user, kỳ, ngày cuối), kèm fingerprint của dữ liệu nguồn.
+    """
+
+    collection_name = "period_summaries"
+
+    def __init__(self):
+        # Dùng lại cách tính điểm mood / hậu xử lý bullet của daily summary
+        self.generator = DailySummaryGenerator()
+
+    async def summarize(
+        self,
+        user_id: str,
+        period: str = "weekly",
+        date: Optional[str] = None,
+        force: bool = False
+    ) -> Dict[str, Any]:
+        days = PERIOD_DAYS[period]
+        if date:
+            end_day = datetime.strptime(date, "%Y-%m-%d")
+        else:
+            end_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start_day = end_day - timedelta(days=days - 1)
+
+        db = mongodb.get_db()
+        uid = summary_user_id(user_id)
+        ids = [uid, str(uid)] if isinstance(uid, ObjectId) else [uid]
+
+        # date của daily_summaries có thể là 00:00 (AI service) hoặc 00:00 giờ VN = 17:00 UTC hôm trước (BE)
+        dailies = await db.daily_summaries.find(
+            {"user_id": {"$in": ids}, "date": {"$gte": start_day - timedelta(hours=7), "$lte": end_day}},
+            {"date": 1, "summary": 1, "metadata": 1, "updated_at": 1}
+        ).sort("date", 1).to_list(length=days * 2)
+        rollups = await self._rollups(db, ids, start_day, end_day)
+        stats = self._reduce_stats(rollups)
+
+        # Dữ liệu nguồn đổi (thêm daily summary, thêm journal / check-in) -> cache không còn dùng được
+        fingerprint = {
+            "daily_summaries": len(dailies),
+            "last_updated": max((d.get("updated_at") for d in dailies if d.get("updated_at")), default=None),
+            "entry_count": stats["entry_count"],
+            "mood_count": stats["mood_count"],
+        }
+        key = {"user_id": uid, "period": period, "end": end_day}
+        if not force:
+            cached = await db[self.collection_name].find_one(key)
+            if cached and cached.get("fingerprint") == fingerprint:
+                return self._response(period, start_day, end_day, cached["summary"], cached["stats"],
+                                      cached["generated_at"], "cached")
+
+        now = datetime.now()
+        if not dailies and not rollups:
+            return self._response(period, start_day, end_day,
+                                  "You haven't recorded anything in this period yet. Small check-ins add up over time.",
+                                  stats, now, "empty_period")
+
+        lines = self._day_lines(start_day, days, dailies, rollups)
+        summary = await self._reduce_text(period, lines, stats)
+        if not summary:
+            return self._response(period, start_day, end_day, self._rule_based(period, stats), stats, now, "fallback")
+
+        await db[self.collection_name].update_one(
+            key,
+            {"$set": {"start": start_day, "summary": summary, "stats": stats, "fingerprint": fingerprint,
+                      "generated_at": now}},
+            upsert=True
+        )
+        return self._response(period, start_day, end_day, summary, stats, now, "generated")
+
+    async def _rollups(self, db, ids: List[Any], start_day: datetime, end_day: datetime) -> Dict[str, Dict[str, Any]]:
+        """Số liệu theo ngày tính trên server: mood / energy của check-in và số journal (không kéo entry về)"""
+        rollups: Dict[str, Dict[str, Any]] = {}
+
+        def day(key: str) -> Dict[str, Any]:
+            return rollups.setdefault(key, {"moods": [], "energy": [], "entries": 0})
+
+        async for doc in db.dailycheckins.aggregate([
+            {"$match": {"user": {"$in": ids},
+                        "date": {"$gte": start_day.strftime("%Y-%m-%d"), "$lte": end_day.strftime("%Y-%m-%d")}}},
+            {"$group": {"_id": "$date", "moods": {"$push": "$mood"}, "energy": {"$push": "$energy"}}},
+        ]):
+            day(doc["_id"])["moods"] = [m for m in doc["moods"] if m is not None]
+            day(doc["_id"])["energy"] = [e for e in doc["energy"] if e is not None]
+
+        async for doc in db.journal_entries.aggregate([
+            {"$match": {"user_id": {"$in": ids},
+                        "created_at": {"$gte": start_day - timedelta(hours=7),
+                                       "$lt": end_day + timedelta(hours=17)},
+                        "deleted_at": {"$in": [None, ""]}}},
+            {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at", "timezone": LOCAL_TZ}},
+                        "count": {"$sum": 1}}},
+        ]):
+            day(doc["_id"])["entries"] = doc["count"]
+        return rollups
+
+    def _reduce_stats(self, rollups: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        moods = [m for r in rollups.values() for m in r["moods"]]
+        energy = [e for r in rollups.values() for e in r["energy"]]
+        return {
+            "entry_count": sum(r["entries"] for r in rollups.values()),
+            "mood_count": len(moods),
+            "mood_distribution": dict(Counter(str(m) for m in moods)),
+            "avg_mood": round(self.generator._calculate_avg_mood(moods, energy), 2),
+            "active_days": len(rollups),
+        }
+
+    def _day_lines(self, start_day: datetime, days: int, dailies: List[Dict], rollups: Dict[str, Dict]) -> List[str]:
+        """Map: mỗi ngày có hoạt động -> một dòng ngắn (số liệu + 2 ý chính của daily summary)"""
+        by_date = {(d["date"] + timedelta(hours=7)).strftime("%Y-%m-%d"): d for d in dailies}
+        lines = []
+        for i in range(days):
+            current = start_day + timedelta(days=i)
+            key = current.strftime("%Y-%m-%d")
+            daily, rollup = by_date.get(key), rollups.get(key)
+            if not daily and not rollup:
+                continue
+
+            parts = []
+            if rollup and rollup["moods"]:
+                avg = self.generator._calculate_avg_mood(rollup["moods"], rollup["energy"])
+                parts.append(f"mood {avg:.1f}/5 ({self.generator._dominant_mood(rollup['moods'])})")
+            if rollup and rollup["entries"]:
+                parts.append(f"{rollup['entries']} journal entries")
+            if daily:
+                bullets = [b.strip("•- ").strip() for b in str(daily.get("summary", "")).split("\n") if b.strip()]
+                highlights = "; ".join(b for b in bullets[:2] if not b.startswith("Tip:"))
+                if highlights:
+                    parts.append(f"highlights: {highlights}")
+            lines.append(truncate_text(f"{key} ({current.strftime('%a')}): " + ", ".join(parts), 300))
+        return lines
+
+    async def _reduce_text(self, period: str, lines: List[str], stats: Dict[str, Any]) -> str:
+        """Reduce: một lần gọi LLM trên các dòng theo ngày, trả về chuỗi bullet (rỗng nếu LLM không dùng được)"""
+        label = "week" if period == "weekly" else "month"
+        prompt = f"""
+Below are compact day-by-day notes of the user's last {label} (may include Vietnamese; preserve emotional meaning).
+{chr(10).join(lines)}
+
+Period totals: {stats['active_days']} active days, average mood {stats['avg_mood']:.1f}/5, mood check-ins by mood: {stats['mood_distribution'] or 'none'}.
+
+Write a {label}ly review. Return ONLY valid JSON: {{"bullets": ["...", "..."], "tips": ["..."]}}.
+- 3 to 5 bullets, each one short sentence (max ~25 words) about a pattern, change over the {label} or takeaway.
+- Friendly and encouraging, not clinical; no raw statistics in the text.
+- tips is optional, at most 2 very short practical suggestions.
+
+JSON:
+"""
+        result = await call_llm(
+            [
+                {"role": "system", "content": "You are a compassionate mental health assistant. "
+                                              "Always use positive, encouraging, supportive language."},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.7,
+            max_tokens=400,
+            priority="summary"
+        )
+        text = (result.get("text") or "").strip()
+        return self.generator._post_process(text) if text else ""
+
+    @staticmethod
+    def _rule_based(period: str, stats: Dict[str, Any]) -> str:
+        label = "Weekly" if period == "weekly" else "Monthly"
+        summary = (f"{label} Review: You recorded {stats['entry_count']} journal entries "
+                   f"and {stats['mood_count']} mood check-ins. ")
+        if stats["mood_distribution"]:
+            mood, count = Counter(stats["mood_distribution"]).most_common(1)[0]
+            summary += f"Your most common mood was '{mood}' ({count} times). "
+        if stats["entry_count"]:
+            summary += "Reflecting on your journal entries shows consistent engagement with your thoughts and feelings. "
+        return summary + "Keep up the good work in your self-care journey!"
+
+    @staticmethod
+    def _response(period: str, start_day: datetime, end_day: datetime, summary: str, stats: Dict[str, Any],
+                  generated_at: datetime, kind: str) -> Dict[str, Any]:
+        return {
+            "summary": summary,
+            "period": {
+                "type": period,
+                "start": start_day.isoformat(),
+                "end": (end_day + timedelta(days=1) - timedelta(microseconds=1)).isoformat()
+            },
+            "stats": stats,
+            "generated_at": generated_at.isoformat(),
+            "type": kind,
+        }
+
+period_summary_service = PeriodSummaryService()
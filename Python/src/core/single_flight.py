@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from fastapi.encoders import jsonable_encoder
+from src.config import settings
+from src.database.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """
+    Gộp các request giống hệt nhau đang chạy đồng thời (cùng user, cùng tham số)
+    thành một lần tính toán duy nhất.
+
+    - In-process: các coroutine cùng key chờ chung một asyncio.Task.
+    - Cross-worker (tuỳ chọn): worker giữ Redis lock tính toán rồi ghi kết quả,
+      các worker khác đọc lại kết quả đó thay vì gọi model/LLM lần nữa.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def make_key(name: str, params: Dict[str, Any]) -> str:
+        """Tạo key ổn định từ tên endpoint và tham số request."""
+        raw = json.dumps(params, sort_keys=True, default=str)
+        return f"singleflight:{name}:{hashlib.md5(raw.encode()).hexdigest()}"
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Chạy fn() một lần cho mọi caller đồng thời có cùng key."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.debug(f"Single-flight hit for {key}")
+
+        # shield: một caller bị huỷ (client ngắt kết nối) không huỷ kết quả của caller khác
+        return await asyncio.shield(task)
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not settings.single_flight_distributed or not redis_client.client:
+            return await fn()
+        return await self._run_distributed(key, fn)
+
+    async def _run_distributed(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        lock_key = f"{key}:lock"
+        result_key = f"{key}:result"
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.single_flight_wait_timeout
+
+        while loop.time() < deadline:
+            token = await redis_client.acquire_lock(lock_key, settings.single_flight_lock_ttl)
+            if token:
+                try:
+                    # Bỏ kết quả của lượt trước để waiter không đọc nhầm dữ liệu cũ
+                    await redis_client.delete(result_key)
+                    result = await fn()
+                    # Chia sẻ kết quả dạng JSON cho các worker đang chờ
+                    await redis_client.set(
+                        result_key,
+                        {"value": jsonable_encoder(result)},
+                        expire=settings.single_flight_result_ttl
+                    )
+                    return result
+                finally:
+                    await redis_client.release_lock(lock_key, token)
+
+            # Worker khác đang tính: chờ kết quả hoặc tới khi lock được nhả
+            while loop.time() < deadline:
+                await asyncio.sleep(settings.single_flight_poll_interval)
+                shared = await redis_client.get(result_key)
+                if isinstance(shared, dict) and "value" in shared:
+                    logger.debug(f"Single-flight shared result for {key}")
+                    return shared["value"]
+                if not await redis_client.exists(lock_key):
+                    break
+
+        logger.warning(f"Single-flight wait timed out for {key}, computing locally")
+        return await fn()
+
+single_flight = SingleFlight()
@@ -47,7 +47,7 @@ class SummarizationService:
                 {"role": "system", "content": "You are an expert summarizer. Provide a concise, meaningful summary."},
                 {"role": "user", "content": prompt}
             ]
-            result = await call_llm(messages, temperature=0.5)
+            result = await call_llm(messages, temperature=0.5, priority="summary")
             if result.get("text"):
                 return result["text"]
             return self._fallback_summarize(text, ratio)
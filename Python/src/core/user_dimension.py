@@ -0,0 +1,117 @@
+import calendar
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+
+from src.database import mongodb
+
+logger = logging.getLogger(__name__)
+
+MS_PER_YEAR = 365 * 24 * 60 * 60 * 1000
+
+def age_bucket_expr(age_field: str = "$age") -> dict:
+    """Biểu thức aggregation: tuổi -> nhóm tuổi"""
+    return {"$cond": [
+        {"$eq": [{"$ifNull": [age_field, None]}, None]},
+        "unknown",
+        {"$switch": {
+            "branches": [
+                {"case": {"$lt": [age_field, 18]}, "then": "0-17"},
+                {"case": {"$lt": [age_field, 25]}, "then": "18-24"},
+                {"case": {"$lt": [age_field, 35]}, "then": "25-34"},
+                {"case": {"$lt": [age_field, 50]}, "then": "35-49"},
+            ],
+            "default": "50+",
+        }},
+    ]}
+
+def _dimension_stages(as_of: datetime) -> List[dict]:
+    """users -> {_id: uid string, age_group, birthday} (age hoặc dateOfBirth tại as_of)"""
+    return [
+        {"$addFields": {"dob": {"$ifNull": ["$dateOfBirth", "$date_of_birth"]}}},
+        {"$addFields": {"computed_age": {"$ifNull": ["$age", {"$cond": {
+            "if": {"$ifNull": ["$dob", False]},
+            "then": {"$floor": {"$divide": [{"$subtract": [as_of, "$dob"]}, MS_PER_YEAR]}},
+            "else": None,
+        }}]}}},
+        {"$project": {
+            "_id": {"$toString": "$_id"},
+            "age_group": age_bucket_expr("$computed_age"),
+            "birthday": {"$cond": [
+                {"$ifNull": ["$dob", False]},
+                {"$dateToString": {"format": "%m-%d", "date": "$dob"}},
+                None,
+            ]},
+            "updated_at": as_of,
+        }},
+    ]
+
+class UserDimensionService:
+    """
+    Bảng chiều user -> nhóm tuổi (collection nhỏ user_dimensions, _id = user id dạng string).
+    Analytics join vào đây thay vì tính tuổi từ users mỗi request.
+    """
+
+    collection_name = "user_dimensions"
+
+    async def _merge(self, match: Optional[dict] = None) -> int:
+        """Tính nhóm tuổi trên server và $merge vào user_dimensions"""
+        db = mongodb.get_db()
+        now = datetime.utcnow()
+        pipeline = ([{"$match": match}] if match else []) + _dimension_stages(now) + [
+            {"$merge": {"into": self.collection_name, "on": "_id",
+                        "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ]
+        await db.users.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+        return await db[self.collection_name].count_documents({"updated_at": now})
+
+    async def upsert_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Cập nhật một user (khi tạo mới / sửa hồ sơ). Xóa khỏi bảng nếu user không còn."""
+        db = mongodb.get_db()
+        try:
+            oid = ObjectId(user_id)
+        except Exception:
+            return None
+
+        if await self._merge({"_id": oid}) == 0:
+            await self.remove_user(user_id)
+            return None
+        return await db[self.collection_name].find_one({"_id": str(user_id)})
+
+    async def remove_user(self, user_id: str):
+        db = mongodb.get_db()
+        await db[self.collection_name].delete_one({"_id": str(user_id)})
+
+    async def rebuild_all(self) -> int:
+        """Backfill toàn bộ (lần đầu triển khai / sửa dữ liệu)"""
+        count = await self._merge()
+        logger.info(f"User dimension rebuilt: {count} users")
+        return count
+
+    async def rebucket_birthdays(self, today: Optional[datetime] = None) -> int:
+        """Chạy mỗi ngày: chỉ tính lại những user có sinh nhật hôm nay"""
+        today = today or datetime.utcnow()
+        birthdays = [today.strftime("%m-%d")]
+        # Sinh nhật 29/02 được tính vào 01/03 ở năm không nhuận
+        if birthdays[0] == "03-01" and not calendar.isleap(today.year):
+            birthdays.append("02-29")
+
+        db = mongodb.get_db()
+        ids = await db[self.collection_name].distinct("_id", {"birthday": {"$in": birthdays}})
+        oids = [ObjectId(i) for i in ids if ObjectId.is_valid(i)]
+        if not oids:
+            return 0
+        count = await self._merge({"_id": {"$in": oids}})
+        logger.info(f"User dimension re-bucketed {count} birthdays")
+        return count
+
+    async def run_daily(self) -> Dict[str, Any]:
+        """Job hằng ngày: backfill nếu bảng rỗng, ngược lại chỉ re-bucket sinh nhật"""
+        db = mongodb.get_db()
+        if await db[self.collection_name].estimated_document_count() == 0:
+            return {"mode": "rebuild", "users": await self.rebuild_all()}
+        return {"mode": "birthdays", "users": await self.rebucket_birthdays()}
+
+user_dimension = UserDimensionService()
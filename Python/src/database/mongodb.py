@@ -68,6 +68,20 @@ class MongoDB:
         # AI interactions indexes
         await db.ai_interactions.create_index([("user_id", 1), ("created_at", -1)])
         await db.ai_interactions.create_index([("type", 1)])
+
+        # Daily summaries (nightly batch tính sẵn + đọc cache theo user/ngày)
+        await db.daily_summaries.create_index([("user_id", 1), ("date", 1)])
+        await db.daily_summaries.create_index([("date", 1)])
+        await db.journal_entries.create_index([("created_at", 1)])
+        await db.period_summaries.create_index([("user_id", 1), ("period", 1), ("end", 1)], unique=True)
+
+        # Mood forecasts (nightly batch)
+        await db.mood_forecasts.create_index([("user_id", 1)], unique=True)
+
+        # Admin analytics daily cube
+        await db.insight_daily_cube.create_index([("date", 1), ("age_group", 1)], unique=True)
+        await db.insight_cube_days.create_index([("date", 1)], unique=True)
+        await db.user_dimensions.create_index([("birthday", 1)])
         
         logger.info("MongoDB indexes created")
     
@@ -2,10 +2,19 @@ import redis.asyncio as redis
 from typing import Any, Optional, Union
 import json
 import logging
+import uuid
 from src.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Compare-and-delete so a worker never releases a lock it no longer owns
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
 class RedisClient:
     """Async Redis client with connection pooling"""
     
@@ -103,6 +112,70 @@ class RedisClient:
             logger.error(f"Redis HSET error: {e}")
             return False
     
+    async def sadd(self, key: str, *members) -> int:
+        """Add members to a set"""
+        try:
+            return await self.client.sadd(key, *members)
+        except Exception as e:
+            logger.error(f"Redis SADD error: {e}")
+            return 0
+
+    async def spop(self, key: str, count: int) -> list:
+        """Pop up to count members from a set"""
+        try:
+            return await self.client.spop(key, count) or []
+        except Exception as e:
+            logger.error(f"Redis SPOP error: {e}")
+            return []
+
+    async def setnx(self, key: str, value: Any) -> bool:
+        """Set value only if key does not exist"""
+        try:
+            return bool(await self.client.set(key, value, nx=True))
+        except Exception as e:
+            logger.error(f"Redis SETNX error: {e}")
+            return False
+
+    async def pfadd(self, key: str, *values, expire: Optional[int] = None) -> bool:
+        """Add values to a HyperLogLog"""
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.pfadd(key, *values)
+                if expire:
+                    pipe.expire(key, expire)
+                results = await pipe.execute()
+            return bool(results[0])
+        except Exception as e:
+            logger.error(f"Redis PFADD error: {e}")
+            return False
+
+    async def pfcount(self, *keys) -> Optional[int]:
+        """Approximate cardinality of the union of HyperLogLogs"""
+        try:
+            return await self.client.pfcount(*keys)
+        except Exception as e:
+            logger.error(f"Redis PFCOUNT error: {e}")
+            return None
+
+    async def acquire_lock(self, key: str, expire: int) -> Optional[str]:
+        """Try to acquire a lock (SET NX EX), return owner token if acquired"""
+        try:
+            token = uuid.uuid4().hex
+            if await self.client.set(key, token, nx=True, ex=expire):
+                return token
+            return None
+        except Exception as e:
+            logger.error(f"Redis LOCK error: {e}")
+            return None
+
+    async def release_lock(self, key: str, token: str) -> bool:
+        """Release a lock only if it is still owned by token"""
+        try:
+            return bool(await self.client.eval(_RELEASE_LOCK_SCRIPT, 1, key, token))
+        except Exception as e:
+            logger.error(f"Redis UNLOCK error: {e}")
+            return False
+
     async def hget(self, key: str, field: str) -> Optional[Any]:
         """Get hash field"""
         try:
@@ -117,5 +190,63 @@ class RedisClient:
             logger.error(f"Redis HGET error: {e}")
             return None
 
+    async def hgetall(self, key: str) -> dict:
+        """Get all hash fields (raw strings)"""
+        try:
+            return await self.client.hgetall(key) or {}
+        except Exception as e:
+            logger.error(f"Redis HGETALL error: {e}")
+            return {}
+
+    async def hincrby(self, key: str, field: str, amount: int = 1, expire: Optional[int] = None) -> int:
+        """Increment hash field"""
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.hincrby(key, field, amount)
+                if expire:
+                    pipe.expire(key, expire)
+                results = await pipe.execute()
+            return results[0]
+        except Exception as e:
+            logger.error(f"Redis HINCRBY error: {e}")
+            return 0
+
+    async def rpush(self, key: str, *values, expire: Optional[int] = None) -> int:
+        """Append values (dict/list are JSON encoded) to a list"""
+        try:
+            values = [json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v for v in values]
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.rpush(key, *values)
+                if expire:
+                    pipe.expire(key, expire)
+                results = await pipe.execute()
+            return results[0]
+        except Exception as e:
+            logger.error(f"Redis RPUSH error: {e}")
+            return 0
+
+    async def lrange(self, key: str, start: int, end: int) -> list:
+        """Get list range, JSON-decoding items when possible"""
+        try:
+            items = await self.client.lrange(key, start, end)
+        except Exception as e:
+            logger.error(f"Redis LRANGE error: {e}")
+            return []
+        result = []
+        for item in items:
+            try:
+                result.append(json.loads(item))
+            except json.JSONDecodeError:
+                result.append(item)
+        return result
+
+    async def ltrim(self, key: str, start: int, end: int) -> bool:
+        """Trim list to range"""
+        try:
+            return bool(await self.client.ltrim(key, start, end))
+        except Exception as e:
+            logger.error(f"Redis LTRIM error: {e}")
+            return False
+
 # Global Redis client instance
 redis_client = RedisClient()
\ No newline at end of file
@@ -140,6 +140,23 @@ class VectorStore:
         except Exception as e:
             logger.error(f"Failed to delete from vector store: {e}")
     
+    async def get_all(self, collection_name: str) -> Dict[str, Any]:
+        """Lấy toàn bộ documents + metadatas + embeddings (cho collection nhỏ)"""
+        try:
+            collection = self.get_collection(collection_name, create=False)
+            return collection.get(include=["documents", "metadatas", "embeddings"])
+        except Exception as e:
+            logger.error(f"Failed to load collection {collection_name}: {e}")
+            return {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+
+    async def reset_collection(self, collection_name: str):
+        """Xóa collection (để seed lại)"""
+        try:
+            self.client.delete_collection(name=collection_name)
+        except Exception as e:
+            logger.warning(f"Failed to delete collection {collection_name}: {e}")
+        self.collections.pop(collection_name, None)
+
     def get_stats(self, collection_name: str) -> Dict[str, Any]:
         """Get collection statistics"""
         try:
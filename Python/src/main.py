@@ -11,6 +11,7 @@ from src.core.embeddings import embedding_service
 from src.core.sentiment import sentiment_analyzer
 from src.core.summarization import summarization_service
 from src.core.cbt_knowledge import cbt_kb
+from src.core.llm_clients import llm_clients
 
 os.makedirs(settings.logs_dir, exist_ok=True)
 
@@ -57,6 +58,7 @@ async def lifespan(app: FastAPI):
         await mongodb.disconnect()
         await redis_client.disconnect()
         await vector_store.disconnect()
+        await llm_clients.close()
         logger.info("Shutdown complete")
 
 # Create FastAPI app
@@ -86,6 +86,7 @@ class ChatMessageRequest(BaseModel):
     session_state: Dict[str, Any]
     user_context: Dict[str, Any]
     recent_messages: Optional[List[Dict[str, Any]]] = None
+    deadline_ms: Optional[int] = None  # ngân sách còn lại của caller cho lượt chat
 
 class SentimentRequest(BaseModel):
     text: str
@@ -99,6 +100,7 @@ class ChatMessageResponse(BaseModel):
     technique: Optional[str] = None
     exercise: Optional[str] = None
     next_state: str
+    metadata: Optional[Dict] = None  # timings_ms theo stage
 
 class ChatSessionCreate(BaseModel):
     user_id: str
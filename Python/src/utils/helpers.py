@@ -1,9 +1,12 @@
 import re
 import json
+import time
+import asyncio
 import hashlib
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
 import numpy as np
+from scipy import stats
 
 def clean_text(text: str) -> str:
     """
@@ -156,6 +159,53 @@ def detect_anomalies(values: List[float], threshold: float = 2.0) -> List[bool]:
     z_scores = [(x - mean) / std for x in values]
     return [abs(z) > threshold for z in z_scores]
 
+def downsample_lttb(values: List[float], max_points: int) -> List[int]:
+    """
+    Downsample a time series with Largest-Triangle-Three-Buckets
+
+    Args:
+        values: List of values (evenly spaced)
+        max_points: Maximum number of points to keep
+
+    Returns:
+        Sorted indices of the points to keep (first and last are always kept)
+    """
+    n = len(values)
+    if max_points >= n or n <= 2:
+        return list(range(n))
+    if max_points < 3:
+        return [0, n - 1][:max(max_points, 1)]
+
+    y = np.asarray(values, dtype=float)
+    x = np.arange(n, dtype=float)
+
+    # Middle points are split into (max_points - 2) buckets
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+
+    selected = [0]
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Average of the next bucket (or the last point) is the third vertex
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+
+        # Pick the point forming the largest triangle with a and the next average
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected.append(a)
+
+    selected.append(n - 1)
+    return selected
+
 def format_date_range(start_date: datetime, end_date: datetime) -> str:
     """
     Format date range for display
@@ -259,4 +309,116 @@ def calculate_percent_change(old_value: float, new_value: float) -> float:
     if old_value == 0:
         return 0 if new_value == 0 else 100
     
-    return ((new_value - old_value) / abs(old_value)) * 100
\ No newline at end of file
+    return ((new_value - old_value) / abs(old_value)) * 100
+
+
+def pearson_from_moments(
+    n: float,
+    sum_x: float,
+    sum_y: float,
+    sum_xx: float,
+    sum_yy: float,
+    sum_xy: float
+) -> Optional[tuple]:
+    """
+    Pearson correlation from additive moments (so partial aggregates can be merged)
+    
+    Args:
+        n: Number of (x, y) observations
+        sum_x, sum_y: Sums of x and y
+        sum_xx, sum_yy: Sums of squares
+        sum_xy: Sum of cross products
+    
+    Returns:
+        (r, two-sided p-value), or None if undefined
+    """
+    if n < 3:
+        return None
+    cov = n * sum_xy - sum_x * sum_y
+    var_x = n * sum_xx - sum_x ** 2
+    var_y = n * sum_yy - sum_y ** 2
+    if var_x <= 0 or var_y <= 0:
+        return None
+
+    r = float(np.clip(cov / np.sqrt(var_x * var_y), -1.0, 1.0))
+    if abs(r) == 1.0:
+        return r, 0.0
+    t = r * np.sqrt((n - 2) / (1 - r ** 2))
+    return r, float(2 * stats.t.sf(abs(t), n - 2))
+
+async def gather_with_deadline(
+    factories: Dict[str, Callable[[], Awaitable[Any]]],
+    timeout: float,
+    limit: int = 4
+) -> tuple:
+    """
+    Run independent coroutines concurrently with bounded parallelism and an overall deadline
+    
+    Args:
+        factories: name -> zero-arg coroutine factory
+        timeout: Overall deadline in seconds
+        limit: Maximum number running at the same time
+    
+    Returns:
+        (results, timings_ms, errors) keyed by name; tasks still running at the
+        deadline are cancelled and reported as "timeout" in errors
+    """
+    semaphore = asyncio.Semaphore(limit)
+    timings: Dict[str, float] = {}
+
+    async def run(name: str, factory: Callable[[], Awaitable[Any]]):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                return await factory()
+            finally:
+                timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    tasks = {name: asyncio.create_task(run(name, factory)) for name, factory in factories.items()}
+    if not tasks:
+        return {}, {}, {}
+    _, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    results, errors = {}, {}
+    for name, task in tasks.items():
+        if task in pending:
+            errors[name] = "timeout"
+        elif task.exception() is not None:
+            errors[name] = str(task.exception()) or type(task.exception()).__name__
+        else:
+            results[name] = task.result()
+    return results, timings, errors
+
+def masked_top_k(
+    matrix: np.ndarray,
+    query: np.ndarray,
+    mask: Optional[np.ndarray],
+    k: int
+) -> List[tuple]:
+    """
+    Top-k rows by dot product, restricted to rows where mask is True
+    
+    Args:
+        matrix: (n, d) row-normalized embeddings
+        query: (d,) normalized query embedding
+        mask: (n,) boolean filter, or None for all rows
+        k: Number of results
+    
+    Returns:
+        [(row index, score)] sorted by descending score
+    """
+    scores = matrix @ query
+    candidates = int(mask.sum()) if mask is not None else len(scores)
+    k = min(k, candidates)
+    if k <= 0:
+        return []
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(i), float(scores[i])) for i in top]
@@ -0,0 +1,44 @@
+import re
+import unicodedata
+
+from src.core.crisis_detection import (
+    ENGLISH_PATTERNS, VIETNAMESE_PATTERNS, detect_crisis, scan_batch, scan_crisis
+)
+
+def legacy_detect(text):
+    text_lower = text.lower()
+    if any(re.search(p, text_lower) for p in VIETNAMESE_PATTERNS):
+        return True, "vi"
+    if any(re.search(p, text_lower) for p in ENGLISH_PATTERNS):
+        return True, "en"
+    return False, ""
+
+SAMPLES = [
+    "Hôm nay mình đi dạo công viên, thấy khá thư thái.",
+    "Tôi muốn chết, không ai hiểu tôi cả.",
+    "Có lúc mình chỉ muốn buông xuôi tất cả.",
+    "I want to die and there is no reason to live.",
+    "I cut vegetables for dinner tonight.",
+    "Thinking about how to take my own life.",
+    "Work was stressful but I'm okay.",
+]
+
+def test_compiled_matcher_agrees_with_legacy_loop():
+    for text in SAMPLES:
+        crisis, _, language = detect_crisis(text)
+        assert (crisis, language) == legacy_detect(text), text
+
+def test_reports_highest_severity_rule():
+    result = scan_crisis("I might cut myself, I want to die")
+    assert result["rule"] == "en_want_die"
+    assert result["severity"] == 9
+    assert result["language"] == "en"
+
+def test_decomposed_vietnamese_diacritics_match():
+    text = unicodedata.normalize("NFD", "Em tự tử mất thôi")
+    assert scan_crisis(text)["rule"] == "vi_self_intent"
+
+def test_scan_batch():
+    results = scan_batch(["All good today", "kết thúc cuộc đời này"])
+    assert results[0] is None
+    assert results[1]["rule"] == "vi_end_life"
@@ -0,0 +1,44 @@
+import asyncio
+
+from src.core.data_version import data_version
+from src.database.redis_client import redis_client
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+
+    async def get(self, key):
+        return self.store.get(key)
+
+    async def set(self, key, value, nx=False):
+        if nx and key in self.store:
+            return None
+        self.store[key] = str(value)
+        return True
+
+    async def setex(self, key, ttl, value):
+        self.store[key] = value
+        return True
+
+    async def incr(self, key):
+        self.store[key] = str(int(self.store.get(key, 0)) + 1)
+        return int(self.store[key])
+
+def test_version_is_unknown_without_redis(monkeypatch):
+    monkeypatch.setattr(redis_client, "client", None)
+    assert asyncio.run(data_version.get("u1")) is None
+
+def test_version_after_eviction_does_not_repeat(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(redis_client, "client", fake)
+
+    async def main():
+        first = await data_version.bump("u1")
+        fake.store.clear()  # key bị evict
+        await asyncio.sleep(0.01)
+        second = await data_version.bump("u1")
+        return first, second, await data_version.get("u1")
+
+    first, second, current = asyncio.run(main())
+    assert second != first
+    assert current == second
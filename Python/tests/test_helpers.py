@@ -0,0 +1,73 @@
+import asyncio
+
+import numpy as np
+from scipy import stats
+
+from src.utils.helpers import downsample_lttb, pearson_from_moments, gather_with_deadline, masked_top_k
+
+def test_downsample_lttb_keeps_short_series():
+    """Series shorter than max_points is returned untouched"""
+    values = [0.1, -0.2, 0.3]
+    assert downsample_lttb(values, 10) == [0, 1, 2]
+
+def test_downsample_lttb_bounds_and_endpoints():
+    """Downsampled series respects max_points and keeps first/last day"""
+    values = [((i * 37) % 11 - 5) / 5 for i in range(365)]
+    indices = downsample_lttb(values, 60)
+    assert len(indices) == 60
+    assert indices[0] == 0
+    assert indices[-1] == 364
+    assert indices == sorted(set(indices))
+
+def test_downsample_lttb_preserves_extremes():
+    """A single sharp dip survives downsampling"""
+    values = [0.5] * 200
+    values[123] = -1.0
+    indices = downsample_lttb(values, 20)
+    assert 123 in indices
+
+def test_pearson_from_moments_matches_scipy():
+    """Merged moments from two partials give the same r/p as scipy on the raw data"""
+    rng = np.random.default_rng(1)
+    x = rng.integers(0, 6, 40).astype(float)
+    y = 0.1 * x + rng.normal(0, 0.3, 40)
+
+    def moments(xs, ys):
+        return np.array([len(xs), xs.sum(), ys.sum(), (xs * xs).sum(), (ys * ys).sum(), (xs * ys).sum()])
+
+    merged = moments(x[:15], y[:15]) + moments(x[15:], y[15:])
+    r, p = pearson_from_moments(*merged)
+    expected_r, expected_p = stats.pearsonr(x, y)
+    assert abs(r - expected_r) < 1e-9
+    assert abs(p - expected_p) < 1e-9
+
+def test_pearson_from_moments_undefined_for_constant_series():
+    assert pearson_from_moments(5, 5, 2, 5, 1, 2) is None
+
+def test_gather_with_deadline_reports_partial_results():
+    """Slow tasks are cancelled at the deadline; finished ones are still returned"""
+    async def value(v, delay=0.0):
+        await asyncio.sleep(delay)
+        return v
+
+    async def boom():
+        raise RuntimeError("bad pipeline")
+
+    results, timings, errors = asyncio.run(gather_with_deadline({
+        "fast": lambda: value(1),
+        "slow": lambda: value(2, delay=5),
+        "broken": boom,
+    }, timeout=0.2, limit=2))
+    assert results == {"fast": 1}
+    assert errors == {"slow": "timeout", "broken": "bad pipeline"}
+    assert set(timings) == {"fast", "slow", "broken"}
+
+def test_masked_top_k_respects_mask_and_order():
+    matrix = np.array([[1.0, 0.0], [0.8, 0.6], [0.0, 1.0], [0.6, 0.8]])
+    query = np.array([1.0, 0.0])
+    mask = np.array([False, True, True, True])
+
+    assert [i for i, _ in masked_top_k(matrix, query, mask, 2)] == [1, 3]
+    assert [i for i, _ in masked_top_k(matrix, query, None, 1)] == [0]
+    assert len(masked_top_k(matrix, query, mask, 10)) == 3
+    assert masked_top_k(matrix, query, np.zeros(4, dtype=bool), 3) == []
@@ -0,0 +1,31 @@
+from src.config import settings
+from src.core.llm_cache import LLMResponseCache
+
+MESSAGES = [{"role": "user", "content": "Remind Lan to drink water.\n  Return as JSON."}]
+
+def test_key_ignores_whitespace_and_buckets_temperature():
+    key = LLMResponseCache.key("openai", "gpt", MESSAGES, 0.7, 500)
+    spaced = [{"role": "user", "content": "  Remind Lan to drink   water. Return as JSON. "}]
+    assert LLMResponseCache.key("openai", "gpt", spaced, 0.71, 500) == key
+    assert LLMResponseCache.key("gemini", "flash", MESSAGES, 0.7, 500) != key
+    assert LLMResponseCache.key("openai", "gpt", MESSAGES, 0.2, 500) != key
+    assert LLMResponseCache.key("openai", "gpt", MESSAGES, 0.7, 100) != key
+
+def test_lru_evicts_oldest_and_expired_entries(monkeypatch):
+    monkeypatch.setattr(settings, "llm_cache_max_entries", 2)
+    cache = LLMResponseCache()
+    cache.set("a", "A", ttl=60)
+    cache.set("b", "B", ttl=60)
+    assert cache.get("a") == "A"  # a vừa được dùng -> b là cũ nhất
+    cache.set("c", "C", ttl=60)
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+
+    cache.set("d", "D", ttl=-1)
+    assert cache.get("d") is None
+
+def test_ttl_is_opt_in_per_call_site(monkeypatch):
+    monkeypatch.setitem(settings.llm_cache_ttl, "notifications", 600)
+    assert LLMResponseCache.ttl(None) == 0
+    assert LLMResponseCache.ttl("chat") == 0
+    assert LLMResponseCache.ttl("notifications") == 600
@@ -0,0 +1,54 @@
+import time
+
+from src.config import settings
+from src.core.llm_health import LLMHealthTable, classify_error
+
+class FakeStatusError(Exception):
+    def __init__(self, status_code, message=""):
+        super().__init__(message or f"Error code: {status_code}")
+        self.status_code = status_code
+
+def test_classify_rate_limit_with_retry_delay():
+    kind, retry_after = classify_error(Exception("429 RESOURCE_EXHAUSTED. Please retry in 7.5s."))
+    assert kind == "rate_limited"
+    assert retry_after == 7.5
+
+def test_not_found_model_is_skipped_for_long_cooldown():
+    table = LLMHealthTable()
+    table.record_failure("gemini:old-model", FakeStatusError(404))
+    assert not table.is_available("gemini:old-model")
+    assert table.snapshot()["gemini:old-model"]["cooldown_remaining_s"] > settings.llm_breaker_cooldown
+
+def test_breaker_opens_after_consecutive_failures_then_allows_one_probe():
+    table = LLMHealthTable()
+    key = "openai:gpt"
+    for _ in range(settings.llm_breaker_failure_threshold - 1):
+        table.record_failure(key, FakeStatusError(500))
+    assert table.try_acquire(key)
+
+    table.record_failure(key, FakeStatusError(500))
+    assert not table.try_acquire(key)
+
+    # Hết cooldown -> half-open: chỉ một request thử
+    table._entry(key)["open_until"] = time.time() - 1
+    assert table.try_acquire(key)
+    assert not table.try_acquire(key)
+    table.record_success(key, 120.0)
+    assert table.try_acquire(key)
+
+def test_rank_prefers_fastest_healthy_model():
+    table = LLMHealthTable()
+    table.record_success("openai:gpt", 2500.0)
+    table.record_success("gemini:flash", 800.0)
+    table.record_failure("gemini:pro", FakeStatusError(429))
+    assert table.rank(["openai:gpt", "gemini:flash", "gemini:pro", "gemini:lite"]) == [
+        "gemini:flash", "openai:gpt", "gemini:lite"
+    ]
+
+def test_fits_budget_uses_measured_latency():
+    table = LLMHealthTable()
+    assert table.fits_budget("gemini:flash", settings.llm_min_attempt_time)
+    assert not table.fits_budget("gemini:flash", settings.llm_min_attempt_time / 2)
+    table.record_success("gemini:flash", 4000.0)
+    assert not table.fits_budget("gemini:flash", 3.0)
+    assert table.fits_budget("gemini:flash", 5.0)
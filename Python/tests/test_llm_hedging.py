@@ -0,0 +1,52 @@
+import asyncio
+
+from src.config import settings
+from src.core import llm
+from src.core.llm_health import LLMHealthTable
+
+def _setup(monkeypatch, delays):
+    """Hai model giả: mỗi model trả lời sau delays[model] giây"""
+    table = LLMHealthTable()
+    cancelled = []
+
+    async def fake_call(provider, model, messages, temperature, max_tokens, timeout=None):
+        try:
+            await asyncio.sleep(delays[model])
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return f"answer from {model}"
+
+    monkeypatch.setattr(llm, "llm_health", table)
+    monkeypatch.setattr(llm, "_candidates", lambda: {"openai:slow": ("openai", "slow"), "gemini:fast": ("gemini", "fast")})
+    monkeypatch.setattr(llm, "_call_provider", fake_call)
+    monkeypatch.setattr(settings, "llm_hedge_default_delay", 0.05)
+    monkeypatch.setattr(settings, "llm_hedge_min_delay", 0.01)
+    monkeypatch.setattr(settings, "llm_min_attempt_time", 0.0)
+    return cancelled, table
+
+def test_hedged_call_takes_first_answer_and_cancels_the_other(monkeypatch):
+    cancelled, _ = _setup(monkeypatch, {"slow": 1.0, "fast": 0.01})
+    result = asyncio.run(llm.call_llm([{"role": "user", "content": "hi"}], hedge=True))
+    assert result["text"] == "answer from fast"
+    assert cancelled == ["slow"]
+
+def test_deadline_returns_empty_for_rule_based_fallback(monkeypatch):
+    cancelled, _ = _setup(monkeypatch, {"slow": 1.0, "fast": 1.0})
+    result = asyncio.run(llm.call_llm([{"role": "user", "content": "hi"}], hedge=True, deadline=0.2))
+    assert result["text"] == ""
+    assert sorted(cancelled) == ["fast", "slow"]
+
+def test_models_too_slow_for_remaining_budget_are_skipped(monkeypatch):
+    cancelled, table = _setup(monkeypatch, {"slow": 0.01, "fast": 0.01})
+    table.record_success("gemini:fast", 50.0)
+    table.record_success("openai:slow", 5000.0)
+    result = asyncio.run(llm.call_llm([{"role": "user", "content": "hi"}], deadline=1.0))
+    assert result["text"] == "answer from fast"
+
+    # Không model nào kịp trong ngân sách -> trả rỗng ngay, không gọi provider
+    for _ in range(10):
+        table.record_success("gemini:fast", 5000.0)
+    result = asyncio.run(llm.call_llm([{"role": "user", "content": "hi"}], deadline=1.0))
+    assert result["text"] == ""
+    assert cancelled == []
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from src.config import settings
+from src.core.llm_scheduler import LLMOverloaded, LLMScheduler
+
+def test_waiting_chat_is_served_before_notifications(monkeypatch):
+    monkeypatch.setitem(settings.llm_max_concurrency, "test", 1)
+    scheduler = LLMScheduler()
+    order = []
+
+    async def call(priority, hold):
+        async with scheduler.slot("test", priority, 10):
+            order.append(priority)
+            await asyncio.sleep(hold)
+
+    async def main():
+        first = asyncio.create_task(call("summary", 0.05))
+        await asyncio.sleep(0.01)
+        queued = [asyncio.create_task(call("notifications", 0)), asyncio.create_task(call("chat", 0))]
+        await asyncio.gather(first, *queued)
+
+    asyncio.run(main())
+    assert order == ["summary", "chat", "notifications"]
+    assert scheduler.metrics()["priorities"]["chat"]["admitted"] == 1
+
+def test_low_priority_is_shed_when_tpm_share_is_used(monkeypatch):
+    monkeypatch.setitem(settings.llm_tpm_budget, "test", 1000)
+    monkeypatch.setitem(settings.llm_queue_timeout, "notifications", 0.01)
+    scheduler = LLMScheduler()
+
+    async def main():
+        async with scheduler.slot("test", "chat", 600):
+            pass
+        # notifications chỉ được dùng 50% TPM -> phải chờ rồi bị shed
+        with pytest.raises(LLMOverloaded):
+            async with scheduler.slot("test", "notifications", 100):
+                pass
+        # chat vẫn còn ngân sách
+        async with scheduler.slot("test", "chat", 300):
+            pass
+
+    asyncio.run(main())
+    assert scheduler.metrics()["priorities"]["notifications"]["timed_out"] == 1
+
+def test_cancelled_queued_attempt_releases_half_open_probe(monkeypatch):
+    from src.core import llm
+    from src.core.llm_health import LLMHealthTable
+
+    monkeypatch.setitem(settings.llm_max_concurrency, "test", 1)
+    table, scheduler = LLMHealthTable(), LLMScheduler()
+    monkeypatch.setattr(llm, "llm_health", table)
+    monkeypatch.setattr(llm, "llm_scheduler", scheduler)
+
+    key = "test:model"
+    table.record_failure(key, Exception("boom"))
+    table._entry(key)["open_until"] = 1.0  # hết cooldown -> half-open
+    assert table.try_acquire(key)
+
+    async def main():
+        async with scheduler.slot("test", "chat", 10):
+            attempt = asyncio.create_task(
+                llm._attempt(key, "test", "model", [{"role": "user", "content": "hi"}], 0.7, 10, "chat")
+            )
+            await asyncio.sleep(0.01)  # đang chờ slot
+            attempt.cancel()
+            await asyncio.gather(attempt, return_exceptions=True)
+
+    asyncio.run(main())
+    assert table.try_acquire(key)
+
+def _half_open_stream_setup(monkeypatch, chunks):
+    from src.core import llm
+    from src.core.llm_health import LLMHealthTable
+
+    table = LLMHealthTable()
+    monkeypatch.setattr(llm, "llm_health", table)
+    monkeypatch.setattr(llm, "_candidates", lambda: {"test:model": ("test", "model")})
+
+    async def fake_stream(provider, model, messages, temperature, max_tokens):
+        for chunk in chunks:
+            await asyncio.sleep(0)
+            yield chunk
+
+    monkeypatch.setattr(llm, "_stream_provider", fake_stream)
+    table.record_failure("test:model", Exception("boom"))
+    table._entry("test:model")["open_until"] = 1.0  # hết cooldown -> half-open
+    return llm, table
+
+def test_stream_closed_by_consumer_settles_half_open_probe(monkeypatch):
+    llm, table = _half_open_stream_setup(monkeypatch, ["a", "b", "c"])
+
+    async def main():
+        stream = llm.stream_llm([{"role": "user", "content": "hi"}])
+        assert await stream.__anext__() == "a"
+        await stream.aclose()  # client ngắt kết nối giữa chừng
+
+    asyncio.run(main())
+    assert table.try_acquire("test:model")
+
+def test_cancelled_queued_stream_releases_half_open_probe(monkeypatch):
+    llm, table = _half_open_stream_setup(monkeypatch, ["a"])
+    monkeypatch.setitem(settings.llm_max_concurrency, "test", 1)
+    scheduler = LLMScheduler()
+    monkeypatch.setattr(llm, "llm_scheduler", scheduler)
+
+    async def consume():
+        async for _ in llm.stream_llm([{"role": "user", "content": "hi"}]):
+            pass
+
+    async def main():
+        async with scheduler.slot("test", "chat", 10):
+            task = asyncio.create_task(consume())
+            await asyncio.sleep(0.01)  # đang chờ slot
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert table.try_acquire("test:model")
@@ -0,0 +1,126 @@
+import asyncio
+from datetime import datetime
+
+from src.core import mood_anomaly
+from src.core.mood_anomaly import empty_state, update_state, evaluate, mood_anomaly_detector
+
+def _feed(scores):
+    state = empty_state()
+    for i, score in enumerate(scores):
+        update_state(state, f"2026-01-{i + 1:02d}", mood_score=score)
+    return state
+
+def test_no_flags_before_seven_days():
+    """Rules only kick in with 7 days of data, like analyze_trends"""
+    state = _feed([1.0, 0.5, 0.0, -0.5, -1.0, -1.0])
+    assert evaluate(state)["risk_flags"] == []
+
+def test_continuous_decline_streak():
+    """7 strictly decreasing daily scores raise continuous_negative_trend"""
+    state = _feed([1.0, 0.8, 0.6, 0.4, 0.2, 0.0, -0.2])
+    result = evaluate(state)
+    assert "continuous_negative_trend" in result["risk_flags"]
+    assert result["decline_streak"] == 6
+
+def test_mood_dip_against_seven_day_average():
+    """A >20% drop vs the 7-day average raises mood_dip_detected"""
+    state = _feed([0.5, 0.5, 0.5, 0.5, 0.5, 0.5, -1.0])
+    result = evaluate(state)
+    assert "mood_dip_detected" in result["risk_flags"]
+    assert "continuous_negative_trend" not in result["risk_flags"]
+
+def test_same_day_update_replaces_pending_score():
+    """Re-submitting a check-in on the same day does not advance the window"""
+    state = _feed([0.5] * 7)
+    update_state(state, "2026-01-07", mood_score=-1.0)
+    assert state["count"] == 6
+    assert "mood_dip_detected" in evaluate(state)["risk_flags"]
+    update_state(state, "2026-01-07", mood_score=0.5)
+    assert evaluate(state)["risk_flags"] == []
+
+def test_late_data_is_rejected():
+    """Data older than the current day cannot be folded in O(1)"""
+    state = _feed([0.0, 0.5])
+    assert update_state(state, "2026-01-01", mood_score=1.0) is False
+
+class _Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, *args):
+        return self
+
+    def limit(self, *args):
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs
+
+class _Collection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, *args):
+        return _Cursor(self.docs)
+
+class _DB:
+    def __init__(self, checkins, journals):
+        self.dailycheckins = _Collection(checkins)
+        self.journal_entries = _Collection(journals)
+
+class _FakeRedis:
+    """Đủ cho get/set/lock của redis_client; await giữa load và save để lộ race nếu không có lock"""
+    def __init__(self):
+        self.store = {}
+
+    async def get(self, key):
+        await asyncio.sleep(0)
+        return self.store.get(key)
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+
+    async def setex(self, key, ttl, value):
+        await asyncio.sleep(0)
+        self.store[key] = value
+        return True
+
+    async def eval(self, script, numkeys, key, token):
+        if self.store.get(key) == token:
+            del self.store[key]
+            return 1
+        return 0
+
+def test_rebuild_includes_journal_sentiment(monkeypatch):
+    """Journal sentiment is blended with the check-in of the same day (mood 0.6 + sentiment 0.4)"""
+    db = _DB(
+        checkins=[{"date": "2026-01-02", "mood": 5}, {"date": "2026-01-01", "mood": 3}],
+        journals=[{"created_at": datetime(2026, 1, 2, 9), "sentiment": {"score": -1.0}},
+                  {"created_at": datetime(2026, 1, 3, 9), "sentiment": {"score": 0.5}},
+                  {"created_at": datetime(2026, 1, 3, 10), "sentiment": None}],
+    )
+    monkeypatch.setattr(mood_anomaly.mongodb, "get_db", lambda: db)
+    state = asyncio.run(mood_anomaly_detector.rebuild("u1"))
+    assert state["count"] == 2
+    assert state["last_score"] == 1.0 * 0.6 + -1.0 * 0.4
+    assert state["today_date"] == "2026-01-03"
+    assert evaluate(state)["today_score"] == 0.5
+
+def test_concurrent_updates_do_not_lose_points(monkeypatch):
+    """Two events for the same day are both counted (load/update/save runs under the user lock)"""
+    fake = _FakeRedis()
+    monkeypatch.setattr(mood_anomaly.redis_client, "client", fake)
+    monkeypatch.setattr(mood_anomaly.mongodb, "get_db", lambda: _DB([], []))
+
+    async def main():
+        await asyncio.gather(
+            mood_anomaly_detector.update("u1", "2026-01-05", sentiment_score=0.2),
+            mood_anomaly_detector.update("u1", "2026-01-05", sentiment_score=0.4),
+        )
+        return await mood_anomaly_detector._load("u1")
+
+    state = asyncio.run(main())
+    assert state["today_sentiment_count"] == 2
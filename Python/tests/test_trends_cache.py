@@ -0,0 +1,40 @@
+import asyncio
+
+from src.api import trends
+
+def test_trends_skip_etag_when_data_version_unavailable(monkeypatch):
+    async def no_version(user_id):
+        return None
+
+    async def fresh_analysis(request):
+        return {"fresh": True}
+
+    monkeypatch.setattr(trends.data_version, "get", no_version)
+    monkeypatch.setattr(trends, "_run_trend_analysis", fresh_analysis)
+
+    request = trends.TrendAnalysisRequest(user_id="507f1f77bcf86cd799439011", days=30)
+    response = asyncio.run(trends.analyze_trends(request, if_none_match="*"))
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+    assert response.body == b'{"fresh":true}'
+
+def test_failed_insert_is_not_marked_saved(monkeypatch):
+    from tests.test_data_version import FakeRedis
+    monkeypatch.setattr(trends.redis_client, "client", FakeRedis())
+    fingerprint = trends.analysis_fingerprint({"trend": "stable"})
+
+    async def main():
+        assert await trends.analysis_changed("u1", 30, fingerprint)
+        # insert ai_interactions lỗi -> không gọi mark_analysis_saved -> lần sau vẫn cần lưu
+        assert await trends.analysis_changed("u1", 30, fingerprint)
+        await trends.mark_analysis_saved("u1", 30, fingerprint)
+        assert not await trends.analysis_changed("u1", 30, fingerprint)
+
+    asyncio.run(main())
+
+def test_fingerprint_ignores_presentation_fields():
+    content = {"trend": "stable", "stats": {"data_points": 30}}
+    charted = {"trend": "stable", "stats": {"data_points": 30, "downsampled_points": 12}}
+    assert trends.analysis_fingerprint(charted) == trends.analysis_fingerprint(content)
+    assert trends.analysis_fingerprint({"trend": "declining", "stats": {"data_points": 30}}) != \
+        trends.analysis_fingerprint(content)